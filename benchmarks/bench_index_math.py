@@ -0,0 +1,121 @@
+"""
+Benchmark the page / TOC arithmetic of page_index.py on synthetic large documents.
+
+Usage:
+    python benchmarks/bench_index_math.py [--items 5000] [--pages 20000] [--repeat 3]
+
+Compares the previous pure-Python loops with pageindex/index_math.py:
+  1. title matching between the TOC and its physical-index copy (extract_matching_page_pairs)
+  2. most common page offset (calculate_page_offset)
+  3. nearest valid physical_index before/after every entry (fix_incorrect_toc,
+     process_none_page_numbers), with 20% of the entries unknown
+  4. token count of every node's page range in a 3-level tree (process_large_node_recursively)
+and checks that both produce the same results. No LLM calls are made.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pageindex.index_math import PageTokenIndex, neighbor_valid_indices, match_titles, most_common_offset
+
+
+def legacy_match(toc_page, toc_physical_index):
+    pairs = []
+    for i, phy_item in enumerate(toc_physical_index):
+        for j, page_item in enumerate(toc_page):
+            if phy_item.get('title') == page_item.get('title'):
+                pairs.append((i, j))
+    return pairs
+
+
+def legacy_offset(differences):
+    difference_counts = {}
+    for diff in differences:
+        difference_counts[diff] = difference_counts.get(diff, 0) + 1
+    return max(difference_counts.items(), key=lambda x: x[1])[0]
+
+
+def legacy_neighbors(values, excluded):
+    prev_values, next_values = [], []
+    for index in range(len(values)):
+        prev_value = -1
+        for i in range(index - 1, -1, -1):
+            if i not in excluded and values[i] is not None:
+                prev_value = values[i]
+                break
+        next_value = -1
+        for i in range(index + 1, len(values)):
+            if i not in excluded and values[i] is not None:
+                next_value = values[i]
+                break
+        prev_values.append(prev_value)
+        next_values.append(next_value)
+    return prev_values, next_values
+
+
+def legacy_range_tokens(page_list, ranges):
+    return [sum([page[1] for page in page_list[start - 1:end]]) for start, end in ranges]
+
+
+def timed(name, func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:45s} {best * 1000:10.2f} ms")
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--pages', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    page_list = [('', rng.randint(200, 900)) for _ in range(args.pages)]
+    starts = sorted(rng.sample(range(1, args.pages + 1), args.items))
+    toc_page = [{'title': f'Section {i}', 'page': start - 12} for i, start in enumerate(starts)]
+    toc_physical_index = [{'title': f'Section {i}', 'physical_index': start}
+                          for i, start in enumerate(starts) if rng.random() < 0.9]
+    values = [start if rng.random() > 0.2 else None for start in starts]
+    excluded = set(rng.sample(range(args.items), args.items // 20))
+    # node ranges of a 3-level tree (chapters > sections > items): the same pages are
+    # summed again at every level, like the recursion over large nodes does
+    ranges = []
+    for step in (100, 10, 1):
+        level_starts = starts[::step]
+        ranges.extend(zip(level_starts, level_starts[1:] + [args.pages]))
+    differences = [start - item['page'] + rng.choice([0, 0, 0, 1, -1]) for start, item in zip(starts, toc_page)]
+
+    print(f"{args.items} TOC items, {args.pages} pages")
+    # built once per document in tree_parser
+    token_index, _ = timed('PageTokenIndex build (once per document)', lambda: PageTokenIndex(page_list), args.repeat)
+    speedups = []
+    for name, legacy, fast in [
+        ('title matching', lambda: legacy_match(toc_page, toc_physical_index),
+         lambda: match_titles(toc_physical_index, toc_page)),
+        ('page offset', lambda: legacy_offset(differences), lambda: most_common_offset(differences)),
+        ('prev/next valid index', lambda: legacy_neighbors(values, excluded),
+         lambda: tuple(a.tolist() for a in neighbor_valid_indices(values, excluded=excluded))),
+        ('node range tokens', lambda: legacy_range_tokens(page_list, ranges),
+         lambda: [token_index.range_tokens(s, e) for s, e in ranges]),
+    ]:
+        expected, legacy_time = timed(f'{name} (legacy)', legacy, args.repeat)
+        result, fast_time = timed(f'{name} (index_math)', fast, args.repeat)
+        if tuple(expected) != tuple(result) if isinstance(expected, (list, tuple)) else expected != result:
+            raise SystemExit(f'{name}: results differ')
+        speedups.append((name, legacy_time / fast_time if fast_time else float('inf')))
+
+    for name, speedup in speedups:
+        print(f"{name:45s} {speedup:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
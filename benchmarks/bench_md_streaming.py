@@ -0,0 +1,128 @@
+"""
+Measure wall time and peak RSS of markdown tree building on a large generated file.
+
+Usage:
+    python benchmarks/bench_md_streaming.py [--size-mb 500] [--path /tmp/bench_corpus.md]
+        [--thinning-threshold 0] [--model deepseek-chat] [--skip-legacy]
+
+Writes a markdown corpus of about --size-mb megabytes (a title, a random heading
+hierarchy and paragraphs of a few hundred words per section) unless --path already
+has one, then builds the tree (no summaries, no node text) in a fresh subprocess
+per implementation:
+
+    legacy     read the whole file, split it into lines and copy every node's text
+               (extract_nodes_from_markdown + extract_node_text_content), then build the tree
+    streaming  md_to_tree: one scan over the file, node text kept as byte ranges
+
+Each child reports its own peak RSS (ru_maxrss), so the numbers do not mix. With
+--thinning-threshold both also count tokens and thin the tree; use a model without a
+tiktoken encoding (e.g. deepseek-chat) to stay offline. No LLM calls are made.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+WORDS = ['index', 'tree', 'node', 'summary', 'section', 'token', 'page', 'heading', 'search', 'document',
+         'corpus', 'offset', 'range', 'stream', 'parser', 'memory']
+
+
+def write_corpus(path, size_mb, seed):
+    rng = random.Random(seed)
+    paragraphs = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 200))) for _ in range(500)]
+    target = size_mb * 1024 * 1024
+    written = 0
+    level = 2
+    k = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# Corpus\n\n')
+        while written < target:
+            level = max(2, min(6, level + rng.choice([-2, -1, 0, 0, 1, 1])))
+            chunk = [f"{'#' * level} Heading {k}", '']
+            for _ in range(rng.choice([1, 2, 3, 5])):
+                chunk.extend([rng.choice(paragraphs), ''])
+            if k % 1000 == 0:
+                chunk.extend(['```', '# not a heading', '```', ''])
+            block = '\n'.join(chunk) + '\n'
+            f.write(block)
+            written += len(block)
+            k += 1
+    return k + 1
+
+
+def run_legacy(path, thinning_threshold, model):
+    page_index_md = sys.modules['pageindex.page_index_md']
+    with open(path, 'r', encoding='utf-8') as f:
+        markdown_content = f.read()
+    node_list, markdown_lines = page_index_md.extract_nodes_from_markdown(markdown_content)
+    nodes = page_index_md.extract_node_text_content(node_list, markdown_lines)
+    if thinning_threshold:
+        nodes = page_index_md.update_node_list_with_text_token_count(nodes, model=model)
+        nodes = page_index_md.tree_thinning_for_index(nodes, thinning_threshold, model=model)
+    # the same post-processing md_to_tree does without summaries and node text
+    tree = page_index_md.build_tree_from_nodes(nodes)
+    page_index_md.write_node_id(tree)
+    tree = page_index_md.format_structure(tree, order=['title', 'node_id', 'summary', 'prefix_summary', 'line_num', 'nodes'])
+    return tree, len(nodes)
+
+
+def run_streaming(path, thinning_threshold, model):
+    page_index_md = sys.modules['pageindex.page_index_md']
+    result = asyncio.run(page_index_md.md_to_tree(
+        path, if_thinning=bool(thinning_threshold), min_token_threshold=thinning_threshold, model=model))
+    return result['structure'], len(page_index_md.structure_to_list(result['structure']))
+
+
+def child(args):
+    import pageindex  # noqa: F401
+    start = time.perf_counter()
+    if args.child == 'legacy':
+        _, nodes = run_legacy(args.path, args.thinning_threshold, args.model)
+    else:
+        _, nodes = run_streaming(args.path, args.thinning_threshold, args.model)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_mb, 'nodes': nodes}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=500)
+    parser.add_argument('--path', type=str, default='/tmp/bench_corpus.md')
+    parser.add_argument('--thinning-threshold', type=int, default=0)
+    parser.add_argument('--model', type=str, default='deepseek-chat')
+    parser.add_argument('--skip-legacy', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', choices=['legacy', 'streaming'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    if not os.path.exists(args.path):
+        start = time.perf_counter()
+        headings = write_corpus(args.path, args.size_mb, args.seed)
+        print(f"wrote {args.path}: {headings} headings in {time.perf_counter() - start:.1f}s")
+    print(f"{args.path}: {os.path.getsize(args.path) / 1024 / 1024:.0f} MB")
+
+    print(f"{'impl':10s} {'seconds':>9s} {'peak RSS MB':>12s} {'nodes':>9s}")
+    impls = ['streaming'] if args.skip_legacy else ['legacy', 'streaming']
+    for impl in impls:
+        cmd = [sys.executable, __file__, '--child', impl, '--path', args.path,
+               '--thinning-threshold', str(args.thinning_threshold), '--model', args.model]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        stats = json.loads(output.strip().splitlines()[-1])
+        print(f"{impl:10s} {stats['seconds']:9.2f} {stats['peak_rss_mb']:12.0f} {stats['nodes']:9d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Time markdown token counting and tree thinning on synthetic documents with many headings.
+
+Usage:
+    python benchmarks/bench_md_thinning.py [--headings 10000 50000] [--thinning-threshold 5000]
+        [--legacy-max-headings 20000] [--model gpt-4o-2024-11-20]
+
+Generates a markdown document per size with one title and a random heading hierarchy
+(levels 2-6) below it with short paragraphs, then times
+update_node_list_with_text_token_count and tree_thinning_for_index. For sizes up to --legacy-max-headings the previous quadratic
+implementation (descendant scan per node, subtree text re-tokenized) is timed as well,
+and the thinned outlines of both are compared. No LLM calls are made.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pageindex  # noqa: F401
+from pageindex.utils import count_tokens, reset_token_cache
+
+page_index_md = sys.modules['pageindex.page_index_md']
+WORDS = ['index', 'tree', 'node', 'summary', 'section', 'token', 'page', 'heading', 'search', 'document']
+
+
+def build_markdown(rng, headings):
+    # one document title, chapters and sections below it
+    lines = ['# Document']
+    level = 2
+    for k in range(headings - 1):
+        level = max(2, min(6, level + rng.choice([-2, -1, 0, 0, 1, 1])))
+        lines.append(f"{'#' * level} Heading {k}")
+        for _ in range(rng.choice([0, 1, 1, 2, 4])):
+            lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))))
+    return '\n'.join(lines)
+
+
+def legacy_descendants(node_list, i):
+    children = []
+    for j in range(i + 1, len(node_list)):
+        if node_list[j]['level'] <= node_list[i]['level']:
+            break
+        children.append(j)
+    return children
+
+
+def legacy_token_count(node_list, model=None):
+    result_list = node_list.copy()
+    for i in range(len(result_list) - 1, -1, -1):
+        total_text = result_list[i].get('text', '')
+        for j in legacy_descendants(result_list, i):
+            if result_list[j].get('text', ''):
+                total_text += '\n' + result_list[j]['text']
+        result_list[i]['text_token_count'] = count_tokens(total_text, model=model)
+    return result_list
+
+
+def legacy_thinning(node_list, min_node_token, model=None):
+    result_list = node_list.copy()
+    nodes_to_remove = set()
+    for i in range(len(result_list) - 1, -1, -1):
+        if result_list[i].get('text_token_count', 0) >= min_node_token:
+            continue
+        children_texts = []
+        for j in legacy_descendants(result_list, i):
+            if j not in nodes_to_remove:
+                if result_list[j].get('text', '').strip():
+                    children_texts.append(result_list[j]['text'])
+                nodes_to_remove.add(j)
+        if children_texts:
+            merged_text = result_list[i].get('text', '')
+            for child_text in children_texts:
+                if merged_text and not merged_text.endswith('\n'):
+                    merged_text += '\n\n'
+                merged_text += child_text
+            result_list[i]['text'] = merged_text
+            result_list[i]['text_token_count'] = count_tokens(merged_text, model=model)
+    for index in sorted(nodes_to_remove, reverse=True):
+        result_list.pop(index)
+    return result_list
+
+
+def run(name, nodes, token_count, thinning, threshold, model):
+    reset_token_cache()
+    nodes = [dict(node) for node in nodes]
+    start = time.perf_counter()
+    counted = token_count(nodes, model=model)
+    counted_at = time.perf_counter()
+    thinned = thinning(counted, threshold, model=model)
+    end = time.perf_counter()
+    print(f"{name:8s} {len(nodes):9d} {counted_at - start:11.2f} {end - counted_at:11.2f} {len(thinned):8d}")
+    return thinned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--headings', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--thinning-threshold', type=int, default=5000)
+    parser.add_argument('--legacy-max-headings', type=int, default=20000)
+    parser.add_argument('--model', type=str, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'impl':8s} {'headings':>9s} {'count s':>11s} {'thinning s':>11s} {'nodes':>8s}")
+    for headings in args.headings:
+        markdown = build_markdown(random.Random(args.seed), headings)
+        node_list, lines = page_index_md.extract_nodes_from_markdown(markdown)
+        nodes = page_index_md.extract_node_text_content(node_list, lines)
+        thinned = run('linear', nodes, page_index_md.update_node_list_with_text_token_count,
+                      page_index_md.tree_thinning_for_index, args.thinning_threshold, args.model)
+        if headings <= args.legacy_max_headings:
+            legacy = run('legacy', nodes, legacy_token_count, legacy_thinning, args.thinning_threshold, args.model)
+            same = [node['title'] for node in thinned] == [node['title'] for node in legacy]
+            print(f"{'':8s} same thinned outline: {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare the fixed 20k-token page groups with groups sized from the model limit table.
+
+Usage:
+    python benchmarks/bench_page_grouping.py doc1.pdf [doc2.pdf ...] [--models deepseek-chat gpt-4o-2024-11-20 gpt-3.5-turbo]
+
+For every document and model the script groups the labeled pages the way TOC generation
+does (generate_toc_parallel stage) and reports the number of groups, i.e. LLM calls,
+the largest group and whether a call would overflow the model's context window
+(group + prompt + expected TOC output). No LLM calls are made.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pageindex  # noqa: F401
+from pageindex.utils import get_page_tokens, get_labeled_page_text, estimate_tokens
+from pageindex.model_limits import get_model_limits, group_token_budget
+
+page_index_module = sys.modules['pageindex.page_index']
+FIXED_MAX_TOKENS = 20000
+
+
+def overflows(group_tokens, model):
+    limits = get_model_limits(model)
+    needed = group_tokens + page_index_module.TOC_PROMPT_TOKENS
+    output = group_tokens * page_index_module.TOC_OUTPUT_RATIO
+    return needed + output > limits.context_window or output > limits.max_output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdf_paths', nargs='+')
+    parser.add_argument('--models', nargs='+', default=['deepseek-chat', 'gpt-4o-2024-11-20', 'gpt-3.5-turbo'])
+    args = parser.parse_args()
+
+    print(f"{'document':30s} {'model':20s} {'tokens':>8s} {'fixed':>6s} {'sized':>6s} "
+          f"{'budget':>7s} {'largest':>8s} {'fixed overflows':>15s}")
+    for pdf_path in args.pdf_paths:
+        name = os.path.basename(pdf_path)[:30]
+        for model in args.models:
+            page_list = get_page_tokens(pdf_path, model=model, token_mode='estimate')
+            page_contents = [get_labeled_page_text(page, i + 1) for i, page in enumerate(page_list)]
+            page_contents = [text for text in page_contents if text]
+            token_lengths = [estimate_tokens(text, model, upper=True) for text in page_contents]
+
+            _, fixed_tokens = page_index_module.page_list_to_group_text(
+                page_contents, token_lengths, max_tokens=FIXED_MAX_TOKENS, with_token_counts=True)
+            budget = group_token_budget(model, prompt_tokens=page_index_module.TOC_PROMPT_TOKENS,
+                                        output_ratio=page_index_module.TOC_OUTPUT_RATIO)
+            _, sized_tokens = page_index_module.page_list_to_group_text(
+                page_contents, token_lengths, max_tokens=budget, with_token_counts=True)
+            fixed_overflows = sum(overflows(tokens, model) for tokens in fixed_tokens)
+            print(f"{name:30s} {model:20s} {sum(token_lengths):8d} {len(fixed_tokens):6d} {len(sized_tokens):6d} "
+                  f"{budget:7d} {max(sized_tokens):8d} {fixed_overflows:15d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Measure how much page preprocessing shrinks the page text that ends up in prompts.
+
+Usage:
+    python benchmarks/bench_page_preprocess.py path/to/corpus_dir_or_pdf [...]
+
+For every PDF the script reports the tokens of the <physical_index_X> tagged page text
+(what TOC detection, TOC generation, verification and summaries are built from) before
+and after preprocessing, the number of blank pages that are skipped and the totals
+over the corpus.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pageindex.utils import get_page_tokens, get_labeled_page_text, count_tokens
+from pageindex.page_preprocess import preprocess_pages
+
+
+def collect_pdfs(paths):
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                pdfs.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.pdf'))
+        elif path.lower().endswith('.pdf'):
+            pdfs.append(path)
+    return pdfs
+
+
+def prompt_tokens(page_list):
+    return sum(count_tokens(get_labeled_page_text(page, i)) for i, page in enumerate(page_list, start=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='PDF files or directories containing PDFs')
+    args = parser.parse_args()
+
+    pdfs = collect_pdfs(args.paths)
+    if not pdfs:
+        raise SystemExit('no PDF files found')
+
+    total_before = total_after = total_pages = total_empty = 0
+    print(f"{'document':40s} {'pages':>6s} {'empty':>6s} {'before':>9s} {'after':>9s} {'saved':>7s} {'ms':>7s}")
+    for pdf in pdfs:
+        page_list = get_page_tokens(pdf)
+        start = time.perf_counter()
+        cleaned, stats = preprocess_pages(page_list)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        before = prompt_tokens(page_list)
+        after = prompt_tokens(cleaned)
+        saved = 1 - after / before if before else 0.0
+        total_before += before
+        total_after += after
+        total_pages += stats['pages']
+        total_empty += len(stats['empty_pages'])
+        print(f"{os.path.basename(pdf)[:40]:40s} {stats['pages']:6d} {len(stats['empty_pages']):6d} "
+              f"{before:9d} {after:9d} {saved:7.1%} {elapsed:7.1f}")
+
+    saved = 1 - total_after / total_before if total_before else 0.0
+    print(f"{'TOTAL':40s} {total_pages:6d} {total_empty:6d} {total_before:9d} {total_after:9d} {saved:7.1%}")
+
+
+if __name__ == '__main__':
+    main()
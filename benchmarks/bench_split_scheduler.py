@@ -0,0 +1,117 @@
+"""
+Simulate large-node splitting on a document with uneven chapter sizes.
+
+Usage:
+    python benchmarks/bench_split_scheduler.py [--llm-slots 8] [--max-concurrent-splits N] [--call-seconds 0.05]
+        [--giant-pages 600] [--sequential-rounds 3]
+
+Compares the previous recursion (every child spawned with an unbounded asyncio.gather)
+with process_large_nodes (largest token mass first for splits and their LLM slots, capped
+in-flight splits, default cap = --llm-slots). A split is simulated as one LLM call per 20
+pages, issued concurrently through get_llm_semaphore() sized to --llm-slots, each call
+taking --call-seconds, followed
+by --sequential-rounds single calls standing in for TOC verification and fixing. The
+simulated TOC of a split divides its pages into 4 children, and checking where each
+child title starts costs one more call per child. Reports the makespan of both.
+No LLM calls are made.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pageindex  # noqa: F401
+import pageindex.utils as pageindex_utils
+from pageindex.index_math import PageTokenIndex
+
+page_index_module = sys.modules['pageindex.page_index']
+PAGES_PER_CALL = 20
+
+
+def build_tree(rng, chapters, giant_pages):
+    # one giant chapter, placed last, among many small ones
+    sizes = [rng.randint(12, 40) for _ in range(chapters - 1)] + [giant_pages]
+    tree, start = [], 1
+    for i, size in enumerate(sizes):
+        tree.append({'title': f'Chapter {i}', 'start_index': start, 'end_index': start + size - 1})
+        start += size
+    return tree, start - 1
+
+
+def simulated_split(call_seconds, sequential_rounds):
+    async def call():
+        async with pageindex_utils.get_llm_semaphore():
+            await asyncio.sleep(call_seconds)
+
+    async def meta_processor(node_page_list, mode=None, start_index=1, opt=None, logger=None, **kwargs):
+        n = len(node_page_list)
+        await asyncio.gather(*[call() for _ in range(math.ceil(n / PAGES_PER_CALL))])
+        # TOC verification and fixing rounds that depend on each other's result
+        for _ in range(sequential_rounds):
+            await call()
+        step = max(1, n // 4)
+        return [{'structure': str(k), 'title': f'Part {start_index + offset}', 'physical_index': start_index + offset}
+                for k, offset in enumerate(range(1, n, step), start=1)]
+
+    async def check_title_appearance_in_start_concurrent(toc, page_list, model=None, logger=None):
+        # one call per entry
+        await asyncio.gather(*[call() for _ in toc])
+        for item in toc:
+            item['appear_start'] = 'yes'
+        return toc
+
+    return meta_processor, check_title_appearance_in_start_concurrent
+
+
+async def legacy_recursive(node, page_list, opt, token_index):
+    if page_index_module._split_token_num(node, opt, token_index) is not None:
+        await page_index_module.split_large_node(node, page_list, opt)
+    if node.get('nodes'):
+        await asyncio.gather(*[legacy_recursive(child, page_list, opt, token_index) for child in node['nodes']])
+
+
+async def run(name, tree, page_list, opt, args, scheduled):
+    page_index_module.meta_processor, page_index_module.check_title_appearance_in_start_concurrent = \
+        simulated_split(args.call_seconds, args.sequential_rounds)
+    token_index = PageTokenIndex(page_list)
+    start = time.perf_counter()
+    if scheduled:
+        await page_index_module.process_large_nodes(tree, page_list, opt, token_index=token_index)
+    else:
+        await asyncio.gather(*[legacy_recursive(node, page_list, opt, token_index) for node in tree])
+    elapsed = time.perf_counter() - start
+    print(f"{name:12s} makespan {elapsed:7.2f} s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chapters', type=int, default=40)
+    parser.add_argument('--giant-pages', type=int, default=600)
+    parser.add_argument('--llm-slots', type=int, default=8)
+    parser.add_argument('--max-concurrent-splits', type=int, default=None)
+    parser.add_argument('--call-seconds', type=float, default=0.05)
+    parser.add_argument('--sequential-rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    pageindex_utils.MAX_CONCURRENT_LLM_CALLS = args.llm_slots
+
+    tree, pages = build_tree(random.Random(args.seed), args.chapters, args.giant_pages)
+    page_list = [('', 1000)] * pages
+    opt = SimpleNamespace(max_page_num_each_node=10, max_token_num_each_node=20000, model=None,
+                          max_concurrent_splits=args.max_concurrent_splits)
+    print(f"{args.chapters} chapters, {pages} pages, {args.llm_slots} LLM slots")
+
+    legacy = asyncio.run(run('legacy', [dict(node) for node in tree], page_list, opt, args, scheduled=False))
+    scheduled = asyncio.run(run('scheduled', [dict(node) for node in tree], page_list, opt, args, scheduled=True))
+    print(f"speedup {legacy / scheduled:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
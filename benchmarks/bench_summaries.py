@@ -0,0 +1,81 @@
+"""
+Compare the input tokens of flat and bottom-up node summaries on a synthetic tree.
+
+Usage:
+    python benchmarks/bench_summaries.py [--pages 600] [--depth 4] [--fanout 4] [--page-tokens 700]
+        [--summary-tokens 200] [--prefix-pages 1]
+
+Builds a tree of the given depth and fanout over --pages pages, where every internal node
+starts with --prefix-pages pages of its own before its first child. Flat mode sends every
+node its full page range, so each page is read once per ancestor level. Bottom-up mode
+sends leaves their own pages and internal nodes their prefix pages plus one summary of
+--summary-tokens per child. Also reports the number of summary rounds on the critical
+path of both modes (flat: 1, bottom-up: tree depth). No LLM calls are made.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pageindex.index_math import PageTokenIndex
+
+
+def build_tree(start, end, depth, fanout, prefix_pages):
+    node = {'start_index': start, 'end_index': end, 'nodes': []}
+    first_child = start + prefix_pages
+    pages = end - first_child + 1
+    if depth <= 1 or pages < fanout:
+        return node
+    size = pages // fanout
+    for k in range(fanout):
+        child_start = first_child + k * size
+        child_end = end if k == fanout - 1 else child_start + size - 1
+        node['nodes'].append(build_tree(child_start, child_end, depth - 1, fanout, prefix_pages))
+    return node
+
+
+def walk(node):
+    yield node
+    for child in node['nodes']:
+        yield from walk(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=600)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--page-tokens', type=int, default=700)
+    parser.add_argument('--summary-tokens', type=int, default=200)
+    parser.add_argument('--prefix-pages', type=int, default=1)
+    args = parser.parse_args()
+
+    token_index = PageTokenIndex([('', args.page_tokens)] * args.pages)
+    root = build_tree(1, args.pages, args.depth, args.fanout, args.prefix_pages)
+    nodes = list(walk(root))
+
+    flat = sum(token_index.range_tokens(node['start_index'], node['end_index']) for node in nodes)
+    bottom_up = 0
+    largest_flat = largest_bottom_up = 0
+    for node in nodes:
+        full = token_index.range_tokens(node['start_index'], node['end_index'])
+        largest_flat = max(largest_flat, full)
+        if node['nodes']:
+            prefix_end = node['nodes'][0]['start_index'] - 1
+            prefix = token_index.range_tokens(node['start_index'], prefix_end) if prefix_end >= node['start_index'] else 0
+            tokens = prefix + args.summary_tokens * len(node['nodes'])
+        else:
+            tokens = full
+        largest_bottom_up = max(largest_bottom_up, tokens)
+        bottom_up += tokens
+
+    print(f"{len(nodes)} nodes, {args.pages} pages, {token_index.total()} document tokens")
+    print(f"{'mode':10s} {'input tokens':>13s} {'largest call':>13s} {'rounds':>7s}")
+    print(f"{'flat':10s} {flat:13d} {largest_flat:13d} {1:7d}")
+    print(f"{'bottom_up':10s} {bottom_up:13d} {largest_bottom_up:13d} {args.depth:7d}")
+    print(f"input tokens saved {1 - bottom_up / flat:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Simulate node summaries with and without short-node passthrough and packed prompts.
+
+Usage:
+    python benchmarks/bench_summary_packing.py [--nodes 300] [--llm-slots 8] [--summary-token-threshold 200]
+        [--summary-pack-tokens 8000] [--call-seconds 0.05] [--seconds-per-1k-tokens 0.01]
+        [--seconds-per-summary 0.03]
+
+Builds --nodes nodes whose text sizes follow a log-normal distribution (many short stubs,
+a few long sections) and summarizes them with generate_summaries_for_structure, once
+the old way (one request per node) and once with the given threshold and pack budget.
+A request is simulated as --call-seconds plus time proportional to its input tokens and
+to the number of descriptions it returns, limited by a pool of --llm-slots like
+get_llm_semaphore() does. Reports request counts, input tokens and makespan of both.
+No LLM calls are made.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pageindex.utils as utils
+
+WORDS = ['contract', 'party', 'liability', 'revenue', 'segment', 'annex', 'clause', 'period', 'report', 'risk']
+
+
+def build_nodes(rng, n):
+    nodes = []
+    for i in range(n):
+        num_words = max(5, int(rng.lognormvariate(5.3, 1.2)))
+        nodes.append({'title': f'Section {i}', 'text': ' '.join(rng.choice(WORDS) for _ in range(num_words))})
+    return nodes
+
+
+def simulated_api(slots, args, usage):
+    async def call(model, prompt, api_key=None):
+        parts = re.findall(r'<part id="(\d+)">', prompt)
+        tokens = utils.count_tokens(prompt, model=model)
+        usage['requests'] += 1
+        usage['input_tokens'] += tokens
+        async with slots:
+            await asyncio.sleep(args.call_seconds + tokens / 1000 * args.seconds_per_1k_tokens
+                                + max(1, len(parts)) * args.seconds_per_summary)
+        if parts:
+            return json.dumps({part: f'description of part {part}' for part in parts})
+        return 'description'
+
+    return call
+
+
+async def run(name, nodes, args, summary_token_threshold, pack_tokens):
+    usage = {'requests': 0, 'input_tokens': 0}
+    utils.ChatGPT_API_async = simulated_api(asyncio.Semaphore(args.llm_slots), args, usage)
+    structure = [dict(node) for node in nodes]
+    start = time.perf_counter()
+    await utils.generate_summaries_for_structure(structure, summary_token_threshold=summary_token_threshold,
+                                                 pack_tokens=pack_tokens)
+    elapsed = time.perf_counter() - start
+    print(f"{name:8s} {usage['requests']:9d} {usage['input_tokens']:13d} {elapsed:11.2f}")
+    return usage['requests'], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=300)
+    parser.add_argument('--llm-slots', type=int, default=8)
+    parser.add_argument('--summary-token-threshold', type=int, default=200)
+    parser.add_argument('--summary-pack-tokens', type=int, default=8000)
+    parser.add_argument('--call-seconds', type=float, default=0.05)
+    parser.add_argument('--seconds-per-1k-tokens', type=float, default=0.01)
+    parser.add_argument('--seconds-per-summary', type=float, default=0.03)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    nodes = build_nodes(random.Random(args.seed), args.nodes)
+    print(f"{args.nodes} nodes, {args.llm_slots} LLM slots")
+    print(f"{'mode':8s} {'requests':>9s} {'input tokens':>13s} {'makespan s':>11s}")
+    before_requests, before = asyncio.run(run('before', nodes, args, 0, 0))
+    after_requests, after = asyncio.run(run('after', nodes, args, args.summary_token_threshold, args.summary_pack_tokens))
+    print(f"requests {before_requests} -> {after_requests}, speedup {before / after:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare serial and parallel TOC generation for documents without a table of contents.
+
+Usage:
+    python benchmarks/bench_toc_generation.py path/to/document.pdf [--model deepseek-chat] [--pages 600]
+
+Both modes run on the same (preprocessed) pages of the PDF:
+  serial    generate_toc_init + generate_toc_continue chained over the page groups
+  parallel  generate_toc_for_group on all groups concurrently + merge_group_tocs
+The script reports wall time, LLM calls, prompt/completion tokens as reported by the
+API and the number of TOC entries each mode produced. It calls the real LLM API, so the
+API key from .env is required.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pageindex.utils import get_page_tokens, get_llm_usage, reset_llm_usage, ConfigLoader, JsonLogger
+from pageindex.page_preprocess import preprocess_pages
+from pageindex.page_index import process_no_toc, process_no_toc_parallel
+
+
+def run(name, func):
+    reset_llm_usage()
+    start = time.perf_counter()
+    toc = func()
+    elapsed = time.perf_counter() - start
+    usage = get_llm_usage()
+    print(f"{name:10s} {elapsed:9.1f} {usage['calls']:6d} {usage['prompt_tokens']:10d} "
+          f"{usage['completion_tokens']:10d} {len(toc):8d}")
+    return toc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdf_path')
+    parser.add_argument('--model', default=None, help='defaults to the model in config.yaml')
+    parser.add_argument('--pages', type=int, default=None, help='only use the first N pages')
+    args = parser.parse_args()
+
+    opt = ConfigLoader().load({'model': args.model} if args.model else {})
+    page_list = get_page_tokens(args.pdf_path, model=opt.model, token_mode=opt.token_count_mode)
+    page_list, _ = preprocess_pages(page_list, model=opt.model, token_mode=opt.token_count_mode)
+    if args.pages:
+        page_list = page_list[:args.pages]
+    logger = JsonLogger(args.pdf_path)
+
+    print(f"{len(page_list)} pages, model {opt.model}")
+    print(f"{'mode':10s} {'seconds':>9s} {'calls':>6s} {'prompt':>10s} {'completion':>10s} {'entries':>8s}")
+    serial = run('serial', lambda: process_no_toc(page_list, model=opt.model, logger=logger))
+    parallel = run('parallel', lambda: asyncio.run(process_no_toc_parallel(page_list, model=opt.model, logger=logger)))
+
+    serial_keys = {(item.get('title', '').strip().lower(), item.get('physical_index')) for item in serial}
+    parallel_keys = {(item['title'].strip().lower(), item['physical_index']) for item in parallel}
+    common = len(serial_keys & parallel_keys)
+    print(f"entries found by both modes: {common} ({common / max(len(serial_keys), 1):.1%} of serial)")
+
+
+if __name__ == '__main__':
+    main()
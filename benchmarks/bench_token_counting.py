@@ -0,0 +1,84 @@
+"""
+Microbenchmark for token counting.
+
+Compares, on synthetic pages:
+  1. the old pattern: tiktoken.get_encoding() + encode() on every call
+  2. count_tokens() with the shared encoder (cold memo)
+  3. count_tokens_many() batch encoding
+  4. count_tokens() on texts that were already counted in this run (memo hits)
+
+Usage:
+    python benchmarks/bench_token_counting.py [--pages 2000] [--chars 3000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tiktoken
+from pageindex.utils import count_tokens, count_tokens_many, reset_token_cache
+
+
+def make_pages(num_pages, num_chars, seed=0):
+    rng = random.Random(seed)
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(5000)]
+    cjk = [chr(rng.randint(0x4e00, 0x9fa5)) for _ in range(2000)]
+    pages = []
+    for i in range(num_pages):
+        parts = []
+        size = 0
+        while size < num_chars:
+            token = rng.choice(words) if rng.random() < 0.8 else ''.join(rng.choices(cjk, k=4))
+            parts.append(token)
+            size += len(token) + 1
+        pages.append(f"Page {i}\n" + ' '.join(parts))
+    return pages
+
+
+def timed(label, func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:45s} {best * 1000:10.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--chars', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages, args.chars)
+    print(f"{args.pages} pages x ~{args.chars} chars")
+
+    def legacy():
+        return [len(tiktoken.get_encoding("cl100k_base").encode(p)) for p in pages]
+
+    def cold_single():
+        reset_token_cache()
+        return [count_tokens(p) for p in pages]
+
+    def cold_batch():
+        reset_token_cache()
+        return count_tokens_many(pages)
+
+    def warm_single():
+        return [count_tokens(p) for p in pages]
+
+    expected = timed('legacy get_encoding + encode per call', legacy, args.repeat)
+    assert timed('count_tokens (shared encoder, cold memo)', cold_single, args.repeat) == expected
+    assert timed('count_tokens_many (batch, cold memo)', cold_batch, args.repeat) == expected
+    count_tokens_many(pages)
+    assert timed('count_tokens (memo hits)', warm_single, args.repeat) == expected
+
+
+if __name__ == '__main__':
+    main()
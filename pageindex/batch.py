@@ -0,0 +1,199 @@
+"""
+Index a corpus of PDF and Markdown documents in one process.
+
+All documents share one event loop, so they share its LLM semaphore (get_llm_semaphore)
+and HTTP clients; a pool of workers keeps several documents in flight. Every result is
+written to the output directory as <name>_structure.json, and every finished document
+appends a record (status, timings, token usage) to manifest.jsonl there. A rerun skips
+documents whose last record is 'done' and whose file has not changed since.
+"""
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+try:
+    from .utils import *
+    from .page_index import page_index_main_async
+    from .page_index_md import md_to_tree
+except:
+    from utils import *
+    from page_index import page_index_main_async
+    from page_index_md import md_to_tree
+
+BATCH_EXTENSIONS = ('.pdf', '.md', '.markdown')
+BATCH_MANIFEST_NAME = 'manifest.jsonl'
+
+
+def collect_documents(source):
+    """
+    Documents to index from a directory (searched recursively), a manifest file with
+    one path per line (blank lines and '#' comments skipped, relative paths resolved
+    against the manifest's directory) or a glob pattern. Returns absolute paths.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(BATCH_EXTENSIONS))
+    elif os.path.isfile(source) and not source.lower().endswith(BATCH_EXTENSIONS):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+        paths = [os.path.join(base_dir, line) for line in lines if line and not line.startswith('#')]
+    else:
+        paths = sorted(glob.glob(source, recursive=True))
+
+    documents = []
+    seen = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if path not in seen and path.lower().endswith(BATCH_EXTENSIONS):
+            seen.add(path)
+            documents.append(path)
+    return documents
+
+
+def output_names(paths, taken=()):
+    """
+    <name>_structure.json per document. Documents sharing a file name, or whose name is
+    in taken (outputs of other documents from earlier runs), get a short path hash appended.
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    names = {}
+    for path, stem in zip(paths, stems):
+        if counts[stem] > 1 or f"{stem}_structure.json" in taken:
+            stem = f"{stem}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}"
+        names[path] = f"{stem}_structure.json"
+    return names
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+class BatchManifest:
+    """Append-only JSONL log of finished documents; the last record of a path wins."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, BATCH_MANIFEST_NAME)
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line cut short by an interrupted run
+                        continue
+                    self.records[record['path']] = record
+
+    def output_names(self, paths):
+        """Output file names; a document keeps the name recorded by an earlier run, whatever else is in this batch."""
+        recorded = {path: record['output'] for path, record in self.records.items() if record.get('output')}
+        names = output_names([path for path in paths if path not in recorded], taken=set(recorded.values()))
+        names.update({path: recorded[path] for path in paths if path in recorded})
+        return names
+
+    def is_done(self, path, output_path):
+        record = self.records.get(path)
+        return (record is not None and record.get('status') == 'done' and os.path.exists(output_path)
+                and record.get('file') == file_signature(path))
+
+    def append(self, record):
+        self.records[record['path']] = record
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+async def index_batch_document(path, output_path, opt, md_options):
+    if path.lower().endswith('.pdf'):
+        return await page_index_main_async(path, opt)
+    # Markdown reruns reuse the unchanged sections of the previous result
+    previous = {'structure': []}
+    if os.path.exists(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    return await md_to_tree(md_path=path, model=opt.model, previous=previous, **md_options)
+
+
+async def run_batch(paths, output_dir, opt, md_options=None, workers=4):
+    """
+    Index paths with workers documents in flight and return the aggregate report.
+    opt is the PDF config (ConfigLoader); md_options are extra md_to_tree arguments.
+    """
+    md_options = md_options or {}
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BatchManifest(output_dir)
+    names = manifest.output_names(paths)
+
+    pending = []
+    skipped = 0
+    for path in paths:
+        if manifest.is_done(path, os.path.join(output_dir, names[path])):
+            skipped += 1
+        else:
+            pending.append(path)
+    print(f"Batch: {len(paths)} documents, {skipped} already done, {len(pending)} to index with {workers} workers")
+
+    queue = asyncio.Queue()
+    for path in pending:
+        queue.put_nowait(path)
+    finished = []
+    start = time.perf_counter()
+
+    async def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            output_path = os.path.join(output_dir, names[path])
+            record = {'path': path, 'output': names[path], 'file': file_signature(path),
+                      'started_at': datetime.now().isoformat(timespec='seconds')}
+            doc_start = time.perf_counter()
+            with use_llm_usage() as usage:
+                try:
+                    result = await index_batch_document(path, output_path, opt, md_options)
+                    with open(output_path, 'w', encoding='utf-8') as f:
+                        json.dump(result, f, indent=2, ensure_ascii=False)
+                    record['status'] = 'done'
+                except Exception as e:
+                    record['status'] = 'failed'
+                    record['error'] = f"{type(e).__name__}: {e}"
+            record['seconds'] = round(time.perf_counter() - doc_start, 3)
+            record['llm_usage'] = dict(usage)
+            manifest.append(record)
+            finished.append(record)
+            print(f"[{len(finished)}/{len(pending)}] {record['status']} {os.path.basename(path)} "
+                  f"in {record['seconds']:.1f}s, {usage['prompt_tokens'] + usage['completion_tokens']} tokens")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(pending))))))
+    elapsed = time.perf_counter() - start
+
+    done = [record for record in finished if record['status'] == 'done']
+    total_tokens = sum(record['llm_usage']['prompt_tokens'] + record['llm_usage']['completion_tokens'] for record in finished)
+    report = {
+        'documents': len(paths),
+        'skipped': skipped,
+        'done': len(done),
+        'failed': len(finished) - len(done),
+        'seconds': round(elapsed, 3),
+        'documents_per_minute': round(len(done) / elapsed * 60, 2) if elapsed else 0.0,
+        'llm_calls': sum(record['llm_usage']['calls'] for record in finished),
+        'prompt_tokens': sum(record['llm_usage']['prompt_tokens'] for record in finished),
+        'completion_tokens': sum(record['llm_usage']['completion_tokens'] for record in finished),
+        'tokens_per_second': round(total_tokens / elapsed, 1) if elapsed else 0.0,
+        'input_mb': round(sum(record['file']['size'] for record in done) / 1024 / 1024, 2),
+    }
+    print(f"Batch finished: {report['done']} done, {report['failed']} failed, {report['skipped']} skipped "
+          f"in {report['seconds']:.1f}s ({report['documents_per_minute']} documents/min, "
+          f"{report['tokens_per_second']} tokens/s, {report['llm_calls']} LLM calls)")
+    return report
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from io import BytesIO
+
+
+# Options that do not change the index and must not invalidate checkpoints
+CHECKPOINT_IGNORED_OPTIONS = ('checkpoint_dir', 'trace_dir', 'summary_cache_path')
+
+
+def hash_document(doc):
+    digest = hashlib.sha256()
+    if isinstance(doc, BytesIO):
+        digest.update(doc.getvalue())
+    else:
+        with open(doc, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_options(opt):
+    options = {k: v for k, v in vars(opt).items() if k not in CHECKPOINT_IGNORED_OPTIONS}
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def clear_checkpoint(root, doc):
+    """Drop all checkpoints of a document, e.g. once its index has been stored."""
+    shutil.rmtree(os.path.join(root, hash_document(doc)[:32]), ignore_errors=True)
+
+
+class CheckpointStore:
+    """
+    Stage outputs of one document's indexing run, so a retry resumes after the last
+    completed stage instead of redoing TOC detection, verification and fixing.
+
+    Layout: <root>/<file hash>/<stage>.json, plus summaries.jsonl with one line per
+    finished node summary. The directory is wiped when the options hash stored in
+    meta.json differs from the current one.
+    """
+
+    def __init__(self, root, doc, opt):
+        self.file_hash = hash_document(doc)
+        self.opt_hash = hash_options(opt)
+        self.path = os.path.join(root, self.file_hash[:32])
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        meta = None
+        if os.path.isfile(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+        if meta != {'file_hash': self.file_hash, 'opt_hash': self.opt_hash}:
+            self.clear()
+            os.makedirs(self.path, exist_ok=True)
+            self._write_json(meta_path, {'file_hash': self.file_hash, 'opt_hash': self.opt_hash})
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, stage):
+        """Output of a completed stage, or None."""
+        stage_path = os.path.join(self.path, f'{stage}.json')
+        if not os.path.isfile(stage_path):
+            return None
+        try:
+            with open(stage_path, 'r', encoding='utf-8') as f:
+                return json.load(f)['data']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, stage, data):
+        self._write_json(os.path.join(self.path, f'{stage}.json'), {'data': data})
+
+    @staticmethod
+    def summary_key(node):
+        return f"{node.get('start_index', node.get('line_num'))}-{node.get('end_index')}-{node.get('title')}"
+
+    def load_summaries(self):
+        summaries = {}
+        summaries_path = os.path.join(self.path, 'summaries.jsonl')
+        if not os.path.isfile(summaries_path):
+            return summaries
+        with open(summaries_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut off by a crash
+                    continue
+                summaries[record['key']] = record['summary']
+        return summaries
+
+    def append_summary(self, key, summary):
+        line = json.dumps({'key': key, 'summary': summary}, ensure_ascii=False)
+        with self._lock:
+            with open(os.path.join(self.path, 'summaries.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
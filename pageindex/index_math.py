@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class PageTokenIndex:
+    """
+    Prefix sums over the page token counts of a page_list, so the token count of any
+    physical page range is O(1) instead of re-summing a slice at every tree level.
+    """
+
+    def __init__(self, page_list, start_index=1):
+        self.start_index = start_index
+        tokens = np.fromiter((page[1] for page in page_list), dtype=np.int64, count=len(page_list))
+        self.prefix = np.concatenate(([0], np.cumsum(tokens)))
+        # scalar lookups are faster on a plain list than on numpy scalars
+        self._prefix = self.prefix.tolist()
+
+    def __len__(self):
+        return len(self._prefix) - 1
+
+    def range_tokens(self, start, end):
+        """Tokens of physical pages start..end (inclusive), clamped to the document."""
+        prefix = self._prefix
+        last = len(prefix) - 1
+        lo = start - self.start_index
+        lo = 0 if lo < 0 else (last if lo > last else lo)
+        hi = end - self.start_index + 1
+        hi = lo if hi < lo else (last if hi > last else hi)
+        return prefix[hi] - prefix[lo]
+
+    def range_tokens_many(self, starts, ends):
+        """Vectorized range_tokens for arrays of physical start/end pages."""
+        lo = np.clip(np.asarray(starts, dtype=np.int64) - self.start_index, 0, len(self))
+        hi = np.clip(np.asarray(ends, dtype=np.int64) - self.start_index + 1, lo, len(self))
+        return self.prefix[hi] - self.prefix[lo]
+
+    def total(self):
+        return self._prefix[-1]
+
+
+def neighbor_valid_indices(values, excluded=None):
+    """
+    For every position i, the nearest valid value before and after it.
+
+    values is a list of physical indices (None = unknown), positions in excluded are
+    treated as unknown too. Returns two int64 arrays (prev, next) holding the neighbour's
+    value, or -1 where there is none.
+    """
+    n = len(values)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    valid = np.fromiter((isinstance(v, (int, np.integer)) for v in values), dtype=bool, count=n)
+    if excluded:
+        excluded_positions = np.fromiter((i for i in excluded if 0 <= i < n), dtype=np.int64)
+        valid[excluded_positions] = False
+    numbers = np.array([v if ok else -1 for v, ok in zip(values, valid)], dtype=np.int64)
+    positions = np.arange(n)
+
+    # position of the last valid item at or before i, then shifted to "strictly before"
+    last_valid = np.maximum.accumulate(np.where(valid, positions, -1))
+    prev_pos = np.concatenate(([-1], last_valid[:-1]))
+    # position of the first valid item at or after i, then shifted to "strictly after"
+    first_valid = np.minimum.accumulate(np.where(valid, positions, n)[::-1])[::-1]
+    next_pos = np.concatenate((first_valid[1:], [n]))
+
+    prev_values = np.where(prev_pos >= 0, numbers[np.clip(prev_pos, 0, n - 1)], -1)
+    next_values = np.where(next_pos < n, numbers[np.clip(next_pos, 0, n - 1)], -1)
+    return prev_values, next_values
+
+
+def match_titles(left_items, right_items, key='title'):
+    """
+    Hash join on the title field. Returns (left position, right position) pairs in the
+    order a nested loop over left then right would produce them.
+    """
+    right_positions = {}
+    for j, item in enumerate(right_items):
+        right_positions.setdefault(item.get(key), []).append(j)
+    return [(i, j) for i, item in enumerate(left_items) for j in right_positions.get(item.get(key), ())]
+
+
+def most_common_offset(differences):
+    """
+    Most frequent value of differences, ties going to the value seen first.
+    Returns None for an empty input.
+    """
+    if len(differences) == 0:
+        return None
+    values, first_seen, counts = np.unique(np.asarray(differences, dtype=np.int64),
+                                           return_index=True, return_counts=True)
+    candidates = np.flatnonzero(counts == counts.max())
+    return int(values[candidates[np.argmin(first_seen[candidates])]])
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """Wilson score interval for a binomial proportion, (0, 1) when there are no trials."""
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    margin = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return float(max(center - margin, 0.0)), float(min(center + margin, 1.0))
+
+
+def find_out_of_order_items(values):
+    """
+    Positions whose physical_index is lower than an earlier entry's or higher than the
+    next valid entry's, i.e. the entries that break the page order of a TOC.
+    """
+    n = len(values)
+    if n == 0:
+        return []
+    numbers = np.array([v if isinstance(v, (int, np.integer)) else -1 for v in values], dtype=np.int64)
+    valid = numbers >= 0
+    running_max = np.maximum.accumulate(numbers)
+    earlier_max = np.concatenate(([-1], running_max[:-1]))
+    _, next_values = neighbor_valid_indices(values)
+    out_of_order = valid & ((numbers < earlier_max) | ((next_values >= 0) & (numbers > next_values)))
+    return np.flatnonzero(out_of_order).tolist()
@@ -0,0 +1,76 @@
+import logging
+import threading
+from collections import namedtuple
+
+
+ModelLimits = namedtuple('ModelLimits', ['context_window', 'max_output'])
+
+# Used for models missing from the table, small enough for any current chat model
+DEFAULT_LIMITS = ModelLimits(context_window=32768, max_output=4096)
+# Share of the context window kept free for tokenizer mismatch and formatting overhead
+CONTEXT_SAFETY_MARGIN = 0.1
+# Bounds of a page group: very small groups waste calls, very large ones hurt recall.
+# The floor is not enforced, a group never exceeds what the model can take
+MIN_GROUP_TOKENS = 2000
+MAX_GROUP_TOKENS = 120000
+
+# (model name prefix, limits); the longest matching prefix wins
+_limits = [
+    ("deepseek-chat", ModelLimits(65536, 8192)),
+    ("deepseek-reasoner", ModelLimits(65536, 8192)),
+    ("deepseek", ModelLimits(65536, 8192)),
+    ("gpt-3.5-turbo", ModelLimits(16385, 4096)),
+    ("gpt-4", ModelLimits(8192, 8192)),
+    ("gpt-4-turbo", ModelLimits(128000, 4096)),
+    ("gpt-4o", ModelLimits(128000, 16384)),
+    ("gpt-4o-2024-05-13", ModelLimits(128000, 4096)),
+    ("gpt-4o-mini", ModelLimits(128000, 16384)),
+    ("gpt-4.1", ModelLimits(1047576, 32768)),
+    ("gpt-5", ModelLimits(400000, 128000)),
+    ("o1", ModelLimits(200000, 100000)),
+    ("o3", ModelLimits(200000, 100000)),
+    ("o4", ModelLimits(200000, 100000)),
+]
+_lock = threading.Lock()
+
+
+def register_model_limits(model_prefix, context_window, max_output):
+    """Declare the context window and output limit of every model starting with model_prefix."""
+    with _lock:
+        _limits.append((model_prefix.lower(), ModelLimits(context_window, max_output)))
+
+
+def get_model_limits(model=None):
+    model = (model or "").lower()
+    with _lock:
+        matches = [(prefix, limits) for prefix, limits in _limits if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_LIMITS
+    return max(matches, key=lambda match: len(match[0]))[1]
+
+
+def group_token_budget(model=None, prompt_tokens=0, output_tokens=0, output_ratio=0.0,
+                       safety_margin=CONTEXT_SAFETY_MARGIN):
+    """
+    Largest page-group size in tokens for one call of a stage.
+
+    prompt_tokens are the fixed prompt parts (instructions, a TOC passed along),
+    output_tokens the fixed part of the expected answer and output_ratio the part of
+    the answer that grows with the group, e.g. the TOC entries found in it. The group,
+    prompt and answer must fit the context window minus the safety margin, and the
+    answer must fit the model's output limit. A budget below MIN_GROUP_TOKENS is logged as
+    an error but kept, since a larger group would overflow the model; ValueError when
+    nothing is left for the pages at all.
+    """
+    limits = get_model_limits(model)
+    usable = limits.context_window * (1 - safety_margin) - prompt_tokens - output_tokens
+    budget = usable / (1 + output_ratio)
+    if output_ratio > 0:
+        budget = min(budget, (limits.max_output * (1 - safety_margin) - output_tokens) / output_ratio)
+    if budget < 1:
+        raise ValueError(f"model {model}: {prompt_tokens} prompt and {output_tokens} output tokens leave no room "
+                         f"for pages (context window {limits.context_window}, max output {limits.max_output})")
+    if budget < MIN_GROUP_TOKENS:
+        logging.error(f"model {model}: page groups limited to {int(budget)} tokens, below {MIN_GROUP_TOKENS}; "
+                      f"expect many small calls (prompt {prompt_tokens}, output {output_tokens} tokens)")
+    return int(min(budget, MAX_GROUP_TOKENS))
@@ -4,7 +4,17 @@ import copy
 import math
 import random
 import re
+import heapq
+import itertools
+import time
 from .utils import *
+from .page_preprocess import preprocess_pages
+from .checkpoint import CheckpointStore
+from .pipeline import Pipeline
+from .tracing import Trace, use_trace
+from .summary_cache import get_summary_cache, use_summary_cache
+from .model_limits import get_model_limits, group_token_budget
+from .index_math import PageTokenIndex, neighbor_valid_indices, match_titles, most_common_offset, wilson_interval, find_out_of_order_items
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -19,6 +29,8 @@ async def check_title_appearance(item, page_list, start_index=1, model=None):
     page_number = item['physical_index']
     if page_number < start_index or page_number >= start_index + len(page_list):
         return {'list_index': item.get('list_index'), 'answer': 'no', 'title': title, 'page_number': None}
+    if is_empty_page(page_list[page_number-start_index]):
+        return {'list_index': item.get('list_index'), 'answer': 'no', 'title': title, 'page_number': page_number}
     page_text = page_list[page_number-start_index][0]
 
     
@@ -83,7 +95,7 @@ async def check_title_appearance_in_start_concurrent(structure, page_list, model
         if physical_index is None:
             item['appear_start'] = 'no'
             continue
-        if physical_index < 1 or physical_index > len(page_list):
+        if physical_index < 1 or physical_index > len(page_list) or is_empty_page(page_list[physical_index - 1]):
             item['appear_start'] = 'no'
 
     # only for items with valid physical_index
@@ -91,7 +103,7 @@ async def check_title_appearance_in_start_concurrent(structure, page_list, model
     valid_items = []
     for item in structure:
         physical_index = item.get('physical_index')
-        if physical_index is not None and 1 <= physical_index <= len(page_list):
+        if physical_index is not None and 1 <= physical_index <= len(page_list) and not is_empty_page(page_list[physical_index - 1]):
             page_text = page_list[physical_index - 1][0]
             tasks.append(check_title_appearance_in_start(item['title'], page_text, model=model, logger=logger))
             valid_items.append(item)
@@ -355,6 +367,10 @@ def find_toc_pages(start_page_index, page_list, opt, logger=None):
         # Only check beyond max_pages if we're still finding TOC pages
         if i >= opt.toc_check_page_num and not last_page_is_yes:
             break
+        if is_empty_page(page_list[i]):
+            # blank pages neither start nor end a toc run
+            i += 1
+            continue
         detected_result = toc_detector_single_page(page_list[i][0],model=opt.model)
         if detected_result == 'yes':
             if logger:
@@ -385,16 +401,15 @@ def remove_page_number(data):
 
 def extract_matching_page_pairs(toc_page, toc_physical_index, start_page_index):
     pairs = []
-    for phy_item in toc_physical_index:
-        for page_item in toc_page:
-            if phy_item.get('title') == page_item.get('title'):
-                physical_index = phy_item.get('physical_index')
-                if physical_index is not None and int(physical_index) >= start_page_index:
-                    pairs.append({
-                        'title': phy_item.get('title'),
-                        'page': page_item.get('page'),
-                        'physical_index': physical_index
-                    })
+    for i, j in match_titles(toc_physical_index, toc_page):
+        phy_item = toc_physical_index[i]
+        physical_index = phy_item.get('physical_index')
+        if physical_index is not None and int(physical_index) >= start_page_index:
+            pairs.append({
+                'title': phy_item.get('title'),
+                'page': toc_page[j].get('page'),
+                'physical_index': physical_index
+            })
     return pairs
 
 
@@ -409,16 +424,7 @@ def calculate_page_offset(pairs):
         except (KeyError, TypeError):
             continue
     
-    if not differences:
-        return None
-    
-    difference_counts = {}
-    for diff in differences:
-        difference_counts[diff] = difference_counts.get(diff, 0) + 1
-    
-    most_common = max(difference_counts.items(), key=lambda x: x[1])[0]
-    
-    return most_common
+    return most_common_offset(differences)
 
 def add_page_offset_to_toc_json(data, offset):
     if offset is None:
@@ -432,15 +438,16 @@ def add_page_offset_to_toc_json(data, offset):
 
 
 
-def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, overlap_page=1):    
+def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, overlap_page=1, with_token_counts=False):    
     num_tokens = sum(token_lengths)
     
     if num_tokens <= max_tokens:
         # merge all pages into one text
         page_text = "".join(page_contents)
-        return [page_text]
+        return ([page_text], [num_tokens]) if with_token_counts else [page_text]
     
     subsets = []
+    subset_tokens = []
     current_subset = []
     current_token_count = 0
 
@@ -451,6 +458,7 @@ def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, over
         if current_token_count + page_tokens > average_tokens_per_part:
 
             subsets.append(''.join(current_subset))
+            subset_tokens.append(current_token_count)
             # Start new subset from overlap if specified
             overlap_start = max(i - overlap_page, 0)
             current_subset = page_contents[overlap_start:i]
@@ -463,11 +471,39 @@ def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, over
     # Add the last subset if it contains any pages
     if current_subset:
         subsets.append(''.join(current_subset))
+        subset_tokens.append(current_token_count)
     
     print('divide page_list to groups', len(subsets))
-    return subsets
+    return (subsets, subset_tokens) if with_token_counts else subsets
 
-def add_page_number_to_toc(part, structure, model=None):
+
+# Expected TOC tokens per token of page text, and the fixed instructions of a TOC prompt
+TOC_OUTPUT_RATIO = 0.1
+TOC_PROMPT_TOKENS = 1500
+
+
+def group_pages_for_model(page_contents, token_lengths, model=None, stage=None, logger=None,
+                          prompt_tokens=TOC_PROMPT_TOKENS, output_tokens=0, output_ratio=0.0):
+    """
+    Page groups as large as the model's context window allows for this stage, instead of
+    a fixed 20k tokens: a 64k or 128k model needs fewer calls, a small model no longer
+    overflows. See group_token_budget for the arguments.
+    """
+    max_tokens = group_token_budget(model, prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                                    output_ratio=output_ratio)
+    group_texts, group_tokens = page_list_to_group_text(page_contents, token_lengths, max_tokens=max_tokens,
+                                                        with_token_counts=True)
+    if logger:
+        logger.info({'page_groups': {
+            'stage': stage,
+            'model': model,
+            'max_tokens': max_tokens,
+            'groups': len(group_texts),
+            'group_tokens': group_tokens,
+        }})
+    return group_texts
+
+def _add_page_number_prompt(part, structure):
     fill_prompt_seq = """
     You are given an JSON structure of a document and a partial part of the document. Your task is to check if the title that is described in the structure is started in the partial given document.
 
@@ -490,7 +526,11 @@ def add_page_number_to_toc(part, structure, model=None):
     The given structure contains the result of the previous part, you need to fill the result of the current part, do not change the previous result.
     Directly return the final JSON structure. Do not output anything else."""
 
-    prompt = fill_prompt_seq + f"\n\nCurrent Partial Document:\n{part}\n\nGiven Structure\n{json.dumps(structure, indent=2)}\n"
+    return fill_prompt_seq + f"\n\nCurrent Partial Document:\n{part}\n\nGiven Structure\n{json.dumps(structure, indent=2)}\n"
+
+
+def add_page_number_to_toc(part, structure, model=None):
+    prompt = _add_page_number_prompt(part, structure)
     current_json_raw = ChatGPT_API(model=model, prompt=prompt)
     json_result = extract_json(current_json_raw)
     
@@ -500,6 +540,16 @@ def add_page_number_to_toc(part, structure, model=None):
     return json_result
 
 
+async def add_page_number_to_toc_async(part, structure, model=None):
+    """Like add_page_number_to_toc, but keeps the "start" flag so callers can ignore "no" answers."""
+    prompt = _add_page_number_prompt(part, structure)
+    current_json_raw = await ChatGPT_API_async(model=model, prompt=prompt)
+    json_result = extract_json(current_json_raw)
+    if isinstance(json_result, dict):
+        json_result = [json_result]
+    return json_result if isinstance(json_result, list) else []
+
+
 def remove_first_physical_index_section(text):
     """
     Removes the first section between <physical_index_X> and <physical_index_X> tags,
@@ -582,14 +632,20 @@ def generate_toc_init(part, model=None):
     else:
         raise Exception(f'finish reason: {finish_reason}')
 
-def process_no_toc(page_list, start_index=1, model=None, logger=None):
+def process_no_toc(page_list, start_index=1, model=None, logger=None, anchors=None):
     page_contents=[]
     token_lengths=[]
     for page_index in range(start_index, start_index+len(page_list)):
-        page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
+        page_text = get_labeled_page_text(page_list[page_index-start_index], page_index)
+        if not page_text:
+            continue
         page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
-    group_texts = page_list_to_group_text(page_contents, token_lengths)
+    # grouping only needs a size bound, not exact counts
+    token_lengths = [estimate_tokens(page_text, model, upper=True) for page_text in page_contents]
+    # generate_toc_continue passes the TOC found so far along, keep up to a quarter of the window for it
+    carried_toc_tokens = min(int(sum(token_lengths) * TOC_OUTPUT_RATIO), get_model_limits(model).context_window // 4)
+    group_texts = group_pages_for_model(page_contents, token_lengths, model=model, stage='generate_toc', logger=logger,
+                                        prompt_tokens=TOC_PROMPT_TOKENS + carried_toc_tokens, output_ratio=TOC_OUTPUT_RATIO)
     logger.info(f'len(group_texts): {len(group_texts)}')
 
     toc_with_page_number= generate_toc_init(group_texts[0], model)
@@ -601,35 +657,339 @@ def process_no_toc(page_list, start_index=1, model=None, logger=None):
     toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
     logger.info(f'convert_physical_index_to_int: {toc_with_page_number}')
 
-    return toc_with_page_number
+    return merge_verified_anchors(toc_with_page_number, anchors)
+
+class TocGroupAnswerError(Exception):
+    """The model answered for a page group, but the answer is cut off or not a JSON list."""
+
+
+async def generate_toc_for_group(part, model=None):
+    prompt = """
+    You are an expert in extracting hierarchical tree structure.
+    You are given one part of a longer document. Your task is to list the sections that start in this part.
+
+    The part may begin in the middle of the document, and its first page may repeat the last page of the previous part; still list every section that starts on any page of the given text.
+
+    For the level, use 1 for top-level sections (e.g. chapters or "1 Introduction"), 2 for their subsections (e.g. "1.2"), 3 for the next level, etc. Judge it from the numbering and wording of the title, not from the position in this part.
+
+    For the title, you need to extract the original title from the text, only fix the space inconsistency.
+
+    The provided text contains tags like <physical_index_X> and <physical_index_X> to indicate the start and end of page X.
 
-def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None):
+    For the physical_index, you need to extract the physical index of the start of the section from the text. Keep the <physical_index_X> format.
+
+    The response should be in the following format.
+        [
+            {
+                "level": <level of the section, 1, 2, 3, ...> (int),
+                "title": <title of the section, keep the original title>,
+                "physical_index": "<physical_index_X> (keep the format)"
+            },
+            ...
+        ]
+
+    If no section starts in the given text, return [].
+    Directly return the final JSON structure. Do not output anything else."""
+
+    prompt = prompt + '\nGiven text\n:' + part
+    response, finish_reason = await ChatGPT_API_with_finish_reason_async(model=model, prompt=prompt)
+    if finish_reason == 'max_output_reached':
+        raise TocGroupAnswerError('answer cut off at the output limit')
+    if finish_reason != 'finished':
+        # 'error': the API call already used up its retries
+        raise Exception(f'finish reason: {finish_reason}')
+    result = extract_json(response)
+    if not isinstance(result, list):
+        raise TocGroupAnswerError('answer is not a JSON list')
+    return result
+
+
+async def generate_toc_for_group_with_retry(group_text, model=None, logger=None):
+    """
+    generate_toc_for_group that copes with answers too long or malformed for the group:
+    such a group is split in two and both halves are retried, down to single pages.
+    Returns None if no part of the group got a usable answer; a single page that fails
+    adds no sections. API errors are raised, smaller groups would not fix them.
+    """
+    try:
+        return await generate_toc_for_group(group_text, model)
+    except TocGroupAnswerError as e:
+        pages = [match.group(0) for match in re.finditer(r'<physical_index_(\d+)>\n.*?\n<physical_index_\1>\n\n', group_text, re.DOTALL)]
+        first_page, last_page = _group_page_range(group_text)
+        if len(pages) < 2:
+            print(f'generate_toc_for_group failed on page {first_page}: {e}')
+            logger.info(f'generate_toc_for_group failed on page {first_page}, no sections from it: {e}')
+            return None
+        print(f'generate_toc_for_group failed on pages {first_page}-{last_page}: {e}, retrying in two halves')
+        logger.info(f'generate_toc_for_group failed on pages {first_page}-{last_page}, retrying in two halves: {e}')
+        half = len(pages) // 2
+        halves = await asyncio.gather(*[generate_toc_for_group_with_retry(''.join(part), model, logger)
+                                        for part in (pages[:half], pages[half:])])
+        if halves[0] is None and halves[1] is None:
+            return None
+        return (halves[0] or []) + (halves[1] or [])
+
+
+def _parse_level(item):
+    level = item.get('level')
+    if level is None and item.get('structure'):
+        level = str(item['structure']).count('.') + 1
+    try:
+        return max(int(level), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def merge_group_tocs(group_tocs):
+    """
+    Merge the section lists extracted from each page group into one TOC.
+
+    Groups overlap by a page, so a section on an overlap page is usually reported twice;
+    entries with the same normalized title and page are kept once. Levels are then turned
+    into "x.x.x" structure indices, a level may only go one deeper than its predecessor.
+    """
+    merged = []
+    seen = set()
+    for group_toc in group_tocs:
+        for item in group_toc:
+            if not isinstance(item, dict):
+                continue
+            title = (item.get('title') or '').strip()
+            physical_index = convert_physical_index_to_int(item.get('physical_index'))
+            if not title or not isinstance(physical_index, int):
+                continue
+            key = (re.sub(r'\s+', '', title).lower(), physical_index)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append({'title': title, 'level': _parse_level(item), 'physical_index': physical_index})
+
+    # stable sort, sections on the same page keep their reading order
+    merged.sort(key=lambda item: item['physical_index'])
+
+    counters = []
+    toc = []
+    for item in merged:
+        level = min(item['level'], len(counters) + 1)
+        counters = counters[:level]
+        if len(counters) < level:
+            counters.append(0)
+        counters[-1] += 1
+        toc.append({
+            'structure': '.'.join(str(c) for c in counters),
+            'title': item['title'],
+            'physical_index': item['physical_index'],
+        })
+    return toc
+
+
+def merge_verified_anchors(toc_items, anchors):
+    """
+    Add the entries an earlier mode already verified to a generated TOC. They win over
+    generated entries with the same title and page, and structure indices are
+    renumbered from the levels of both. A generated entry with the title of an anchor is
+    the same section on a (possibly wrong) page and is dropped.
+    """
+    if not anchors:
+        return toc_items
+    return merge_group_tocs([anchors, without_anchor_titles(toc_items, anchors)])
+
+
+def without_anchor_titles(toc_items, anchors):
+    anchor_titles = {_normalize_title(anchor.get('title')) for anchor in anchors or []}
+    return [item for item in toc_items if _normalize_title(item.get('title')) not in anchor_titles]
+
+
+async def process_no_toc_parallel(page_list, start_index=1, model=None, logger=None, anchors=None):
+    """
+    Map-reduce variant of process_no_toc: every page group extracts its own sections
+    concurrently and merge_group_tocs stitches them together, instead of chaining
+    generate_toc_continue calls that resend the growing TOC.
+    """
     page_contents=[]
-    token_lengths=[]
-    toc_content = toc_transformer(toc_content, model)
+    for page_index in range(start_index, start_index+len(page_list)):
+        page_text = get_labeled_page_text(page_list[page_index-start_index], page_index)
+        if not page_text:
+            continue
+        page_contents.append(page_text)
+    # grouping only needs a size bound, not exact counts
+    token_lengths = [estimate_tokens(page_text, model, upper=True) for page_text in page_contents]
+    group_texts = group_pages_for_model(page_contents, token_lengths, model=model, stage='generate_toc_parallel',
+                                        logger=logger, output_ratio=TOC_OUTPUT_RATIO)
+    logger.info(f'len(group_texts): {len(group_texts)}')
+
+    # every group is still read: anchors may list only the chapters, the sub-sections between them come from the LLM
+    group_tocs = await asyncio.gather(*[generate_toc_for_group_with_retry(group_text, model, logger) for group_text in group_texts])
+    failed_groups = sum(1 for group_toc in group_tocs if group_toc is None)
+    if failed_groups:
+        logger.info(f'page groups without a usable answer: {failed_groups}/{len(group_texts)}')
+        if failed_groups == len(group_texts):
+            raise Exception('generate_toc_for_group got no usable answer for any page group')
+    # anchors are merged with the raw group answers, so the levels of both set the structure
+    group_tocs = [without_anchor_titles(group_toc or [], anchors) for group_toc in group_tocs]
+    toc_with_page_number = merge_group_tocs([anchors or []] + group_tocs)
+    logger.info(f'generate_toc_parallel: {toc_with_page_number}')
+
+    return toc_with_page_number
+
+def _normalize_title(title):
+    return re.sub(r'\s+', '', str(title or '')).lower()
+
+
+def _group_page_range(group_text):
+    indices = [int(i) for i in re.findall(r'<physical_index_(\d+)>', group_text)]
+    return (min(indices), max(indices)) if indices else (None, None)
+
+
+def find_title_anchors(toc_items, page_list, start_index=1, skip_pages=(), fixed=None):
+    """
+    Resolve TOC entries locally when their title is a line of exactly one page.
+    Entries in fixed (already verified, {toc item index: physical_index}) are kept as
+    they are; local anchors that would break the page order of the TOC are dropped.
+    Returns {toc item index: physical_index}.
+    """
+    fixed = fixed or {}
+    line_pages = {}
+    for physical_index, page in enumerate(page_list, start=start_index):
+        if physical_index in skip_pages or is_empty_page(page):
+            continue
+        for line in page[0].split('\n'):
+            key = _normalize_title(line)
+            if key:
+                line_pages.setdefault(key, set()).add(physical_index)
+
+    _, next_fixed = neighbor_valid_indices([fixed.get(i) for i in range(len(toc_items))])
+    anchors = {}
+    last_page = start_index
+    for i, item in enumerate(toc_items):
+        if i in fixed:
+            anchors[i] = fixed[i]
+            last_page = fixed[i]
+            continue
+        pages = line_pages.get(_normalize_title(item.get('title')))
+        if pages and len(pages) == 1:
+            physical_index = next(iter(pages))
+            if physical_index >= last_page and (next_fixed[i] < 0 or physical_index <= next_fixed[i]):
+                anchors[i] = physical_index
+                last_page = physical_index
+    return anchors
+
+
+def match_anchors_to_toc(toc_items, anchors):
+    """Map verified (title, physical_index) anchors onto TOC entries by title, in TOC order."""
+    fixed = {}
+    position = 0
+    for anchor in anchors or []:
+        title = _normalize_title(anchor.get('title'))
+        for i in range(position, len(toc_items)):
+            if _normalize_title(toc_items[i].get('title')) == title:
+                fixed[i] = anchor['physical_index']
+                position = i + 1
+                break
+    return fixed
+
+
+def _match_group_answers(requested, toc_items, answers):
+    """Map the items the LLM returned for one group back to TOC item indices."""
+    by_key = {}
+    by_title = {}
+    for i in requested:
+        by_key.setdefault((str(toc_items[i].get('structure')), _normalize_title(toc_items[i].get('title'))), i)
+        by_title.setdefault(_normalize_title(toc_items[i].get('title')), i)
+    matched = []
+    for position, answer in enumerate(answers):
+        if not isinstance(answer, dict):
+            continue
+        i = by_key.get((str(answer.get('structure')), _normalize_title(answer.get('title'))))
+        if i is None:
+            i = by_title.get(_normalize_title(answer.get('title')))
+        if i is None and len(answers) == len(requested):
+            i = requested[position]
+        if i is not None:
+            matched.append((i, answer))
+    return matched
+
+
+async def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None, anchors=None):
+    """
+    Find the start page of every TOC entry. Entries whose title occurs on exactly one page
+    are resolved locally; the rest are sent, concurrently, to every page group that lies
+    between their resolved neighbours. When several groups answer for an entry, the
+    earliest group's in-range answer wins.
+    """
+    toc_content = await asyncio.to_thread(toc_transformer, toc_content, model)
     logger.info(f'toc_transformer: {toc_content}')
+    page_contents=[]
     for page_index in range(start_index, start_index+len(page_list)):
-        page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
+        page_text = get_labeled_page_text(page_list[page_index-start_index], page_index)
+        if not page_text:
+            continue
         page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
+    # grouping only needs a size bound, not exact counts
+    token_lengths = [estimate_tokens(page_text, model, upper=True) for page_text in page_contents]
     
-    group_texts = page_list_to_group_text(page_contents, token_lengths)
+    # every call gets the TOC entries and answers them back with their physical_index
+    structure_tokens = estimate_tokens(json.dumps(toc_content, ensure_ascii=False), model, upper=True)
+    group_texts = group_pages_for_model(page_contents, token_lengths, model=model, stage='add_page_number',
+                                        logger=logger, prompt_tokens=TOC_PROMPT_TOKENS + structure_tokens,
+                                        output_tokens=int(structure_tokens * 1.2))
     logger.info(f'len(group_texts): {len(group_texts)}')
 
-    toc_with_page_number=copy.deepcopy(toc_content)
-    for group_text in group_texts:
-        toc_with_page_number = add_page_number_to_toc(group_text, toc_with_page_number, model)
-    logger.info(f'add_page_number_to_toc: {toc_with_page_number}')
+    toc_with_page_number = copy.deepcopy(toc_content)
+    skip_pages = {page_index + start_index for page_index in toc_page_list}
+    fixed = match_anchors_to_toc(toc_with_page_number, anchors)
+    anchors = find_title_anchors(toc_with_page_number, page_list, start_index=start_index, skip_pages=skip_pages, fixed=fixed)
+    logger.info(f'title anchors: {len(anchors)}/{len(toc_with_page_number)} ({len(fixed)} verified earlier)')
+
+    # page range each unresolved entry can start in, bounded by the resolved neighbours
+    last_page = start_index + len(page_list) - 1
+    prev_anchor, next_anchor = neighbor_valid_indices([anchors.get(i) for i in range(len(toc_with_page_number))])
+    candidate_ranges = {
+        i: (int(prev_anchor[i]) if prev_anchor[i] >= 0 else start_index,
+            int(next_anchor[i]) if next_anchor[i] >= 0 else last_page)
+        for i in range(len(toc_with_page_number)) if i not in anchors
+    }
 
-    toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
-    logger.info(f'convert_physical_index_to_int: {toc_with_page_number}')
+    group_ranges = [_group_page_range(group_text) for group_text in group_texts]
+    requests = []
+    for group_index, (group_start, group_end) in enumerate(group_ranges):
+        if group_start is None:
+            continue
+        requested = [i for i, (low, high) in candidate_ranges.items() if low <= group_end and high >= group_start]
+        if requested:
+            requests.append((group_index, requested))
+    logger.info(f'add_page_number_to_toc calls: {len(requests)}, entries sent: {sum(len(r) for _, r in requests)}')
+
+    results = await asyncio.gather(*[
+        add_page_number_to_toc_async(
+            group_texts[group_index],
+            [{'structure': toc_with_page_number[i].get('structure'), 'title': toc_with_page_number[i].get('title')} for i in requested],
+            model,
+        )
+        for group_index, requested in requests
+    ])
+
+    resolved = dict(anchors)
+    for (group_index, requested), answers in zip(requests, results):
+        group_start, group_end = group_ranges[group_index]
+        for i, answer in _match_group_answers(requested, toc_with_page_number, answers):
+            if i in resolved or answer.get('start') == 'no':
+                continue
+            physical_index = convert_physical_index_to_int(answer.get('physical_index'))
+            low, high = candidate_ranges[i]
+            if isinstance(physical_index, int) and group_start <= physical_index <= group_end and low <= physical_index <= high:
+                resolved[i] = physical_index
+
+    for i, item in enumerate(toc_with_page_number):
+        item['physical_index'] = resolved.get(i)
+    logger.info(f'add_page_number_to_toc: {toc_with_page_number}')
 
     return toc_with_page_number
 
 
 
-def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None):
-    toc_with_page_number = toc_transformer(toc_content, model)
+async def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None):
+    toc_with_page_number = await asyncio.to_thread(toc_transformer, toc_content, model)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
     toc_no_page_number = remove_page_number(copy.deepcopy(toc_with_page_number))
@@ -637,9 +997,9 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
     start_page_index = toc_page_list[-1] + 1
     main_content = ""
     for page_index in range(start_page_index, min(start_page_index + toc_check_page_num, len(page_list))):
-        main_content += f"<physical_index_{page_index+1}>\n{page_list[page_index][0]}\n<physical_index_{page_index+1}>\n\n"
+        main_content += get_labeled_page_text(page_list[page_index], page_index+1)
 
-    toc_with_physical_index = toc_index_extractor(toc_no_page_number, main_content, model)
+    toc_with_physical_index = await asyncio.to_thread(toc_index_extractor, toc_no_page_number, main_content, model)
     logger.info(f'toc_with_physical_index: {toc_with_physical_index}')
 
     toc_with_physical_index = convert_physical_index_to_int(toc_with_physical_index)
@@ -654,7 +1014,7 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
     toc_with_page_number = add_page_offset_to_toc_json(toc_with_page_number, offset)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
-    toc_with_page_number = process_none_page_numbers(toc_with_page_number, page_list, model=model)
+    toc_with_page_number = await process_none_page_numbers(toc_with_page_number, page_list, model=model)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
     return toc_with_page_number
@@ -662,47 +1022,45 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
 
 
 ##check if needed to process none page numbers
-def process_none_page_numbers(toc_items, page_list, start_index=1, model=None):
-    for i, item in enumerate(toc_items):
-        if "physical_index" not in item:
-            # logger.info(f"fix item: {item}")
-            # Find previous physical_index
-            prev_physical_index = 0  # Default if no previous item exists
-            for j in range(i - 1, -1, -1):
-                if toc_items[j].get('physical_index') is not None:
-                    prev_physical_index = toc_items[j]['physical_index']
-                    break
-            
-            # Find next physical_index
-            next_physical_index = -1  # Default if no next item exists
-            for j in range(i + 1, len(toc_items)):
-                if toc_items[j].get('physical_index') is not None:
-                    next_physical_index = toc_items[j]['physical_index']
-                    break
-
-            page_contents = []
-            for page_index in range(prev_physical_index, next_physical_index+1):
-                # Add bounds checking to prevent IndexError
-                list_index = page_index - start_index
-                if list_index >= 0 and list_index < len(page_list):
-                    page_text = f"<physical_index_{page_index}>\n{page_list[list_index][0]}\n<physical_index_{page_index}>\n\n"
+async def process_none_page_numbers(toc_items, page_list, start_index=1, model=None):
+    """
+    Locate the entries that got no physical_index from the page offset, one concurrent
+    LLM call per entry, each searching the pages between its nearest located neighbours.
+    """
+    async def locate(item, prev_physical_index, next_physical_index):
+        page_contents = []
+        for page_index in range(prev_physical_index, next_physical_index+1):
+            # Add bounds checking to prevent IndexError
+            list_index = page_index - start_index
+            if list_index >= 0 and list_index < len(page_list):
+                page_text = get_labeled_page_text(page_list[list_index], page_index)
+                if page_text:
                     page_contents.append(page_text)
-                else:
-                    continue
 
-            if not page_contents:
-                continue
+        if not page_contents:
+            return
 
-            item_copy = copy.deepcopy(item)
-            del item_copy['page']
-            result = add_page_number_to_toc(page_contents, item_copy, model)
-            if not isinstance(result, list) or not result:
-                continue
-            physical_index_value = result[0].get('physical_index')
-            if isinstance(physical_index_value, str) and physical_index_value.startswith('<physical_index'):
-                item['physical_index'] = int(physical_index_value.split('_')[-1].rstrip('>').strip())
-                del item['page']
-    
+        item_copy = copy.deepcopy(item)
+        item_copy.pop('page', None)
+        result = await add_page_number_to_toc_async(''.join(page_contents), item_copy, model)
+        if not result or not isinstance(result[0], dict) or result[0].get('start') == 'no':
+            return
+        physical_index_value = result[0].get('physical_index')
+        if isinstance(physical_index_value, str) and physical_index_value.startswith('<physical_index'):
+            item['physical_index'] = int(physical_index_value.split('_')[-1].rstrip('>').strip())
+            item.pop('page', None)
+
+    tasks = []
+    last_physical_index = start_index + len(page_list) - 1
+    prev_valid, next_valid = neighbor_valid_indices([item.get('physical_index') for item in toc_items])
+    for i, item in enumerate(toc_items):
+        if "physical_index" not in item:
+            # Default to the document bounds if there is no previous / next located item
+            prev_physical_index = int(prev_valid[i]) if prev_valid[i] >= 0 else 0
+            next_physical_index = int(next_valid[i]) if next_valid[i] >= 0 else last_physical_index
+            tasks.append(locate(item, prev_physical_index, next_physical_index))
+
+    await asyncio.gather(*tasks)
     return toc_items
 
 
@@ -752,7 +1110,7 @@ def check_toc(page_list, opt=None):
 
 
 ################### fix incorrect toc #########################################################
-def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20"):
+async def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20"):
     tob_extractor_prompt = """
     You are given a section title and several pages of a document, your job is to find the physical index of the start page of the section in the partial document.
 
@@ -766,7 +1124,7 @@ def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = tob_extractor_prompt + '\nSection Title:\n' + str(section_title) + '\nDocument pages:\n' + content
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = await ChatGPT_API_async(model=model, prompt=prompt)
     json_content = extract_json(response)    
     return convert_physical_index_to_int(json_content['physical_index'])
 
@@ -777,6 +1135,8 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
     incorrect_indices = {result['list_index'] for result in incorrect_results}
     
     end_index = len(page_list) + start_index - 1
+    prev_valid, next_valid = neighbor_valid_indices(
+        [item.get('physical_index') for item in toc_with_page_number], excluded=incorrect_indices)
     
     incorrect_results_and_range_logs = []
     # Helper function to process and check a single incorrect item
@@ -793,29 +1153,9 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
                 'is_valid': False
             }
         
-        # Find the previous correct item
-        prev_correct = None
-        for i in range(list_index-1, -1, -1):
-            if i not in incorrect_indices and i >= 0 and i < len(toc_with_page_number):
-                physical_index = toc_with_page_number[i].get('physical_index')
-                if physical_index is not None:
-                    prev_correct = physical_index
-                    break
-        # If no previous correct item found, use start_index
-        if prev_correct is None:
-            prev_correct = start_index - 1
-        
-        # Find the next correct item
-        next_correct = None
-        for i in range(list_index+1, len(toc_with_page_number)):
-            if i not in incorrect_indices and i >= 0 and i < len(toc_with_page_number):
-                physical_index = toc_with_page_number[i].get('physical_index')
-                if physical_index is not None:
-                    next_correct = physical_index
-                    break
-        # If no next correct item found, use end_index
-        if next_correct is None:
-            next_correct = end_index
+        # Nearest correct items before and after, falling back to the document bounds
+        prev_correct = int(prev_valid[list_index]) if prev_valid[list_index] >= 0 else start_index - 1
+        next_correct = int(next_valid[list_index]) if next_valid[list_index] >= 0 else end_index
         
         incorrect_results_and_range_logs.append({
             'list_index': list_index,
@@ -827,15 +1167,16 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
         page_contents=[]
         for page_index in range(prev_correct, next_correct+1):
             # Add bounds checking to prevent IndexError
-            list_index = page_index - start_index
-            if list_index >= 0 and list_index < len(page_list):
-                page_text = f"<physical_index_{page_index}>\n{page_list[list_index][0]}\n<physical_index_{page_index}>\n\n"
-                page_contents.append(page_text)
+            page_list_index = page_index - start_index
+            if page_list_index >= 0 and page_list_index < len(page_list):
+                page_text = get_labeled_page_text(page_list[page_list_index], page_index)
+                if page_text:
+                    page_contents.append(page_text)
             else:
                 continue
         content_range = ''.join(page_contents)
         
-        physical_index_int = single_toc_item_index_fixer(incorrect_item['title'], content_range, model)
+        physical_index_int = await single_toc_item_index_fixer(incorrect_item['title'], content_range, model)
         
         # Check if the result is correct
         check_item = incorrect_item.copy()
@@ -912,7 +1253,24 @@ async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorr
 
 
 ################### verify toc #########################################################
-async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
+# Adaptive verification: random batches until the Wilson interval of the accuracy is
+# clearly above or below the threshold meta_processor uses to choose between fixing and
+# falling back. A clean sample above it is accepted after checking only the entries that
+# break the page order; a sample with errors is checked in full for fix_incorrect_toc.
+VERIFY_ACCURACY_THRESHOLD = 0.6
+VERIFY_CONFIDENCE = 0.95
+VERIFY_CONFIDENCE_Z = 1.96
+VERIFY_BATCH_SIZE = 10
+VERIFY_MIN_CHECKS = 20
+
+
+async def verify_toc(page_list, list_result, start_index=1, N=None, model=None, mode='all', logger=None,
+                     known_correct=None, verified_items=None):
+    """
+    Check that TOC entries start on their physical_index and return (accuracy, incorrect results).
+    Entries in known_correct (list indices verified earlier) count as correct without a
+    call; if verified_items is a list, every entry confirmed correct is appended to it.
+    """
     print('start verify_toc')
     # Find the last non-None physical_index
     last_physical_index = None
@@ -924,46 +1282,98 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
     # Early return if we don't have valid physical indices
     if last_physical_index is None or last_physical_index < len(page_list)/2:
         return 0, []
-    
-    # Determine which items to check
-    if N is None:
-        print('check all items')
-        sample_indices = range(0, len(list_result))
-    else:
-        N = min(N, len(list_result))
-        print(f'check {N} items')
-        sample_indices = random.sample(range(0, len(list_result)), N)
 
-    # Prepare items with their list indices
-    indexed_sample_list = []
-    for idx in sample_indices:
-        item = list_result[idx]
-        # Skip items with None physical_index (these were invalidated by validate_and_truncate_physical_indices)
-        if item.get('physical_index') is not None:
-            item_with_index = item.copy()
+    checkable_indices = [idx for idx, item in enumerate(list_result) if item.get('physical_index') is not None]
+    results = {}
+    for idx in known_correct or ():
+        if idx in checkable_indices:
+            results[idx] = {'list_index': idx, 'answer': 'yes', 'title': list_result[idx]['title'],
+                            'page_number': list_result[idx]['physical_index']}
+
+    async def check_indices(indices):
+        indices = [idx for idx in indices if idx not in results]
+        # Prepare items with their list indices
+        indexed_sample_list = []
+        for idx in indices:
+            item_with_index = list_result[idx].copy()
             item_with_index['list_index'] = idx  # Add the original index in list_result
             indexed_sample_list.append(item_with_index)
+        # Run checks concurrently
+        batch_results = await asyncio.gather(*[
+            check_title_appearance(item, page_list, start_index, model)
+            for item in indexed_sample_list
+        ])
+        for idx, result in zip(indices, batch_results):
+            results[idx] = result
+
+    decision = 'all'
+    suspicious_checked = 0
+    if N is not None:
+        N = min(N, len(list_result))
+        print(f'check {N} items')
+        await check_indices([idx for idx in random.sample(range(0, len(list_result)), N) if list_result[idx].get('physical_index') is not None])
+    elif mode != 'adaptive' or len(checkable_indices) <= VERIFY_MIN_CHECKS:
+        print('check all items')
+        await check_indices(checkable_indices)
+    else:
+        # a fixed seed keeps the verification of a document reproducible
+        order = [idx for idx in checkable_indices if idx not in results]
+        random.Random(len(order)).shuffle(order)
+        decision = 'exhausted'
+        for batch_start in range(0, len(order), VERIFY_BATCH_SIZE):
+            await check_indices(order[batch_start:batch_start + VERIFY_BATCH_SIZE])
+            if len(results) < VERIFY_MIN_CHECKS:
+                continue
+            correct = sum(1 for result in results.values() if result['answer'] == 'yes')
+            low, high = wilson_interval(correct, len(results), z=VERIFY_CONFIDENCE_Z)
+            if high < VERIFY_ACCURACY_THRESHOLD:
+                decision = 'below_threshold'
+                break
+            if low > VERIFY_ACCURACY_THRESHOLD:
+                decision = 'above_threshold'
+                break
+
+        if decision == 'above_threshold' and any(result['answer'] != 'yes' for result in results.values()):
+            # the TOC will be fixed and fix_incorrect_toc needs every wrong entry
+            decision = 'fix_needed'
+            await check_indices([idx for idx in order if idx not in results])
+        elif decision == 'above_threshold':
+            # no error in the sample: only check the entries that break the page order
+            suspicious = [idx for idx in find_out_of_order_items([item.get('physical_index') for item in list_result])
+                          if idx not in results]
+            suspicious_checked = len(suspicious)
+            await check_indices(suspicious)
 
-    # Run checks concurrently
-    tasks = [
-        check_title_appearance(item, page_list, start_index, model)
-        for item in indexed_sample_list
-    ]
-    results = await asyncio.gather(*tasks)
-    
     # Process results
     correct_count = 0
     incorrect_results = []
-    for result in results:
+    for idx in sorted(results):
+        result = results[idx]
         if result['answer'] == 'yes':
             correct_count += 1
+            if verified_items is not None:
+                verified_items.append(list_result[idx])
         else:
             incorrect_results.append(result)
     
     # Calculate accuracy
     checked_count = len(results)
     accuracy = correct_count / checked_count if checked_count > 0 else 0
-    print(f"accuracy: {accuracy*100:.2f}%")
+    low, high = wilson_interval(correct_count, checked_count, z=VERIFY_CONFIDENCE_Z)
+    verify_stats = {
+        'items': len(checkable_indices),
+        'checked': checked_count,
+        'known_correct': len(known_correct or ()),
+        'saved_calls': len(checkable_indices) - checked_count + len(known_correct or ()),
+        'suspicious_checked': suspicious_checked,
+        'decision': decision,
+        'confidence': VERIFY_CONFIDENCE,
+        'accuracy_interval': [round(low, 4), round(high, 4)],
+    }
+    if logger:
+        logger.info({'verify_toc': verify_stats})
+    print(f"accuracy: {accuracy*100:.2f}% (checked {checked_count}/{len(checkable_indices)}, "
+          f"{VERIFY_CONFIDENCE:.0%} interval {low*100:.1f}%-{high*100:.1f}%, {decision})")
     return accuracy, incorrect_results
 
 
@@ -971,16 +1381,23 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
 
 
 ################### main process #########################################################
-async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None):
+async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None, anchors=None):
+    """
+    Build and verify the TOC with the given mode, falling back to the next mode when
+    accuracy is too low. Entries verified by a failed mode are carried forward as anchors:
+    later modes keep them and only resolve and verify the remaining entries.
+    """
     print(mode)
     print(f'start_index: {start_index}')
     
     if mode == 'process_toc_with_page_numbers':
-        toc_with_page_number = process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger)
+        toc_with_page_number = await process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger)
     elif mode == 'process_toc_no_page_numbers':
-        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger)
+        toc_with_page_number = await process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger, anchors=anchors)
+    elif opt.toc_generation_mode == 'parallel':
+        toc_with_page_number = await process_no_toc_parallel(page_list, start_index=start_index, model=opt.model, logger=logger, anchors=anchors)
     else:
-        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger)
+        toc_with_page_number = await asyncio.to_thread(process_no_toc, page_list, start_index=start_index, model=opt.model, logger=logger, anchors=anchors)
             
     toc_with_page_number = [item for item in toc_with_page_number if item.get('physical_index') is not None] 
     
@@ -990,13 +1407,20 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
         start_index=start_index, 
         logger=logger
     )
-    
-    accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, model=opt.model)
+
+    anchor_keys = {(_normalize_title(anchor.get('title')), anchor.get('physical_index')) for anchor in anchors or []}
+    known_correct = [i for i, item in enumerate(toc_with_page_number)
+                     if (_normalize_title(item.get('title')), item.get('physical_index')) in anchor_keys]
+    verified_items = []
+    accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, model=opt.model,
+                                                   mode=opt.toc_verify_mode, logger=logger,
+                                                   known_correct=known_correct, verified_items=verified_items)
         
     logger.info({
-        'mode': 'process_toc_with_page_numbers',
+        'mode': mode,
         'accuracy': accuracy,
-        'incorrect_results': incorrect_results
+        'incorrect_results': incorrect_results,
+        'anchors_reused': len(known_correct),
     })
     if accuracy == 1.0 and len(incorrect_results) == 0:
         return toc_with_page_number
@@ -1004,127 +1428,444 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
         toc_with_page_number, incorrect_results = await fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorrect_results,start_index=start_index, max_attempts=3, model=opt.model, logger=logger)
         return toc_with_page_number
     else:
+        anchors = [
+            {'structure': item.get('structure'), 'title': item['title'], 'physical_index': item['physical_index']}
+            for item in verified_items
+        ]
+        logger.info(f'carry {len(anchors)} verified anchors to the next mode')
         if mode == 'process_toc_with_page_numbers':
-            return await meta_processor(page_list, mode='process_toc_no_page_numbers', toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger)
+            return await meta_processor(page_list, mode='process_toc_no_page_numbers', toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger, anchors=anchors)
         elif mode == 'process_toc_no_page_numbers':
-            return await meta_processor(page_list, mode='process_no_toc', start_index=start_index, opt=opt, logger=logger)
+            return await meta_processor(page_list, mode='process_no_toc', start_index=start_index, opt=opt, logger=logger, anchors=anchors)
         else:
             raise Exception('Processing failed')
         
  
-async def process_large_node_recursively(node, page_list, opt=None, logger=None):
-    node_page_list = page_list[node['start_index']-1:node['end_index']]
-    token_num = sum([page[1] for page in node_page_list])
-    
+def _split_token_num(node, opt, token_index):
+    """Token count of the node's pages if it has to be split, else None."""
+    token_num = token_index.range_tokens(node['start_index'], node['end_index'])
     if node['end_index'] - node['start_index'] > opt.max_page_num_each_node and token_num >= opt.max_token_num_each_node:
-        print('large node:', node['title'], 'start_index:', node['start_index'], 'end_index:', node['end_index'], 'token_num:', token_num)
+        return token_num
+    return None
 
-        node_toc_tree = await meta_processor(node_page_list, mode='process_no_toc', start_index=node['start_index'], opt=opt, logger=logger)
-        node_toc_tree = await check_title_appearance_in_start_concurrent(node_toc_tree, page_list, model=opt.model, logger=logger)
-        
-        # Filter out items with None physical_index before post_processing
-        valid_node_toc_items = [item for item in node_toc_tree if item.get('physical_index') is not None]
-        
-        if valid_node_toc_items and node['title'].strip() == valid_node_toc_items[0]['title'].strip():
-            node['nodes'] = post_processing(valid_node_toc_items[1:], node['end_index'])
-            node['end_index'] = valid_node_toc_items[1]['start_index'] if len(valid_node_toc_items) > 1 else node['end_index']
-        else:
-            node['nodes'] = post_processing(valid_node_toc_items, node['end_index'])
-            node['end_index'] = valid_node_toc_items[0]['start_index'] if valid_node_toc_items else node['end_index']
-        
-    if 'nodes' in node and node['nodes']:
-        tasks = [
-            process_large_node_recursively(child_node, page_list, opt, logger=logger)
-            for child_node in node['nodes']
-        ]
-        await asyncio.gather(*tasks)
+
+def collect_large_nodes(nodes, opt, token_index):
+    """
+    (token_num, node) of every node that needs a split. Small nodes cost no LLM call,
+    so their children are searched right away instead of being queued.
+    """
+    large_nodes = []
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        token_num = _split_token_num(node, opt, token_index)
+        if token_num is not None:
+            large_nodes.append((token_num, node))
+        elif node.get('nodes'):
+            stack.extend(node['nodes'])
+    return large_nodes
+
+
+async def split_large_node(node, page_list, opt=None, logger=None, token_num=None):
+    print('large node:', node['title'], 'start_index:', node['start_index'], 'end_index:', node['end_index'], 'token_num:', token_num)
+    node_page_list = page_list[node['start_index']-1:node['end_index']]
+
+    node_toc_tree = await meta_processor(node_page_list, mode='process_no_toc', start_index=node['start_index'], opt=opt, logger=logger)
+    node_toc_tree = await check_title_appearance_in_start_concurrent(node_toc_tree, page_list, model=opt.model, logger=logger)
+    
+    # Filter out items with None physical_index before post_processing
+    valid_node_toc_items = [item for item in node_toc_tree if item.get('physical_index') is not None]
     
+    if valid_node_toc_items and node['title'].strip() == valid_node_toc_items[0]['title'].strip():
+        node['nodes'] = post_processing(valid_node_toc_items[1:], node['end_index'])
+        node['end_index'] = valid_node_toc_items[1]['start_index'] if len(valid_node_toc_items) > 1 else node['end_index']
+    else:
+        node['nodes'] = post_processing(valid_node_toc_items, node['end_index'])
+        node['end_index'] = valid_node_toc_items[0]['start_index'] if valid_node_toc_items else node['end_index']
+    return node
+
+
+async def process_large_nodes(nodes, page_list, opt=None, logger=None, token_index=None, on_progress=None,
+                              on_subtree_done=None):
+    """
+    Split every large node of the tree through a work queue: the node with the largest
+    token mass is split first and at most opt.max_concurrent_splits splits run at once
+    (default: the size of the LLM semaphore). The LLM calls of a split take free slots in
+    the same order, so a huge chapter does not wait behind a crowd of small ones, and
+    sub-trees produced by a split are queued as soon as it finishes.
+    on_subtree_done(position, node) is called once a node of nodes has no splits left
+    anywhere below it. Returns per-split stats.
+    """
+    if token_index is None:
+        token_index = PageTokenIndex(page_list)
+    max_in_flight = max(1, int(getattr(opt, 'max_concurrent_splits', None) or get_llm_semaphore().limit))
+    queue = []
+    order = itertools.count()
+    started_at = time.perf_counter()
+
+    # splits queued or running below each node of nodes
+    pending = [0] * len(nodes)
+
+    def enqueue(candidates, root):
+        for token_num, node in collect_large_nodes(candidates, opt, token_index):
+            pending[root] += 1
+            heapq.heappush(queue, (-token_num, next(order), root, node, time.perf_counter()))
+
+    def finish(root):
+        if pending[root] == 0 and on_subtree_done:
+            on_subtree_done(root, nodes[root])
+
+    async def run_split(node, token_num, queued_at):
+        split_start = time.perf_counter()
+        with use_llm_priority(token_num):
+            await split_large_node(node, page_list, opt, logger=logger, token_num=token_num)
+        return {
+            'title': node['title'],
+            'start_index': node['start_index'],
+            'end_index': node['end_index'],
+            'token_num': token_num,
+            'children': len(node.get('nodes') or []),
+            'queue_wait': round(split_start - queued_at, 3),
+            'latency': round(time.perf_counter() - split_start, 3),
+        }
+
+    for root, node in enumerate(nodes):
+        enqueue([node], root)
+        finish(root)
+    in_flight = {}
+    stats = []
+    try:
+        while queue or in_flight:
+            while queue and len(in_flight) < max_in_flight:
+                neg_token_num, _, root, node, queued_at = heapq.heappop(queue)
+                in_flight[asyncio.ensure_future(run_split(node, -neg_token_num, queued_at))] = (root, node)
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                root, node = in_flight.pop(task)
+                stats.append(task.result())
+                if on_progress:
+                    on_progress('split', node)
+                enqueue(node.get('nodes') or [], root)
+                pending[root] -= 1
+                finish(root)
+    except BaseException:
+        for task in in_flight:
+            task.cancel()
+        raise
+
+    if stats:
+        makespan = time.perf_counter() - started_at
+        print(f"large node splits: {len(stats)}, max in flight: {max_in_flight}, makespan: {makespan:.1f}s")
+        if logger:
+            logger.info({'split_scheduler': {
+                'splits': len(stats),
+                'max_in_flight': max_in_flight,
+                'makespan': round(makespan, 3),
+                'nodes': stats,
+            }})
+    return stats
+
+
+async def process_large_node_recursively(node, page_list, opt=None, logger=None, token_index=None, on_progress=None):
+    await process_large_nodes([node], page_list, opt, logger=logger, token_index=token_index, on_progress=on_progress)
     return node
 
-async def tree_parser(page_list, opt, doc=None, logger=None):
-    check_toc_result = check_toc(page_list, opt)
+async def tree_parser(page_list, opt, doc=None, logger=None, checkpoint=None, on_progress=None):
+    """
+    Build the document tree. on_progress(event, payload), if given, is called with
+    ('tree', top-level nodes) as soon as post_processing has produced them and with
+    ('split', node) whenever a large node got its sub-tree.
+    """
+    toc_tree, resumed = await build_toc_tree(page_list, opt, doc=doc, logger=logger, checkpoint=checkpoint, on_progress=on_progress)
+    if not resumed:
+        await process_large_nodes(toc_tree, page_list, opt, logger=logger, on_progress=on_progress)
+        if checkpoint:
+            checkpoint.save('tree', toc_tree)
+    return toc_tree
+
+
+async def build_toc_tree(page_list, opt, doc=None, logger=None, checkpoint=None, on_progress=None):
+    """
+    Top-level tree of the document before large nodes are split. Returns (tree, resumed),
+    resumed meaning the tree was loaded from the checkpoint with all splits already done.
+    """
+    if checkpoint:
+        toc_tree = checkpoint.load('tree')
+        if toc_tree is not None:
+            logger.info('resume: tree')
+            if on_progress:
+                on_progress('tree', toc_tree)
+            return toc_tree, True
+
+    check_toc_result = checkpoint.load('check_toc') if checkpoint else None
+    if check_toc_result is None:
+        check_toc_result = await asyncio.to_thread(check_toc, page_list, opt)
+        if checkpoint:
+            checkpoint.save('check_toc', check_toc_result)
+    else:
+        logger.info('resume: check_toc')
     logger.info(check_toc_result)
 
-    if check_toc_result.get("toc_content") and check_toc_result["toc_content"].strip() and check_toc_result["page_index_given_in_toc"] == "yes":
-        toc_with_page_number = await meta_processor(
-            page_list, 
-            mode='process_toc_with_page_numbers', 
-            start_index=1, 
-            toc_content=check_toc_result['toc_content'], 
-            toc_page_list=check_toc_result['toc_page_list'], 
-            opt=opt,
-            logger=logger)
+    toc_with_page_number = checkpoint.load('toc') if checkpoint else None
+    if toc_with_page_number is not None:
+        logger.info('resume: toc')
     else:
-        toc_with_page_number = await meta_processor(
-            page_list, 
-            mode='process_no_toc', 
-            start_index=1, 
-            opt=opt,
-            logger=logger)
-
-    toc_with_page_number = add_preface_if_needed(toc_with_page_number)
-    toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger)
+        if check_toc_result.get("toc_content") and check_toc_result["toc_content"].strip() and check_toc_result["page_index_given_in_toc"] == "yes":
+            toc_with_page_number = await meta_processor(
+                page_list, 
+                mode='process_toc_with_page_numbers', 
+                start_index=1, 
+                toc_content=check_toc_result['toc_content'], 
+                toc_page_list=check_toc_result['toc_page_list'], 
+                opt=opt,
+                logger=logger)
+        else:
+            toc_with_page_number = await meta_processor(
+                page_list, 
+                mode='process_no_toc', 
+                start_index=1, 
+                opt=opt,
+                logger=logger)
+        if checkpoint:
+            checkpoint.save('toc', toc_with_page_number)
+
+    verified_toc = checkpoint.load('verified_toc') if checkpoint else None
+    if verified_toc is not None:
+        logger.info('resume: verified_toc')
+        toc_with_page_number = verified_toc
+    else:
+        toc_with_page_number = add_preface_if_needed(toc_with_page_number)
+        toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger)
+        if checkpoint:
+            checkpoint.save('verified_toc', toc_with_page_number)
     
     # Filter out items with None physical_index before post_processings
     valid_toc_items = [item for item in toc_with_page_number if item.get('physical_index') is not None]
     
     toc_tree = post_processing(valid_toc_items, len(page_list))
-    tasks = [
-        process_large_node_recursively(node, page_list, opt, logger=logger)
-        for node in toc_tree
-    ]
-    await asyncio.gather(*tasks)
-    
-    return toc_tree
+    if on_progress:
+        on_progress('tree', toc_tree)
+    return toc_tree, False
 
 
-def page_index_main(doc, opt=None):
-    logger = JsonLogger(doc)
-    
-    is_valid_pdf = (
-        (isinstance(doc, str) and os.path.isfile(doc) and doc.lower().endswith(".pdf")) or 
-        isinstance(doc, BytesIO)
-    )
-    if not is_valid_pdf:
-        raise ValueError("Unsupported input type. Expected a PDF file path or BytesIO object.")
+def build_index_pipeline(doc, opt, logger, checkpoint=None, on_progress=None):
+    """
+    Stages of page_index_main:
+
+        page_list -> toc_tree -> split -> structure ----------------------------> result
+                                   |          \                               /   /
+                                   |           +-> doc_description ----------+   /
+                                   |          /                                 /
+                                   +-> top_summaries                           /
+                                   +-> summary:<n> ... -> summaries ----------+
+
+    split adds one summary:<n> stage per top-level node as soon as no split is left in
+    its sub-tree, so summaries overlap with the splitting of the remaining chapters.
+    top_summaries finishes once the outline for the document description is summarized,
+    so the description runs alongside the summaries still in flight. In flat mode that is
+    every top-level node. bottom_up summarizes a top-level node last, after its whole
+    sub-tree, so there a node whose children all have their summaries counts as ready:
+    the description starts from the level-2 summaries while the chapter summaries run.
+    """
+    pipeline = Pipeline('page_index')
+    add_summaries = opt.if_add_node_summary == 'yes'
+    add_description = add_summaries and opt.if_add_doc_description == 'yes'
+    top_nodes = []
+    top_summaries_ready = None
+
+    def description_ready(top_node):
+        if 'summary' in top_node:
+            return True
+        children = top_node.get('nodes') or []
+        return opt.summary_mode == 'bottom_up' and bool(children) and all('summary' in child for child in children)
+
+    def on_summary(node):
+        if on_progress:
+            on_progress('summary', node)
+        if top_summaries_ready is not None and all(description_ready(top_node) for top_node in top_nodes):
+            top_summaries_ready.set()
+
+    summary_stats = {}
+    summary_opts = {
+        'summary_token_threshold': int(getattr(opt, 'summary_token_threshold', None) or 0),
+        'pack_tokens': int(getattr(opt, 'summary_pack_tokens', None) or 0),
+        'stats': summary_stats,
+    }
 
-    print('Parsing PDF...')
-    page_list = get_page_tokens(doc)
+    def load_pages():
+        page_list = get_page_tokens(doc, model=opt.model, token_mode=opt.token_count_mode)
+
+        logger.info({'total_page_number': len(page_list)})
+        logger.info({'total_token': sum([page[1] for page in page_list])})
+        logger.info({'token_estimator': get_token_estimator().to_dict()})
+
+        if opt.if_preprocess_pages == 'yes':
+            page_list, preprocess_stats = preprocess_pages(page_list, model=opt.model, token_mode=opt.token_count_mode)
+            logger.info({'preprocess_pages': preprocess_stats})
+            print(f"Preprocessed pages: {len(preprocess_stats['empty_pages'])} empty, "
+                  f"{preprocess_stats['tokens_before']} -> {preprocess_stats['tokens_after']} tokens")
+        return page_list
+
+    async def toc_tree(page_list):
+        return await build_toc_tree(page_list, opt, doc=doc, logger=logger, checkpoint=checkpoint, on_progress=on_progress)
 
-    logger.info({'total_page_number': len(page_list)})
-    logger.info({'total_token': sum([page[1] for page in page_list])})
+    async def split(page_list, toc_tree, resumed):
+        summary_stages = []
+        top_nodes[:] = toc_tree
 
-    async def page_index_builder():
-        structure = await tree_parser(page_list, opt, doc=doc, logger=logger)
+        def on_subtree_done(position, node):
+            if not add_summaries:
+                return
+
+            async def summarize_subtree(page_list):
+                if opt.summary_mode == 'bottom_up':
+                    await generate_summaries_bottom_up(node, page_list, model=opt.model, checkpoint=checkpoint,
+                                                       on_summary=on_summary, **summary_opts)
+                else:
+                    add_node_text(node, page_list)
+                    await generate_summaries_for_structure(node, model=opt.model, checkpoint=checkpoint,
+                                                           on_summary=on_summary, **summary_opts)
+
+            summary_stages.append(pipeline.add_stage(f'summary:{position}', summarize_subtree, inputs=('page_list',)).name)
+
+        if resumed:
+            for position, node in enumerate(toc_tree):
+                on_subtree_done(position, node)
+        else:
+            await process_large_nodes(toc_tree, page_list, opt, logger=logger, on_progress=on_progress,
+                                      on_subtree_done=on_subtree_done)
+            if checkpoint:
+                checkpoint.save('tree', toc_tree)
+
+        async def summaries(**done):
+            logger.info({'summaries': summary_stats})
+            requests = sum(summary_stats.get(name, 0) for name in ('packed_calls', 'single_calls', 'parent_calls'))
+            print(f"Summaries: {summary_stats.get('nodes', 0)} text nodes, {summary_stats.get('passthrough', 0)} passed through, "
+                  f"{summary_stats.get('packed_nodes', 0)} packed into {summary_stats.get('packed_calls', 0)} prompts, "
+                  f"{requests} requests")
+            return len(done)
+
+        if add_summaries:
+            pipeline.add_stage('summaries', summaries, inputs=summary_stages)
+        return toc_tree
+
+    async def structure(split):
         if opt.if_add_node_id == 'yes':
-            write_node_id(structure)    
+            write_node_id(split)
+        if on_progress:
+            on_progress('structure', split)
+        return split
+
+    async def top_summaries(split):
+        nonlocal top_summaries_ready
+        top_summaries_ready = asyncio.Event()
+        if all(description_ready(top_node) for top_node in top_nodes):
+            top_summaries_ready.set()
+        await top_summaries_ready.wait()
+        return len(top_nodes)
+
+    async def doc_description(structure, top_summaries):
+        usage = {}
+        description = await generate_doc_description_async(structure, model=opt.model, usage=usage)
+        logger.info({'doc_description': usage})
+        return description
+
+    async def result(page_list, structure, summaries=None, doc_description=None):
         if opt.if_add_node_text == 'yes':
             add_node_text(structure, page_list)
-        if opt.if_add_node_summary == 'yes':
-            if opt.if_add_node_text == 'no':
-                add_node_text(structure, page_list)
-            await generate_summaries_for_structure(structure, model=opt.model)
-            if opt.if_add_node_text == 'no':
-                remove_structure_text(structure)
-            if opt.if_add_doc_description == 'yes':
-                # Create a clean structure without unnecessary fields for description generation
-                clean_structure = create_clean_structure_for_description(structure)
-                doc_description = generate_doc_description(clean_structure, model=opt.model)
-                return {
-                    'doc_name': get_pdf_name(doc),
-                    'doc_description': doc_description,
-                    'structure': structure,
-                }
+        elif add_summaries:
+            remove_structure_text(structure)
+        # text and summaries may be written before the node ids, keep the key order of a sequential run
+        for node in structure_to_list(structure):
+            for key in ('text', 'summary'):
+                if key in node:
+                    node[key] = node.pop(key)
+        if add_description:
+            return {
+                'doc_name': get_pdf_name(doc),
+                'doc_description': doc_description,
+                'structure': structure,
+            }
         return {
             'doc_name': get_pdf_name(doc),
             'structure': structure,
         }
 
-    return asyncio.run(page_index_builder())
+    pipeline.add_stage('page_list', load_pages)
+    pipeline.add_stage('toc_tree', toc_tree, inputs=('page_list',), outputs=('toc_tree', 'resumed'))
+    pipeline.add_stage('split', split, inputs=('page_list', 'toc_tree', 'resumed'))
+    pipeline.add_stage('structure', structure, inputs=('split',))
+    result_inputs = ['page_list', 'structure']
+    if add_summaries:
+        result_inputs.append('summaries')
+    if add_description:
+        pipeline.add_stage('top_summaries', top_summaries, inputs=('split',))
+        pipeline.add_stage('doc_description', doc_description, inputs=('structure', 'top_summaries'))
+        result_inputs.append('doc_description')
+    pipeline.add_stage('result', result, inputs=result_inputs)
+    return pipeline
+
+
+async def page_index_main_async(doc, opt=None, on_progress=None):
+    """
+    Index a PDF on the running event loop, e.g. from a FastAPI handler or a worker
+    loop. on_progress(event, payload) receives partial results while the run is
+    going: 'tree' and 'split' from tree_parser, ('structure', tree) once node ids are
+    assigned and ('summary', node) for every finished node summary.
+    """
+    logger = JsonLogger(doc)
+    
+    is_valid_pdf = (
+        (isinstance(doc, str) and os.path.isfile(doc) and doc.lower().endswith(".pdf")) or 
+        isinstance(doc, BytesIO)
+    )
+    if not is_valid_pdf:
+        raise ValueError("Unsupported input type. Expected a PDF file path or BytesIO object.")
+
+    checkpoint = CheckpointStore(opt.checkpoint_dir, doc, opt) if opt.checkpoint_dir else None
+    if checkpoint:
+        result = checkpoint.load('result')
+        if result is not None:
+            print('Loaded finished index from checkpoint')
+            return result
+
+    print('Parsing PDF...')
+    pipeline = build_index_pipeline(doc, opt, logger, checkpoint=checkpoint, on_progress=on_progress)
+    trace = Trace(get_pdf_name(doc))
+    summary_cache = get_summary_cache(opt.summary_cache_path) if getattr(opt, 'summary_cache_path', None) else None
+    with use_trace(trace), use_summary_cache(summary_cache) as cache_usage, use_token_estimator(), use_token_cache():
+        values = await pipeline.run()
+    result = values['result']
+
+    logger.info({'pipeline': {'critical_path': pipeline.critical_path()}})
+    if cache_usage:
+        logger.info({'summary_cache': cache_usage.stats()})
+        print(f"Summary cache: {cache_usage.hits} hits, {cache_usage.misses} misses")
+    if getattr(opt, 'trace_dir', None):
+        trace_path = os.path.join(opt.trace_dir, f"{os.path.splitext(get_pdf_name(doc))[0]}_trace.json")
+        print(f'Execution trace saved to: {trace.save(trace_path)}')
+    if checkpoint:
+        checkpoint.save('result', result)
+    return result
+
+
+def page_index_main(doc, opt=None, on_progress=None):
+    """Sync wrapper of page_index_main_async for the CLI, runs its own event loop."""
+    async def run():
+        try:
+            return await page_index_main_async(doc, opt, on_progress=on_progress)
+        finally:
+            await close_llm_clients()
+
+    return asyncio.run(run())
 
 
 def page_index(doc, model=None, toc_check_page_num=None, max_page_num_each_node=None, max_token_num_each_node=None,
-               if_add_node_id=None, if_add_node_summary=None, if_add_doc_description=None, if_add_node_text=None):
+               if_add_node_id=None, if_add_node_summary=None, if_add_doc_description=None, if_add_node_text=None,
+               if_preprocess_pages=None, token_count_mode=None, toc_generation_mode=None, toc_verify_mode=None,
+               max_concurrent_splits=None, summary_mode=None, summary_token_threshold=None,
+               summary_pack_tokens=None, checkpoint_dir=None, trace_dir=None,
+               summary_cache_path=None):
     
     user_opt = {
         arg: value for arg, value in locals().items()
@@ -1134,6 +1875,21 @@ def page_index(doc, model=None, toc_check_page_num=None, max_page_num_each_node=
     return page_index_main(doc, opt)
 
 
+async def page_index_async(doc, model=None, toc_check_page_num=None, max_page_num_each_node=None, max_token_num_each_node=None,
+                           if_add_node_id=None, if_add_node_summary=None, if_add_doc_description=None, if_add_node_text=None,
+                           if_preprocess_pages=None, token_count_mode=None, toc_generation_mode=None, toc_verify_mode=None,
+                           max_concurrent_splits=None, summary_mode=None, summary_token_threshold=None,
+                           summary_pack_tokens=None, checkpoint_dir=None, trace_dir=None,
+                           summary_cache_path=None):
+    """page_index for callers that already run an event loop."""
+    user_opt = {
+        arg: value for arg, value in locals().items()
+        if arg != "doc" and value is not None
+    }
+    opt = ConfigLoader().load(user_opt)
+    return await page_index_main_async(doc, opt)
+
+
 def validate_and_truncate_physical_indices(toc_with_page_number, page_list_length, start_index=1, logger=None):
     """
     Validates and truncates physical indices that exceed the actual document length.
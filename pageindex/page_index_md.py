@@ -1,11 +1,15 @@
 import asyncio
+import hashlib
 import json
+import mmap
 import re
 import os
 try:
     from .utils import *
+    from .summary_cache import get_summary_cache, use_summary_cache
 except:
     from utils import *
+    from summary_cache import get_summary_cache, use_summary_cache
 
 async def get_node_summary(node, summary_token_threshold=200, model=None):
     node_text = node.get('text')
@@ -16,10 +20,19 @@ async def get_node_summary(node, summary_token_threshold=200, model=None):
         return await generate_node_summary(node, model=model)
 
 
-async def generate_summaries_for_structure_md(structure, summary_token_threshold, model=None):
+async def generate_summaries_for_structure_md(structure, summary_token_threshold, model=None, pack_tokens=0, only_missing=False):
     nodes = structure_to_list(structure)
-    tasks = [get_node_summary(node, summary_token_threshold=summary_token_threshold, model=model) for node in nodes]
-    summaries = await asyncio.gather(*tasks)
+    if only_missing:
+        # sections that kept their summary from the previous run
+        nodes = [node for node in nodes if 'summary' not in node and 'prefix_summary' not in node]
+    # count every text in one batch off the loop, the per-node counts below hit the token cache
+    await asyncio.to_thread(count_tokens_many, [node.get('text', '') for node in nodes], model=model)
+    if pack_tokens:
+        summaries = await asyncio.gather(*start_text_summaries(
+            nodes, model=model, summary_token_threshold=summary_token_threshold, pack_tokens=pack_tokens))
+    else:
+        tasks = [get_node_summary(node, summary_token_threshold=summary_token_threshold, model=model) for node in nodes]
+        summaries = await asyncio.gather(*tasks)
     
     for node, summary in zip(nodes, summaries):
         if not node.get('nodes'):
@@ -86,104 +99,298 @@ def extract_node_text_content(node_list, markdown_lines):
         node['text'] = '\n'.join(markdown_lines[start_line:end_line]).strip()    
     return all_nodes
 
-def update_node_list_with_text_token_count(node_list, model=None):
 
-    def find_all_children(parent_index, parent_level, node_list):
-        """Find all direct and indirect children of a parent node"""
-        children_indices = []
-        
-        # Look for children after the parent
-        for i in range(parent_index + 1, len(node_list)):
-            current_level = node_list[i]['level']
-            
-            # If we hit a node at same or higher level than parent, stop
-            if current_level <= parent_level:
-                break
-                
-            # This is a descendant
-            children_indices.append(i)
-        
-        return children_indices
-    
+class MarkdownFile:
+    """
+    Markdown file mapped into memory. Nodes keep byte ranges ('text_ranges') instead of
+    text copies; text() decodes a node's ranges only when the text is actually needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return len(self._data)
+
+    def candidate_lines(self):
+        """
+        (line number, byte offset, line) of every line that may be a heading or a code
+        fence, i.e. starts with '#' or '```' after whitespace. Lines are read through the
+        file buffer, so scanning does not pull the mapped pages into memory.
+        """
+        self._file.seek(0)
+        offset = 0
+        for line_num, line in enumerate(self._file, 1):
+            if line.lstrip().startswith((b'#', b'```')):
+                yield line_num, offset, line.rstrip(b'\n')
+            offset += len(line)
+
+    def text(self, ranges):
+        """Text of byte ranges, every range stripped and the non-empty ones joined by a blank line."""
+        parts = []
+        for start, end in ranges:
+            # same newlines as reading the file in text mode
+            part = self._data[start:end].decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').strip()
+            if part:
+                parts.append(part)
+        return '\n\n'.join(parts)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def scan_markdown_headings(source):
+    """
+    Streaming counterpart of extract_nodes_from_markdown + extract_node_text_content:
+    one pass over the file, every node gets its title, line number, level and the byte
+    range from its heading to the next heading, without holding the text.
+    """
+    header_pattern = re.compile(r'^(#{1,6})\s+(.+)$')
+    node_list = []
+    in_code_block = False
+    heading_start = 0
+
+    for line_num, offset, raw_line in source.candidate_lines():
+        line = raw_line.decode('utf-8').rstrip('\r')
+        stripped_line = line.strip()
+
+        if stripped_line.startswith('```'):
+            in_code_block = not in_code_block
+            continue
+        if in_code_block:
+            continue
+
+        match = header_pattern.match(stripped_line)
+        if not match:
+            continue
+        header_match = re.match(r'^(#{1,6})', line)
+        if header_match is None:
+            print(f"Warning: Line {line_num} does not contain a valid header: '{line}'")
+            continue
+        # the previous node's text ends where this heading starts
+        if node_list:
+            node_list[-1]['text_ranges'] = [(heading_start, offset)]
+        heading_start = offset
+        node_list.append({
+            'title': match.group(2).strip(),
+            'line_num': line_num,
+            'level': len(header_match.group(1)),
+            'text_ranges': [],
+        })
+
+    if node_list:
+        node_list[-1]['text_ranges'] = [(heading_start, len(source))]
+    return node_list
+
+
+def get_md_node_text(node, source=None):
+    """Text of a node from extract_node_text_content ('text') or scan_markdown_headings ('text_ranges')."""
+    if 'text' in node or source is None:
+        return node.get('text', '')
+    return source.text(node['text_ranges'])
+
+
+def add_markdown_node_text(structure, source):
+    """Materialize 'text' from 'text_ranges' for every node of the tree."""
+    for node in structure_to_list(structure):
+        if 'text' not in node and 'text_ranges' in node:
+            node['text'] = source.text(node.pop('text_ranges'))
+    return structure
+
+
+def md_text_hash(text):
+    """Hash of a section's own text, stored as 'text_hash' and compared on re-index."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def add_markdown_text_hashes(structure, source=None):
+    for node in structure_to_list(structure):
+        node['text_hash'] = md_text_hash(get_md_node_text(node, source))
+    return structure
+
+
+def md_section_keys(structure):
+    """
+    (node, key) for every node in document order. The key is the path of titles from
+    the root, each with its position among same-titled siblings, so a section keeps its
+    key when sections are inserted or removed elsewhere.
+    """
+    entries = []
+
+    def walk(nodes, parent_key):
+        seen = {}
+        for node in nodes:
+            position = seen.get(node['title'], 0)
+            seen[node['title']] = position + 1
+            key = parent_key + ((node['title'], position),)
+            entries.append((node, key))
+            walk(node.get('nodes') or [], key)
+
+    walk(structure, ())
+    return entries
+
+
+def reuse_previous_sections(structure, previous_structure, keep_node_ids=True):
+    """
+    Match the sections of a freshly parsed tree (with 'text_hash') against the tree of
+    the previous run: by title path first, then the remaining ones by text hash, which
+    catches moved sections. Matched sections keep their node_id, new ones get IDs after
+    the largest previous one. A section whose text is unchanged and whose children are
+    the same sections as before keeps its summary/prefix_summary; changed, added sections
+    and their ancestors get none, so only they are summarized again.
+    Returns counts of unchanged, changed, added and removed sections.
+    """
+    previous_entries = md_section_keys(previous_structure)
+    entries = md_section_keys(structure)
+
+    previous_by_key = {key: node for node, key in previous_entries}
+    matches = {}
+    used = set()
+    for node, key in entries:
+        previous_node = previous_by_key.get(key)
+        if previous_node is not None:
+            matches[id(node)] = previous_node
+            used.add(id(previous_node))
+
+    previous_by_hash = {}
+    for previous_node, _ in previous_entries:
+        if id(previous_node) not in used and previous_node.get('text_hash'):
+            previous_by_hash.setdefault(previous_node['text_hash'], []).append(previous_node)
+    for node, _ in entries:
+        candidates = previous_by_hash.get(node['text_hash'])
+        if id(node) not in matches and candidates:
+            previous_node = candidates.pop(0)
+            matches[id(node)] = previous_node
+            used.add(id(previous_node))
+
+    counts = {'unchanged': 0, 'changed': 0, 'added': 0, 'removed': len(previous_entries) - len(used)}
+
+    def mark(nodes):
+        any_dirty = False
+        for node in nodes:
+            children = node.get('nodes') or []
+            children_dirty = mark(children)
+            previous_node = matches.get(id(node))
+            if previous_node is None:
+                counts['added'] += 1
+                any_dirty = True
+                continue
+            same_children = [id(matches.get(id(child))) for child in children] == \
+                [id(child) for child in previous_node.get('nodes') or []]
+            if children_dirty or not same_children or previous_node.get('text_hash') != node['text_hash']:
+                counts['changed'] += 1
+                any_dirty = True
+                continue
+            counts['unchanged'] += 1
+            for key in ('summary', 'prefix_summary'):
+                if previous_node.get(key):
+                    node[key] = previous_node[key]
+        return any_dirty
+
+    mark(structure)
+
+    if keep_node_ids:
+        previous_ids = [int(node['node_id']) for node, _ in previous_entries if str(node.get('node_id', '')).isdigit()]
+        next_id = max(previous_ids, default=-1) + 1
+        for node, _ in entries:
+            previous_node = matches.get(id(node))
+            if previous_node is not None and previous_node.get('node_id'):
+                node['node_id'] = previous_node['node_id']
+            else:
+                node['node_id'] = str(next_id).zfill(4)
+                next_id += 1
+    return counts
+
+
+def find_subtree_ends(node_list):
+    """
+    For every node the index one past its last descendant, in one pass with a stack
+    of open headings: a node's subtree ends at the next node of the same or a higher level.
+    """
+    ends = [len(node_list)] * len(node_list)
+    stack = []
+    for i, node in enumerate(node_list):
+        while stack and node_list[stack[-1]]['level'] >= node['level']:
+            ends[stack.pop()] = i
+        stack.append(i)
+    return ends
+
+
+def update_node_list_with_text_token_count(node_list, model=None, source=None, batch_size=2000):
+    """
+    Set 'text_token_count' of every node to the tokens of its own text plus all its
+    descendants' texts. Every text is tokenized once; subtree totals come from prefix
+    sums over the own counts, plus one token per newline that joins two texts.
+    With a MarkdownFile source, texts are read from their ranges batch_size at a time.
+    """
     # Make a copy to avoid modifying the original
     result_list = node_list.copy()
-    
-    # Process nodes from end to beginning to ensure children are processed before parents
-    for i in range(len(result_list) - 1, -1, -1):
-        current_node = result_list[i]
-        current_level = current_node['level']
-        
-        # Get all children of this node
-        children_indices = find_all_children(i, current_level, result_list)
-        
-        # Start with the node's own text
-        node_text = current_node.get('text', '')
-        total_text = node_text
-        
-        # Add all children's text
-        for child_index in children_indices:
-            child_text = result_list[child_index].get('text', '')
-            if child_text:
-                total_text += '\n' + child_text
-        
-        # Calculate token count for combined text
-        result_list[i]['text_token_count'] = count_tokens(total_text, model=model)
-    
+    own_counts = []
+    for batch_start in range(0, len(result_list), batch_size):
+        batch = result_list[batch_start:batch_start + batch_size]
+        own_counts.extend(count_tokens_many([get_md_node_text(node, source) for node in batch], model=model))
+    ends = find_subtree_ends(result_list)
+
+    token_prefix = [0]
+    text_prefix = [0]
+    for num_tokens in own_counts:
+        token_prefix.append(token_prefix[-1] + num_tokens)
+        text_prefix.append(text_prefix[-1] + (1 if num_tokens else 0))
+
+    for i, end in enumerate(ends):
+        separators = text_prefix[end] - text_prefix[i + 1]
+        result_list[i]['text_token_count'] = token_prefix[end] - token_prefix[i] + separators
+
     return result_list
 
 
-def tree_thinning_for_index(node_list, min_node_token=None, model=None):
-    def find_all_children(parent_index, parent_level, node_list):
-        children_indices = []
-        
-        for i in range(parent_index + 1, len(node_list)):
-            current_level = node_list[i]['level']
-            
-            if current_level <= parent_level:
-                break
-                
-            children_indices.append(i)
-        
-        return children_indices
-    
-    result_list = node_list.copy()
-    nodes_to_remove = set()
-    
-    for i in range(len(result_list) - 1, -1, -1):
-        if i in nodes_to_remove:
+def tree_thinning_for_index(node_list, min_node_token=None, model=None, source=None):
+    """
+    Merge every node whose subtree has fewer than min_node_token tokens with all its
+    descendants. Only the outermost such nodes are kept, so the text is joined and
+    re-tokenized once per kept node instead of once per level. Nodes read from a
+    MarkdownFile source merge their byte ranges instead of their text.
+    """
+    result_list = []
+    ends = find_subtree_ends(node_list)
+
+    i = 0
+    while i < len(node_list):
+        current_node = node_list[i]
+        if current_node.get('text_token_count', 0) >= min_node_token:
+            result_list.append(current_node)
+            i += 1
             continue
-            
-        current_node = result_list[i]
-        current_level = current_node['level']
-        
-        total_tokens = current_node.get('text_token_count', 0)
-        
-        if total_tokens < min_node_token:
-            children_indices = find_all_children(i, current_level, result_list)
-            
-            children_texts = []
-            for child_index in sorted(children_indices):
-                if child_index not in nodes_to_remove:
-                    child_text = result_list[child_index].get('text', '')
-                    if child_text.strip():
-                        children_texts.append(child_text)
-                    nodes_to_remove.add(child_index)
-            
-            if children_texts:
-                parent_text = current_node.get('text', '')
-                merged_text = parent_text
-                for child_text in children_texts:
-                    if merged_text and not merged_text.endswith('\n'):
-                        merged_text += '\n\n'
-                    merged_text += child_text
-                
-                result_list[i]['text'] = merged_text
-                
-                result_list[i]['text_token_count'] = count_tokens(merged_text, model=model)
-    
-    for index in sorted(nodes_to_remove, reverse=True):
-        result_list.pop(index)
-    
+
+        if 'text' not in current_node and source is not None:
+            if ends[i] > i + 1:
+                for j in range(i + 1, ends[i]):
+                    current_node['text_ranges'] = current_node['text_ranges'] + node_list[j]['text_ranges']
+                current_node['text_token_count'] = count_tokens(source.text(current_node['text_ranges']), model=model)
+            result_list.append(current_node)
+            i = ends[i]
+            continue
+
+        children_texts = [node_list[j].get('text', '') for j in range(i + 1, ends[i])]
+        children_texts = [text for text in children_texts if text.strip()]
+        if children_texts:
+            parent_text = current_node.get('text', '')
+            current_node['text'] = '\n\n'.join(([parent_text] if parent_text else []) + children_texts)
+            current_node['text_token_count'] = count_tokens(current_node['text'], model=model)
+        result_list.append(current_node)
+        i = ends[i]
+
     return result_list
 
 
@@ -201,10 +408,13 @@ def build_tree_from_nodes(node_list):
         tree_node = {
             'title': node['title'],
             'node_id': str(node_counter).zfill(4),
-            'text': node['text'],
             'line_num': node['line_num'],
             'nodes': []
         }
+        if 'text' in node:
+            tree_node['text'] = node['text']
+        else:
+            tree_node['text_ranges'] = node['text_ranges']
         node_counter += 1
         
         while stack and stack[-1][1] >= current_level:
@@ -240,61 +450,100 @@ def clean_tree_for_output(tree_nodes):
     return cleaned_nodes
 
 
-async def md_to_tree(md_path, if_thinning=False, min_token_threshold=None, if_add_node_summary='no', summary_token_threshold=None, model=None, if_add_doc_description='no', if_add_node_text='no', if_add_node_id='yes'):
-    with open(md_path, 'r', encoding='utf-8') as f:
-        markdown_content = f.read()
-    
-    print(f"Extracting nodes from markdown...")
-    node_list, markdown_lines = extract_nodes_from_markdown(markdown_content)
+def build_markdown_tree(md_path, if_thinning=False, min_token_threshold=None, model=None, with_text=False, with_hashes=False):
+    """Scan, count, thin and build the tree of a markdown file. CPU and file bound, md_to_tree runs it in a thread."""
+    # node text stays in the file as byte ranges until summaries or the output need it
+    with MarkdownFile(md_path) as source:
+        print(f"Extracting nodes from markdown...")
+        nodes_with_content = scan_markdown_headings(source)
+
+        if if_thinning:
+            nodes_with_content = update_node_list_with_text_token_count(nodes_with_content, model=model, source=source)
+            print(f"Thinning nodes...")
+            nodes_with_content = tree_thinning_for_index(nodes_with_content, min_token_threshold, model=model, source=source)
+
+        print(f"Building tree from nodes...")
+        tree_structure = build_tree_from_nodes(nodes_with_content)
+        if with_hashes:
+            add_markdown_text_hashes(tree_structure, source)
+        if with_text:
+            add_markdown_node_text(tree_structure, source)
+    return tree_structure
 
-    print(f"Extracting text content from nodes...")
-    nodes_with_content = extract_node_text_content(node_list, markdown_lines)
-    
-    if if_thinning:
-        nodes_with_content = update_node_list_with_text_token_count(nodes_with_content, model=model)
-        print(f"Thinning nodes...")
-        nodes_with_content = tree_thinning_for_index(nodes_with_content, min_token_threshold, model=model)
-    
-    print(f"Building tree from nodes...")
-    tree_structure = build_tree_from_nodes(nodes_with_content)
 
-    if if_add_node_id == 'yes':
-        write_node_id(tree_structure)
+async def md_to_tree(md_path, if_thinning=False, min_token_threshold=None, if_add_node_summary='no', summary_token_threshold=None, model=None, if_add_doc_description='no', if_add_node_text='no', if_add_node_id='yes', summary_cache_path=None, summary_pack_tokens=0, previous=None):
+    """
+    previous: result of an earlier md_to_tree run of the same file made with previous
+    set (its nodes carry 'text_hash'), or just its structure. Unchanged sections keep
+    their node IDs and summaries, only changed sections and their ancestors are
+    summarized again. Pass {'structure': []} for a first run whose result can be used
+    this way later.
 
-    print(f"Formatting tree structure...")
+    File scanning and token counting run in threads, so documents indexed concurrently
+    on one loop (batch mode, the API) do not stall each other.
+    """
+    with use_token_cache():
+        incremental = previous is not None
+        if isinstance(previous, dict):
+            previous_structure = previous.get('structure') or []
+            previous_description = previous.get('doc_description')
+        else:
+            previous_structure = previous or []
+            previous_description = None
+        hash_key = ['text_hash'] if incremental else []
+        tree_structure = await asyncio.to_thread(
+            build_markdown_tree, md_path, if_thinning=if_thinning, min_token_threshold=min_token_threshold, model=model,
+            with_text=if_add_node_summary == 'yes' or if_add_node_text == 'yes', with_hashes=incremental)
+
+        counts = None
+        if incremental:
+            counts = await asyncio.to_thread(reuse_previous_sections, tree_structure, previous_structure,
+                                             keep_node_ids=if_add_node_id == 'yes')
+            print(f"Incremental: {counts['unchanged']} unchanged, {counts['changed']} changed, "
+                  f"{counts['added']} added, {counts['removed']} removed sections")
+        elif if_add_node_id == 'yes':
+            write_node_id(tree_structure)
+
+        print(f"Formatting tree structure...")
     
-    if if_add_node_summary == 'yes':
-        # Always include text for summary generation
-        tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary', 'text', 'line_num', 'nodes'])
+        if if_add_node_summary == 'yes':
+            # Always include text for summary generation
+            tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary', 'text'] + hash_key + ['line_num', 'nodes'])
         
-        print(f"Generating summaries for each node...")
-        tree_structure = await generate_summaries_for_structure_md(tree_structure, summary_token_threshold=summary_token_threshold, model=model)
+            print(f"Generating summaries for each node...")
+            summary_cache = get_summary_cache(summary_cache_path) if summary_cache_path else None
+            with use_summary_cache(summary_cache) as cache_usage:
+                tree_structure = await generate_summaries_for_structure_md(tree_structure, summary_token_threshold=summary_token_threshold, model=model,
+                                                                            pack_tokens=summary_pack_tokens, only_missing=incremental)
+            if cache_usage:
+                print(f"Summary cache: {cache_usage.hits} hits, {cache_usage.misses} misses")
         
-        if if_add_node_text == 'no':
-            # Remove text after summary generation if not requested
-            tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary', 'line_num', 'nodes'])
+            if if_add_node_text == 'no':
+                # Remove text after summary generation if not requested
+                tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary'] + hash_key + ['line_num', 'nodes'])
         
-        if if_add_doc_description == 'yes':
-            print(f"Generating document description...")
-            # Create a clean structure without unnecessary fields for description generation
-            clean_structure = create_clean_structure_for_description(tree_structure)
-            doc_description = generate_doc_description(clean_structure, model=model)
-            return {
-                'doc_name': os.path.splitext(os.path.basename(md_path))[0],
-                'doc_description': doc_description,
-                'structure': tree_structure,
-            }
-    else:
-        # No summaries needed, format based on text preference
-        if if_add_node_text == 'yes':
-            tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary', 'text', 'line_num', 'nodes'])
+            if if_add_doc_description == 'yes':
+                if counts and previous_description and not (counts['changed'] or counts['added'] or counts['removed']):
+                    doc_description = previous_description
+                else:
+                    print(f"Generating document description...")
+                    doc_description = await generate_doc_description_async(tree_structure, model=model)
+                return {
+                    'doc_name': os.path.splitext(os.path.basename(md_path))[0],
+                    'doc_description': doc_description,
+                    'structure': tree_structure,
+                }
         else:
-            tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary', 'line_num', 'nodes'])
+            # No summaries needed, format based on text preference
+            if if_add_node_text == 'yes':
+                tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary', 'text'] + hash_key + ['line_num', 'nodes'])
+            else:
+                tree_structure = format_structure(tree_structure, order = ['title', 'node_id', 'summary', 'prefix_summary'] + hash_key + ['line_num', 'nodes'])
     
-    return {
-        'doc_name': os.path.splitext(os.path.basename(md_path))[0],
-        'structure': tree_structure,
-    }
+        return {
+            'doc_name': os.path.splitext(os.path.basename(md_path))[0],
+            'structure': tree_structure,
+        }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+import re
+import math
+from collections import Counter
+from .utils import count_page_tokens
+
+
+PAGE_NUMBER_PATTERNS = [
+    re.compile(r'^[-–—_\s]*\d{1,4}[-–—_\s]*$'),
+    re.compile(r'^(page|p\.|pp\.)\s*\d{1,4}(\s*(of|/)\s*\d{1,4})?$', re.IGNORECASE),
+    re.compile(r'^\d{1,4}\s*/\s*\d{1,4}$'),
+    re.compile(r'^第\s*\d{1,4}\s*页(\s*[,，/]?\s*共\s*\d{1,4}\s*页)?$'),
+    re.compile(r'^(?=[ivxlcdm])m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})$', re.IGNORECASE),
+]
+
+INLINE_SPACE_RE = re.compile(r'[ \t\f\v\u00a0\u3000]+')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+DIGITS_RE = re.compile(r'\d+')
+
+
+def normalize_whitespace(text):
+    """
+    Collapse runs of inline whitespace, strip every line and squeeze blank line runs.
+    """
+    if not text:
+        return ""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [INLINE_SPACE_RE.sub(' ', line).strip() for line in text.split('\n')]
+    text = '\n'.join(lines)
+    return BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10, 'l': 50, 'c': 100, 'd': 500, 'm': 1000}
+
+
+def is_page_number_line(line):
+    line = line.strip()
+    if not line or len(line) > 30:
+        return False
+    return any(pattern.match(line) for pattern in PAGE_NUMBER_PATTERNS)
+
+
+def page_number_value(line):
+    """
+    The number on a line shaped like a page number ("14", "- 14 -", "Page 14 of 80",
+    "xiv"), None for other lines. The shape alone does not make it a page number.
+    """
+    if not is_page_number_line(line):
+        return None
+    line = line.strip().lower()
+    numbers = DIGITS_RE.findall(line)
+    if numbers:
+        return int(numbers[0])
+    values = [ROMAN_VALUES[char] for char in line]
+    return sum(-value if value < next_value else value for value, next_value in zip(values, values[1:] + [0]))
+
+
+def _page_number_kind(line):
+    return _masked_key(line) if DIGITS_RE.search(line) else 'roman'
+
+
+def _line_key(line):
+    return INLINE_SPACE_RE.sub(' ', line.strip().lower())
+
+
+def _masked_key(line):
+    return DIGITS_RE.sub('#', _line_key(line))
+
+
+def _edge_lines(lines, edge_lines):
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    return non_empty[:edge_lines], non_empty[-edge_lines:]
+
+
+def detect_repeated_lines(page_texts, edge_lines=3, min_page_ratio=0.2, min_pages=3):
+    """
+    Find header/footer lines that repeat in the top or bottom lines of many pages.
+
+    Lines repeating verbatim are boilerplate. Lines that only repeat once digits are
+    masked ("Annual Report 2023 | 14") are boilerplate only if the number moves in step
+    with the physical page, which keeps numbered headings like "Chapter 3" out.
+    Lines shaped like page numbers are page numbers only where the same shape at the
+    same edge counts up with the physical page on at least min_pages pages; every such
+    run (e.g. roman front matter, then arabic from 1) is an (edge, shape, offset) key.
+    Returns (exact_keys, masked_keys, page_number_keys).
+    """
+    non_empty_pages = [text for text in page_texts if text and text.strip()]
+    if len(non_empty_pages) < max(min_pages, 4):
+        return set(), set(), set()
+
+    exact_counts = Counter()
+    masked_offsets = {}
+    page_number_counts = Counter()
+    for physical_index, text in enumerate(page_texts, start=1):
+        if not text or not text.strip():
+            continue
+        lines = text.split('\n')
+        head, tail = _edge_lines(lines, edge_lines)
+        exact_keys = set()
+        for i in set(head + tail):
+            key = _line_key(lines[i])
+            if not key:
+                continue
+            value = page_number_value(lines[i])
+            if value is not None:
+                for edge, edge_indices in (('head', head), ('tail', tail)):
+                    if i in edge_indices:
+                        page_number_counts[(edge, _page_number_kind(lines[i]), value - physical_index)] += 1
+                continue
+            exact_keys.add(key)
+            numbers = DIGITS_RE.findall(key)
+            if numbers:
+                masked_offsets.setdefault(_masked_key(lines[i]), {})[physical_index] = int(numbers[-1]) - physical_index
+        exact_counts.update(exact_keys)
+
+    threshold = max(min_pages, math.ceil(len(non_empty_pages) * min_page_ratio))
+    exact = {key for key, count in exact_counts.items() if count >= threshold}
+    masked = set()
+    for key, offsets in masked_offsets.items():
+        if len(offsets) < threshold:
+            continue
+        _, offset_count = Counter(offsets.values()).most_common(1)[0]
+        if offset_count >= 0.6 * len(offsets):
+            masked.add(key)
+    page_numbers = {key for key, count in page_number_counts.items() if count >= min_pages}
+    return exact, masked, page_numbers
+
+
+def strip_page_boilerplate(text, repeated_keys, seen_keys, edge_lines=3, physical_index=None):
+    """
+    Remove repeated header/footer lines and page numbers from the edges of one page.
+    The first occurrence of every repeated line is kept, so a chapter heading that is
+    reused as a running header still marks the page where the chapter starts. A line
+    shaped like a page number ("3", "II") is removed only if it belongs to a page number
+    run found by detect_repeated_lines, so a chapter number above a heading stays.
+    """
+    exact_keys, masked_keys, page_number_keys = repeated_keys
+    lines = text.split('\n')
+    head, tail = _edge_lines(lines, edge_lines)
+    removed = set()
+
+    def should_remove(i, edge):
+        line = lines[i]
+        value = page_number_value(line)
+        if value is not None:
+            return (physical_index is not None
+                    and (edge, _page_number_kind(line), value - physical_index) in page_number_keys)
+        key = _line_key(line)
+        if key not in exact_keys:
+            key = _masked_key(line)
+            if key not in masked_keys:
+                return False
+        if key in seen_keys:
+            return True
+        seen_keys.add(key)
+        return False
+
+    for i in head:
+        if not should_remove(i, 'head'):
+            break
+        removed.add(i)
+    for i in reversed(tail):
+        if i in removed or not should_remove(i, 'tail'):
+            break
+        removed.add(i)
+
+    if not removed:
+        return text, 0
+    return '\n'.join(line for i, line in enumerate(lines) if i not in removed), len(removed)
+
+
+def preprocess_pages(page_list, model=None, token_mode="exact", edge_lines=3, min_page_ratio=0.2):
+    """
+    Clean extracted pages before they are used in any prompt.
+
+    Repeated running headers/footers and page numbers are stripped, whitespace is
+    normalized and blank (e.g. image-only) pages are reduced to an empty string with
+    0 tokens. The list keeps one entry per physical page, so physical indices are unchanged.
+    Returns the new page list and a stats dict.
+    """
+    texts = [normalize_whitespace(page[0]) for page in page_list]
+    repeated_keys = detect_repeated_lines(texts, edge_lines=edge_lines, min_page_ratio=min_page_ratio)
+
+    seen_keys = set()
+    removed_lines = 0
+    cleaned_texts = []
+    empty_pages = []
+    for physical_index, text in enumerate(texts, start=1):
+        text, removed = strip_page_boilerplate(text, repeated_keys, seen_keys, edge_lines=edge_lines,
+                                               physical_index=physical_index)
+        removed_lines += removed
+        text = text.strip()
+        if not text:
+            empty_pages.append(physical_index)
+        cleaned_texts.append(text)
+    cleaned_list = list(zip(cleaned_texts, count_page_tokens(cleaned_texts, model=model, token_mode=token_mode)))
+
+    stats = {
+        'pages': len(page_list),
+        'empty_pages': empty_pages,
+        'repeated_lines': len(repeated_keys[0]) + len(repeated_keys[1]),
+        'page_number_runs': len(repeated_keys[2]),
+        'removed_lines': removed_lines,
+        'tokens_before': sum(page[1] for page in page_list),
+        'tokens_after': sum(page[1] for page in cleaned_list),
+    }
+    return cleaned_list, stats
+
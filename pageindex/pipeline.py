@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import time
+
+try:
+    from .utils import bind_llm_loop
+    from .tracing import trace_span
+except ImportError:
+    from utils import bind_llm_loop
+    from tracing import trace_span
+
+
+_current_stage = contextvars.ContextVar('pageindex_stage', default=None)
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=None, parent=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs) if outputs else (name,)
+        # stage that added this one while it was running, an implicit dependency
+        self.parent = parent
+        self.added = None
+        self.start = None
+        self.end = None
+
+
+class Pipeline:
+    """
+    Indexing stages as a DAG. Every stage declares the values it reads (inputs) and the
+    values it produces (outputs, by default its own name); run() starts each stage as
+    soon as its inputs exist, so independent stages overlap. Async stages run on the
+    event loop, sync stages in worker threads whose LLM calls share the loop's semaphore.
+
+    A running stage may add further stages, e.g. one per sub-tree it finished; a stage
+    may also list inputs whose producer is only added later.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.values = {}
+        self._started = None
+        self._wakeup = None
+        self._origin = None
+
+    def add_stage(self, name, func, inputs=(), outputs=None):
+        if name in self.stages:
+            raise ValueError(f"pipeline {self.name}: duplicate stage {name}")
+        stage = Stage(name, func, inputs=inputs, outputs=outputs, parent=_current_stage.get())
+        self.stages[name] = stage
+        if self._wakeup is not None:
+            stage.added = time.perf_counter() - self._origin
+            self._wakeup.set()
+        return stage
+
+    def describe(self):
+        return [{'stage': stage.name, 'inputs': list(stage.inputs), 'outputs': list(stage.outputs)}
+                for stage in self.stages.values()]
+
+    def _ready(self, stage):
+        return all(name in self.values for name in stage.inputs)
+
+    async def _run_stage(self, stage):
+        _current_stage.set(stage)
+        kwargs = {name: self.values[name] for name in stage.inputs}
+        stage.start = time.perf_counter() - self._origin
+        with trace_span(stage.name, cat='stage'):
+            if asyncio.iscoroutinefunction(stage.func):
+                result = await stage.func(**kwargs)
+            else:
+                result = await asyncio.to_thread(stage.func, **kwargs)
+        stage.end = time.perf_counter() - self._origin
+        return result
+
+    def _store(self, stage, result):
+        if len(stage.outputs) == 1:
+            self.values[stage.outputs[0]] = result
+        else:
+            self.values.update(zip(stage.outputs, result))
+
+    async def run(self, **initial):
+        """Run all stages, returns the dict of all produced values."""
+        self.values.update(initial)
+        self._started = set()
+        self._wakeup = asyncio.Event()
+        bind_llm_loop(asyncio.get_running_loop())
+        self._origin = time.perf_counter()
+        running = {}
+        try:
+            while True:
+                for stage in list(self.stages.values()):
+                    if stage.name not in self._started and self._ready(stage):
+                        self._started.add(stage.name)
+                        running[asyncio.ensure_future(self._run_stage(stage))] = stage
+                if not running:
+                    blocked = [stage.name for stage in self.stages.values() if stage.name not in self._started]
+                    if blocked:
+                        raise RuntimeError(f"pipeline {self.name}: stages never got their inputs: {blocked}")
+                    break
+                self._wakeup.clear()
+                wakeup = asyncio.ensure_future(self._wakeup.wait())
+                done, _ = await asyncio.wait(set(running) | {wakeup}, return_when=asyncio.FIRST_COMPLETED)
+                wakeup.cancel()
+                for task in done:
+                    if task is wakeup:
+                        continue
+                    stage = running.pop(task)
+                    self._store(stage, task.result())
+        except BaseException:
+            for task in running:
+                task.cancel()
+            raise
+        finally:
+            self._wakeup = None
+        return self.values
+
+    def critical_path(self):
+        """
+        Chain of stages that determined the run time: starting from the stage that
+        finished last, repeatedly step to the latest-finishing stage it waited for, or
+        to the stage that added it if that happened after all its inputs were ready.
+        """
+        producers = {output: stage for stage in self.stages.values() for output in stage.outputs}
+        finished = [stage for stage in self.stages.values() if stage.end is not None]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda s: s.end)
+        path = []
+        while stage is not None:
+            path.append({'stage': stage.name, 'start': round(stage.start, 3), 'seconds': round(stage.end - stage.start, 3)})
+            predecessors = [producers[name] for name in stage.inputs
+                            if name in producers and producers[name].end is not None]
+            last_input = max(predecessors, key=lambda s: s.end) if predecessors else None
+            if stage.parent is not None and stage.added is not None and (last_input is None or stage.added > last_input.end):
+                stage = stage.parent
+            else:
+                stage = last_input
+        return path[::-1]
@@ -0,0 +1,194 @@
+import contextlib
+import contextvars
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+# Bump when a summary prompt changes, so summaries written with the old prompt are not reused
+SUMMARY_PROMPT_VERSION = 1
+SUMMARY_CACHE_MAX_ENTRIES = 200000
+# Share of the entries dropped at once when the cache is full, so eviction does not run on every insert
+SUMMARY_CACHE_EVICT_RATIO = 0.1
+# Buffered writes (new summaries and last_used updates) that trigger a flush
+SUMMARY_CACHE_FLUSH_ENTRIES = 256
+
+_current_cache = contextvars.ContextVar('pageindex_summary_cache', default=None)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def summary_cache_key(text, model=None, kind='node'):
+    """Hash of the whitespace-normalized summary input, the model and the prompt version."""
+    normalized = re.sub(r'\s+', ' ', text or '').strip()
+    digest = hashlib.sha256()
+    for part in (f'{kind}-v{SUMMARY_PROMPT_VERSION}', str(model), normalized):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """
+    Node summaries shared by all documents and re-indexes, in a SQLite file. Entries
+    are keyed by summary_cache_key(), so a boilerplate section summarized once is
+    reused everywhere it appears. When the cache grows beyond max_entries the least
+    recently used entries are dropped.
+
+    Lookups only read. New summaries and last_used updates are buffered in memory
+    (and served from there) and written in one transaction by flush(), which runs
+    once flush_entries are pending and at the end of every indexing run.
+    """
+
+    def __init__(self, path, max_entries=SUMMARY_CACHE_MAX_ENTRIES, flush_entries=SUMMARY_CACHE_FLUSH_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_entries = flush_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (summary, model, created) not written yet, key -> last_used not written yet
+        self._pending = {}
+        self._touched = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS summaries ('
+            'key TEXT PRIMARY KEY, summary TEXT NOT NULL, model TEXT, created REAL, last_used REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used)')
+        self._conn.commit()
+        self._entries = self._conn.execute('SELECT COUNT(*) FROM summaries').fetchone()[0]
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """Summaries for keys in input order, None where missing; one query for all of them."""
+        now = time.time()
+        with self._lock:
+            found = {key: self._pending[key][0] for key in keys if key in self._pending}
+            missing = list({key for key in keys if key not in found})
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update(rows)
+            summaries = []
+            for key in keys:
+                summary = found.get(key)
+                if summary is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._touched[key] = now
+                summaries.append(summary)
+            return summaries
+
+    def put(self, key, summary, model=None):
+        with self._lock:
+            self._pending.setdefault(key, (summary, str(model), time.time()))
+            if len(self._pending) + len(self._touched) < self.flush_entries:
+                return
+        self.flush()
+
+    def flush(self):
+        """Write buffered summaries and last_used updates in one transaction."""
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            pending, self._pending = self._pending, {}
+            touched, self._touched = self._touched, {}
+            cursor = self._conn.executemany(
+                'INSERT OR IGNORE INTO summaries (key, summary, model, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                [(key, summary, model, created, touched.pop(key, created))
+                 for key, (summary, model, created) in pending.items()])
+            self._entries += cursor.rowcount
+            self._conn.executemany('UPDATE summaries SET last_used = ? WHERE key = ?',
+                                   [(last_used, key) for key, last_used in touched.items()])
+            if self._entries > self.max_entries:
+                evict = self._entries - self.max_entries + int(self.max_entries * SUMMARY_CACHE_EVICT_RATIO)
+                self._conn.execute(
+                    'DELETE FROM summaries WHERE key IN (SELECT key FROM summaries ORDER BY last_used LIMIT ?)',
+                    (evict,))
+                self._entries = self._conn.execute('SELECT COUNT(*) FROM summaries').fetchone()[0]
+            self._conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+def get_summary_cache(path, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+    """One SummaryCache per file for the whole process, shared by concurrent indexing runs."""
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = SummaryCache(path, max_entries=max_entries)
+        return _caches[path]
+
+
+class SummaryCacheUsage:
+    """Hits and misses of one indexing run, the process-wide counters live on the cache."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        summaries = self.cache.get_many(keys)
+        hits = sum(summary is not None for summary in summaries)
+        self.hits += hits
+        self.misses += len(summaries) - hits
+        return summaries
+
+    def put(self, key, summary, model=None):
+        self.cache.put(key, summary, model=model)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'cache': self.cache.stats(),
+        }
+
+
+def get_current_summary_cache():
+    return _current_cache.get()
+
+
+@contextlib.contextmanager
+def use_summary_cache(cache):
+    """
+    Route the summaries of this context and the tasks it starts through cache, a no-op
+    for None. The summaries buffered by the run are written when the context exits.
+    """
+    if cache is None:
+        yield None
+        return
+    usage = SummaryCacheUsage(cache)
+    token = _current_cache.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_cache.reset(token)
+        cache.flush()
@@ -0,0 +1,137 @@
+import math
+import re
+
+
+CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff00-\uffef]')
+LATIN_RE = re.compile(r'[A-Za-z\u00c0-\u024f]')
+DIGIT_RE = re.compile(r'[0-9]')
+SPACE_RE = re.compile(r'\s')
+
+FEATURES = ('cjk', 'latin', 'digit', 'other')
+
+# Tokens per character for cl100k_base, used until the estimator is fitted on real pages
+DEFAULT_RATIOS = {'cjk': 0.75, 'latin': 0.23, 'digit': 0.35, 'other': 0.6}
+DEFAULT_ERROR_BOUND = 0.3
+MIN_ERROR_BOUND = 0.05
+CALIBRATION_SAMPLE_SIZE = 32
+MIN_CALIBRATION_TOKENS = 20
+
+
+def char_counts(text):
+    """
+    Count CJK, Latin letter, digit and other non-space characters.
+    Whitespace is not counted: BPE vocabularies fold it into the following token.
+    """
+    if not text:
+        return (0, 0, 0, 0)
+    total = len(text)
+    cjk = total - len(CJK_RE.sub('', text))
+    latin = total - len(LATIN_RE.sub('', text))
+    digit = total - len(DIGIT_RE.sub('', text))
+    space = total - len(SPACE_RE.sub('', text))
+    return (cjk, latin, digit, max(total - cjk - latin - digit - space, 0))
+
+
+def select_calibration_sample(texts, sample_size=CALIBRATION_SAMPLE_SIZE):
+    """Indices of up to sample_size non-empty texts spread evenly over the document."""
+    candidates = [i for i, text in enumerate(texts) if text and text.strip()]
+    if len(candidates) <= sample_size:
+        return candidates
+    step = len(candidates) / sample_size
+    return [candidates[int(k * step)] for k in range(sample_size)]
+
+
+def _solve(matrix, vector):
+    # Gaussian elimination with partial pivoting, the systems here are at most 4x4
+    n = len(vector)
+    a = [row[:] + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            return None
+        a[col], a[pivot] = a[pivot], a[col]
+        for r in range(n):
+            if r != col:
+                factor = a[r][col] / a[col][col]
+                for c in range(col, n + 1):
+                    a[r][c] -= factor * a[col][c]
+    return [a[i][n] / a[i][i] for i in range(n)]
+
+
+def _least_squares(rows, targets, active):
+    matrix = [[sum(row[i] * row[j] for row in rows) for j in active] for i in active]
+    vector = [sum(row[i] * y for row, y in zip(rows, targets)) for i in active]
+    return _solve(matrix, vector)
+
+
+class TokenEstimator:
+    """
+    Linear character-class model of a tokenizer: tokens ~= sum(ratio[class] * chars[class]).
+
+    Used on planning paths (page grouping, large-node checks, token limit checks) where a
+    rough size is enough. error_bound is the relative error observed on the calibration
+    sample (95th percentile), estimate_upper() adds it on top of the estimate.
+    """
+
+    def __init__(self, ratios=None, error_bound=DEFAULT_ERROR_BOUND):
+        self.ratios = dict(ratios or DEFAULT_RATIOS)
+        self.error_bound = error_bound
+        self.sample_size = 0
+
+    def estimate(self, text):
+        if not text:
+            return 0
+        counts = char_counts(text)
+        return int(math.ceil(sum(self.ratios[f] * c for f, c in zip(FEATURES, counts))))
+
+    def estimate_upper(self, text):
+        return int(math.ceil(self.estimate(text) * (1 + self.error_bound)))
+
+    def fit(self, texts, exact_counts):
+        """
+        Fit per-class ratios on (text, exact token count) pairs with non-negative least squares.
+        Classes that do not occur in the sample keep their previous ratio.
+        """
+        rows = []
+        targets = []
+        for text, num_tokens in zip(texts, exact_counts):
+            if num_tokens >= MIN_CALIBRATION_TOKENS:
+                rows.append(char_counts(text))
+                targets.append(num_tokens)
+        if not rows:
+            return self
+
+        active = [i for i in range(len(FEATURES)) if any(row[i] for row in rows)]
+        present = list(active)
+        while active:
+            solution = _least_squares(rows, targets, active)
+            if solution is None:
+                return self
+            negative = [feature for feature, value in zip(active, solution) if value <= 0]
+            if not negative:
+                break
+            active = [feature for feature in active if feature not in negative]
+        else:
+            return self
+
+        for feature in present:
+            self.ratios[FEATURES[feature]] = 0.0
+        for feature, value in zip(active, solution):
+            self.ratios[FEATURES[feature]] = value
+
+        errors = sorted(abs(y - self.estimate(text)) / y for text, y in zip(texts, exact_counts)
+                        if y >= MIN_CALIBRATION_TOKENS)
+        bound = errors[min(len(errors) - 1, math.ceil(0.95 * len(errors)) - 1)]
+        if len(errors) < 8:
+            # too few pages to trust the observed spread
+            bound = max(bound, DEFAULT_ERROR_BOUND)
+        self.error_bound = max(bound, MIN_ERROR_BOUND)
+        self.sample_size = len(errors)
+        return self
+
+    def to_dict(self):
+        return {
+            'ratios': {k: round(v, 4) for k, v in self.ratios.items()},
+            'error_bound': round(self.error_bound, 4),
+            'sample_size': self.sample_size,
+        }
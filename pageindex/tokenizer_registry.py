@@ -0,0 +1,168 @@
+import os
+import logging
+import functools
+import threading
+from pathlib import Path
+
+import tiktoken
+
+try:
+    from tokenizers import Tokenizer as HFTokenizer
+except ImportError:
+    HFTokenizer = None
+
+try:
+    from .token_estimator import TokenEstimator
+except ImportError:
+    from token_estimator import TokenEstimator
+
+
+DEFAULT_ENCODING = "cl100k_base"
+DEEPSEEK_TOKENIZER_PATH = os.getenv(
+    "DEEPSEEK_TOKENIZER_PATH",
+    str(Path(__file__).resolve().parent.parent / "data" / "tokenizers" / "deepseek" / "tokenizer.json"),
+)
+# The tokenizer published with DeepSeek-V3, shared by deepseek-chat and deepseek-reasoner
+DEEPSEEK_TOKENIZER_URL = "https://huggingface.co/deepseek-ai/DeepSeek-V3/resolve/main/tokenizer.json"
+# Published DeepSeek rule of thumb: ~0.3 token per English character, ~0.6 per Chinese character
+DEEPSEEK_ESTIMATE_RATIOS = {'cjk': 0.6, 'latin': 0.3, 'digit': 0.3, 'other': 0.4}
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name=DEFAULT_ENCODING):
+    return tiktoken.get_encoding(encoding_name)
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding_name=DEFAULT_ENCODING):
+        self.name = f"tiktoken:{encoding_name}"
+        self.encoding = get_encoding(encoding_name)
+
+    def encode(self, text):
+        return self.encoding.encode(text)
+
+    def decode(self, tokens):
+        return self.encoding.decode(tokens)
+
+    def truncate(self, text, max_tokens):
+        tokens = self.encode(text)
+        return text if len(tokens) <= max_tokens else self.decode(tokens[:max_tokens])
+
+    def count(self, text):
+        return len(self.encoding.encode(text)) if text else 0
+
+    def count_many(self, texts, num_threads=8):
+        return [len(tokens) for tokens in self.encoding.encode_batch(texts, num_threads=num_threads)]
+
+
+class HuggingFaceTokenizer:
+    """A local tokenizer.json, e.g. the one published with DeepSeek-V3."""
+
+    def __init__(self, path, name):
+        if HFTokenizer is None:
+            raise ImportError("the 'tokenizers' package is required to load " + path)
+        self.name = name
+        self.tokenizer = HFTokenizer.from_file(path)
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False).ids
+
+    def decode(self, tokens):
+        return self.tokenizer.decode(tokens)
+
+    def truncate(self, text, max_tokens):
+        tokens = self.encode(text)
+        return text if len(tokens) <= max_tokens else self.decode(tokens[:max_tokens])
+
+    def count(self, text):
+        return len(self.encode(text)) if text else 0
+
+    def count_many(self, texts, num_threads=8):
+        # encode_batch is parallelized inside the Rust library
+        encodings = self.tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+
+class EstimatedTokenizer:
+    """
+    Character-ratio fallback when a model's real tokenizer is not available locally.
+    It has no token ids, so there is no encode/decode; truncate cuts by characters.
+    """
+
+    def __init__(self, name, ratios):
+        self.name = name
+        self.estimator = TokenEstimator(ratios=ratios)
+
+    def truncate(self, text, max_tokens):
+        # keep the share of characters that fits
+        num_tokens = self.count(text)
+        return text if num_tokens <= max_tokens else text[:int(len(text) * max_tokens / num_tokens)]
+
+    def count(self, text):
+        return self.estimator.estimate(text)
+
+    def count_many(self, texts, num_threads=8):
+        return [self.estimator.estimate(text) for text in texts]
+
+
+def load_deepseek_tokenizer():
+    if HFTokenizer is None:
+        reason = "the 'tokenizers' package is not installed"
+    elif not os.path.isfile(DEEPSEEK_TOKENIZER_PATH):
+        reason = (f"{DEEPSEEK_TOKENIZER_PATH} does not exist "
+                  f"(run scripts/download_tiktoken_assets.py --deepseek or set DEEPSEEK_TOKENIZER_PATH)")
+    else:
+        return HuggingFaceTokenizer(DEEPSEEK_TOKENIZER_PATH, name="deepseek")
+    logging.warning(f"DeepSeek tokenizer unavailable: {reason}; token counts for DeepSeek models "
+                    f"are character-ratio estimates, not exact")
+    return EstimatedTokenizer("deepseek-estimate", DEEPSEEK_ESTIMATE_RATIOS)
+
+
+def load_o200k_tokenizer():
+    try:
+        return TiktokenTokenizer("o200k_base")
+    except Exception as e:
+        logging.warning(f"o200k_base unavailable ({e}), falling back to {DEFAULT_ENCODING}")
+        return TiktokenTokenizer(DEFAULT_ENCODING)
+
+
+# (model name prefix, factory); the longest matching prefix wins
+_registry = [
+    ("deepseek", load_deepseek_tokenizer),
+    ("gpt-4o", load_o200k_tokenizer),
+    ("gpt-4.1", load_o200k_tokenizer),
+    ("gpt-5", load_o200k_tokenizer),
+    ("o1", load_o200k_tokenizer),
+    ("o3", load_o200k_tokenizer),
+    ("o4", load_o200k_tokenizer),
+]
+_tokenizers = {}
+_lock = threading.Lock()
+
+
+def register_tokenizer(model_prefix, factory):
+    """Route every model whose name starts with model_prefix to the tokenizer built by factory()."""
+    with _lock:
+        _registry.append((model_prefix.lower(), factory))
+        _tokenizers.clear()
+
+
+def _resolve_factory(model):
+    model = (model or "").lower()
+    matches = [(prefix, factory) for prefix, factory in _registry if model.startswith(prefix)]
+    if not matches:
+        return "default", lambda: TiktokenTokenizer(DEFAULT_ENCODING)
+    return max(matches, key=lambda match: len(match[0]))
+
+
+def get_tokenizer(model=None):
+    """Tokenizer for the given model name, loaded once per registry entry."""
+    key, factory = _resolve_factory(model)
+    tokenizer = _tokenizers.get(key)
+    if tokenizer is None:
+        with _lock:
+            tokenizer = _tokenizers.get(key)
+            if tokenizer is None:
+                tokenizer = factory()
+                _tokenizers[key] = tokenizer
+    return tokenizer
@@ -0,0 +1,101 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+
+_current_trace = contextvars.ContextVar('pageindex_trace', default=None)
+
+
+class Trace:
+    """
+    Execution trace of one indexing run in Chrome trace-event format, viewable in
+    chrome://tracing or https://ui.perfetto.dev. Every asyncio task and worker thread
+    gets its own row, so concurrent stages and LLM calls show up side by side.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.events = []
+        self._origin = time.perf_counter()
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def now(self):
+        return time.perf_counter() - self._origin
+
+    def _row(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = ('task', id(task)) if task is not None else ('thread', threading.get_ident())
+        with self._lock:
+            if key not in self._rows:
+                self._rows[key] = len(self._rows) + 1
+            return self._rows[key]
+
+    def add(self, name, cat, start, end, args=None, row=None):
+        """Complete event between start and end, in seconds since the trace started."""
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round(start * 1e6),
+            'dur': round((end - start) * 1e6),
+            'pid': 1,
+            'tid': row if row is not None else self._row(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, cat='stage', **args):
+        row = self._row()
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, cat, start, self.now(), args=args, row=row)
+
+    def to_dict(self):
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0, 'args': {'name': self.name}}]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        return path
+
+
+def get_current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def use_trace(trace):
+    """Make trace the target of trace_span() in this context and the tasks it starts."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def trace_span(name, cat='stage', **args):
+    """Record a span in the current trace, a no-op when no trace is active."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, cat=cat, **args):
+        yield
@@ -1,4 +1,3 @@
-import tiktoken
 import openai
 import logging
 import os
@@ -8,6 +7,14 @@ import json
 import PyPDF2
 import copy
 import asyncio
+import hashlib
+import functools
+import heapq
+import itertools
+import threading
+import weakref
+import contextlib
+import contextvars
 import pymupdf
 from io import BytesIO
 from dotenv import load_dotenv
@@ -16,6 +23,16 @@ import logging
 import yaml
 from pathlib import Path
 from types import SimpleNamespace as config
+try:
+    from .token_estimator import TokenEstimator, select_calibration_sample
+    from .tokenizer_registry import get_tokenizer
+    from .tracing import trace_span
+    from .summary_cache import get_current_summary_cache, summary_cache_key
+except ImportError:
+    from token_estimator import TokenEstimator, select_calibration_sample
+    from tokenizer_registry import get_tokenizer
+    from tracing import trace_span
+    from summary_cache import get_current_summary_cache, summary_cache_key
 
 CHATGPT_API_KEY = (
     os.getenv("DEEPSEEK_API_KEY")
@@ -24,16 +41,350 @@ CHATGPT_API_KEY = (
 )
 CHATGPT_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
 
+
+def _default_tiktoken_cache_dir():
+    data_dir = Path(__file__).resolve().parent.parent / "data"
+    cache_dir = data_dir / "tiktoken"
+    writable_root = data_dir if data_dir.exists() else data_dir.parent
+    if cache_dir.is_dir() or os.access(writable_root, os.W_OK):
+        return str(cache_dir)
+    return None
+
+
+# Keep tiktoken's BPE files under the project's data directory instead of downloading them
+# on first use; hosts without outbound network get them from scripts/download_tiktoken_assets.py
+if "TIKTOKEN_CACHE_DIR" not in os.environ and _default_tiktoken_cache_dir() is not None:
+    os.environ["TIKTOKEN_CACHE_DIR"] = _default_tiktoken_cache_dir()
+TIKTOKEN_CACHE_DIR = os.environ.get("TIKTOKEN_CACHE_DIR")
+
+# Texts shorter than this are cheaper to encode than to hash
+TOKEN_CACHE_MIN_CHARS = 256
+TOKEN_CACHE_MAX_ENTRIES = 200000
+_token_count_cache = {}
+# Set by use_token_cache, so documents indexed concurrently in one process each memoize
+# into a cache of their own instead of clearing each other's
+_token_cache_scope = contextvars.ContextVar('pageindex_token_cache', default=None)
+
+
+def warm_up_tokenizer(model=None):
+    """Load the model's tokenizer now so the first indexing request does not pay for it."""
+    get_tokenizer(model).count("warm up")
+
+
+def _token_cache_key(text, tokenizer):
+    # the tokenizer name is part of the key: the same page counts differently per model
+    digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    return (tokenizer.name, digest)
+
+
+@contextlib.contextmanager
+def use_token_cache():
+    """Memoize token counts made in this context (and its tasks and threads) in a cache of its own, dropped on exit."""
+    cache = {}
+    token = _token_cache_scope.set(cache)
+    try:
+        yield cache
+    finally:
+        _token_cache_scope.reset(token)
+
+
+def get_token_cache():
+    cache = _token_cache_scope.get()
+    return cache if cache is not None else _token_count_cache
+
+
+def reset_token_cache():
+    """Drop the memoized token counts of the current use_token_cache scope (or the process-wide ones)."""
+    get_token_cache().clear()
+
+
+def _store_token_count(key, num_tokens):
+    cache = get_token_cache()
+    if len(cache) >= TOKEN_CACHE_MAX_ENTRIES:
+        cache.clear()
+    cache[key] = num_tokens
+
+
 def count_tokens(text, model=None):
     if not text:
         return 0
-    enc = tiktoken.get_encoding("cl100k_base")
-    tokens = enc.encode(text)
-    return len(tokens)
+    tokenizer = get_tokenizer(model)
+    if len(text) < TOKEN_CACHE_MIN_CHARS:
+        return tokenizer.count(text)
+    key = _token_cache_key(text, tokenizer)
+    num_tokens = get_token_cache().get(key)
+    if num_tokens is None:
+        num_tokens = tokenizer.count(text)
+        _store_token_count(key, num_tokens)
+    return num_tokens
+
+
+# Fitted on the pages of the document being indexed, see count_page_tokens
+_token_estimator = TokenEstimator()
+# Set by use_token_estimator, so documents indexed concurrently in one process each keep
+# the estimator fitted on their own pages
+_token_estimator_scope = contextvars.ContextVar('pageindex_token_estimator', default=None)
+
+
+@contextlib.contextmanager
+def use_token_estimator():
+    """Keep the estimator that count_page_tokens fits in this context (and its tasks and threads) to it."""
+    scope = config(estimator=_token_estimator)
+    token = _token_estimator_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _token_estimator_scope.reset(token)
+
+
+def get_token_estimator():
+    scope = _token_estimator_scope.get()
+    return scope.estimator if scope is not None else _token_estimator
+
+
+def estimate_tokens(text, model=None, upper=False):
+    """
+    Fast approximate token count for planning decisions (grouping, size checks).
+    With upper=True the calibrated error bound is added, so the result can be compared
+    against a hard limit.
+    """
+    estimator = get_token_estimator()
+    if upper:
+        return estimator.estimate_upper(text)
+    return estimator.estimate(text)
+
+
+def count_page_tokens(page_texts, model=None, token_mode="exact"):
+    """
+    Token counts for a document's pages; also (re)calibrates the shared estimator on them.
+
+    token_mode "exact" encodes every page. "estimate" encodes only a spread-out sample of
+    pages, fits the estimator on it and estimates the rest; page counts are only used for
+    planning, so this is enough.
+    """
+    global _token_estimator
+    sample_indices = select_calibration_sample(page_texts)
+    if token_mode == "estimate" and len(sample_indices) < len(page_texts):
+        sample_texts = [page_texts[i] for i in sample_indices]
+        sample_counts = count_tokens_many(sample_texts, model=model)
+        estimator = TokenEstimator().fit(sample_texts, sample_counts)
+        counts = [estimator.estimate(text) for text in page_texts]
+        for i, num_tokens in zip(sample_indices, sample_counts):
+            counts[i] = num_tokens
+    else:
+        counts = count_tokens_many(page_texts, model=model)
+        estimator = TokenEstimator().fit([page_texts[i] for i in sample_indices],
+                                         [counts[i] for i in sample_indices])
+    scope = _token_estimator_scope.get()
+    if scope is not None:
+        # the scope object is shared with the context copies of asyncio.to_thread
+        scope.estimator = estimator
+    else:
+        _token_estimator = estimator
+    return counts
+
+
+def count_tokens_many(texts, model=None, num_threads=8):
+    """
+    Count tokens for a list of texts with the model's tokenizer, batch encoding
+    everything that is not memoized yet. Returns counts in input order.
+    """
+    tokenizer = get_tokenizer(model)
+    cache = get_token_cache()
+    counts = [0] * len(texts)
+    pending = {}
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        key = _token_cache_key(text, tokenizer) if len(text) >= TOKEN_CACHE_MIN_CHARS else None
+        num_tokens = cache.get(key) if key is not None else None
+        if num_tokens is not None:
+            counts[i] = num_tokens
+        else:
+            pending.setdefault(text, (key, []))[1].append(i)
+
+    if pending:
+        unique_texts = list(pending)
+        unique_counts = tokenizer.count_many(unique_texts, num_threads=num_threads)
+        for text, num_tokens in zip(unique_texts, unique_counts):
+            key, indices = pending[text]
+            if key is not None:
+                _store_token_count(key, num_tokens)
+            for i in indices:
+                counts[i] = num_tokens
+    return counts
+
+# Upper bound on concurrent async LLM requests, shared by every fan-out in one event loop
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("PAGEINDEX_MAX_CONCURRENT_LLM_CALLS", "8"))
+_llm_semaphores = weakref.WeakKeyDictionary()
+# Event loop of a running pipeline, so sync LLM calls made from its worker threads take
+# slots of the same semaphore as the async calls
+_llm_loop = contextvars.ContextVar('pageindex_llm_loop', default=None)
+_llm_usage_lock = threading.Lock()
+_llm_usage = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+# Extra counters of the calls made in a use_llm_usage() context, e.g. one document of a batch
+_llm_usage_scope = contextvars.ContextVar('pageindex_llm_usage', default=None)
+# Priority of the LLM calls made in a use_llm_priority() context
+_llm_priority = contextvars.ContextVar('pageindex_llm_priority', default=0)
+
+
+class LLMSemaphore:
+    """
+    asyncio.Semaphore that hands a freed slot to the waiter with the highest priority
+    (use_llm_priority), in arrival order among equal priorities.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._free = limit
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self):
+        if self._free:
+            self._free -= 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-_llm_priority.get(), next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the slot was handed over just before the cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        # a freed slot goes straight to the next waiter, cancelled ones are skipped
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def get_llm_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = LLMSemaphore(MAX_CONCURRENT_LLM_CALLS)
+    return semaphore
+
+
+@contextlib.contextmanager
+def use_llm_priority(priority):
+    """LLM calls made in this context, and in tasks started from it, take free slots before lower priorities."""
+    token = _llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        _llm_priority.reset(token)
+
+
+# OpenAI clients keep an HTTP connection pool: one sync client per API key, and one async
+# client per API key and event loop, since an async client must not outlive its loop
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
+_async_llm_clients = weakref.WeakKeyDictionary()
+
+
+def get_llm_client(api_key=CHATGPT_API_KEY):
+    with _llm_clients_lock:
+        client = _llm_clients.get(api_key)
+        if client is None:
+            client = _llm_clients[api_key] = openai.OpenAI(api_key=api_key, base_url=CHATGPT_BASE_URL)
+        return client
+
+
+def get_async_llm_client(api_key=CHATGPT_API_KEY):
+    clients = _async_llm_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(api_key)
+    if client is None:
+        client = clients[api_key] = openai.AsyncOpenAI(api_key=api_key, base_url=CHATGPT_BASE_URL)
+    return client
+
+
+async def close_llm_clients():
+    """Close the async clients of the running loop, e.g. before asyncio.run() tears it down."""
+    clients = _async_llm_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def bind_llm_loop(loop):
+    return _llm_loop.set(loop)
+
+
+async def _acquire_llm_semaphore():
+    semaphore = get_llm_semaphore()
+    await semaphore.acquire()
+    return semaphore
+
+
+@contextlib.contextmanager
+def llm_slot():
+    """Hold a slot of the bound loop's LLM semaphore around a sync call made off the loop thread."""
+    loop = _llm_loop.get()
+    try:
+        asyncio.get_running_loop()
+        on_loop_thread = True
+    except RuntimeError:
+        on_loop_thread = False
+    # blocking on the loop's own thread would deadlock
+    if loop is None or on_loop_thread or loop.is_closed():
+        yield
+        return
+    semaphore = asyncio.run_coroutine_threadsafe(_acquire_llm_semaphore(), loop).result()
+    try:
+        yield
+    finally:
+        loop.call_soon_threadsafe(semaphore.release)
+
+
+def record_llm_usage(response):
+    usage = getattr(response, 'usage', None)
+    scope = _llm_usage_scope.get()
+    with _llm_usage_lock:
+        for counters in (_llm_usage, scope) if scope is not None else (_llm_usage,):
+            counters['calls'] += 1
+            if usage is not None:
+                counters['prompt_tokens'] += usage.prompt_tokens or 0
+                counters['completion_tokens'] += usage.completion_tokens or 0
+
+
+@contextlib.contextmanager
+def use_llm_usage():
+    """Count the LLM calls of this context and the tasks and threads it starts into the yielded dict too."""
+    counters = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    token = _llm_usage_scope.set(counters)
+    try:
+        yield counters
+    finally:
+        _llm_usage_scope.reset(token)
+
+
+def get_llm_usage():
+    with _llm_usage_lock:
+        return dict(_llm_usage)
+
+
+def reset_llm_usage():
+    with _llm_usage_lock:
+        for key in _llm_usage:
+            _llm_usage[key] = 0
+
 
 def ChatGPT_API_with_finish_reason(model, prompt, api_key=CHATGPT_API_KEY, chat_history=None):
     max_retries = 10
-    client = openai.OpenAI(api_key=api_key, base_url=CHATGPT_BASE_URL)
+    client = get_llm_client(api_key)
     for i in range(max_retries):
         try:
             if chat_history:
@@ -42,11 +393,13 @@ def ChatGPT_API_with_finish_reason(model, prompt, api_key=CHATGPT_API_KEY, chat_
             else:
                 messages = [{"role": "user", "content": prompt}]
             
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-            )
+            with llm_slot(), trace_span('llm', cat='llm', model=model):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                )
+            record_llm_usage(response)
             if response.choices[0].finish_reason == "length":
                 return response.choices[0].message.content, "max_output_reached"
             else:
@@ -65,7 +418,7 @@ def ChatGPT_API_with_finish_reason(model, prompt, api_key=CHATGPT_API_KEY, chat_
 
 def ChatGPT_API(model, prompt, api_key=CHATGPT_API_KEY, chat_history=None):
     max_retries = 10
-    client = openai.OpenAI(api_key=api_key, base_url=CHATGPT_BASE_URL)
+    client = get_llm_client(api_key)
     for i in range(max_retries):
         try:
             if chat_history:
@@ -74,12 +427,13 @@ def ChatGPT_API(model, prompt, api_key=CHATGPT_API_KEY, chat_history=None):
             else:
                 messages = [{"role": "user", "content": prompt}]
             
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-            )
-   
+            with llm_slot(), trace_span('llm', cat='llm', model=model):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                )
+            record_llm_usage(response)
             return response.choices[0].message.content
         except Exception as e:
             print('************* Retrying *************')
@@ -96,13 +450,15 @@ async def ChatGPT_API_async(model, prompt, api_key=CHATGPT_API_KEY):
     messages = [{"role": "user", "content": prompt}]
     for i in range(max_retries):
         try:
-            async with openai.AsyncOpenAI(api_key=api_key, base_url=CHATGPT_BASE_URL) as client:
-                response = await client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0,
-                )
-                return response.choices[0].message.content
+            async with get_llm_semaphore():
+                with trace_span('llm', cat='llm', model=model):
+                    response = await get_async_llm_client(api_key).chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0,
+                    )
+            record_llm_usage(response)
+            return response.choices[0].message.content
         except Exception as e:
             print('************* Retrying *************')
             logging.error(f"Error: {e}")
@@ -113,6 +469,33 @@ async def ChatGPT_API_async(model, prompt, api_key=CHATGPT_API_KEY):
                 return "Error"  
             
             
+async def ChatGPT_API_with_finish_reason_async(model, prompt, api_key=CHATGPT_API_KEY):
+    max_retries = 10
+    messages = [{"role": "user", "content": prompt}]
+    for i in range(max_retries):
+        try:
+            async with get_llm_semaphore():
+                with trace_span('llm', cat='llm', model=model):
+                    response = await get_async_llm_client(api_key).chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0,
+                    )
+            record_llm_usage(response)
+            if response.choices[0].finish_reason == "length":
+                return response.choices[0].message.content, "max_output_reached"
+            else:
+                return response.choices[0].message.content, "finished"
+        except Exception as e:
+            print('************* Retrying *************')
+            logging.error(f"Error: {e}")
+            if i < max_retries - 1:
+                await asyncio.sleep(1)  # Wait for 1s before retrying
+            else:
+                logging.error('Max retries reached for prompt: ' + prompt)
+                return "Error", "error"
+
+
 def get_json_content(response):
     start_idx = response.find("```json")
     if start_idx != -1:
@@ -415,31 +798,24 @@ def add_preface_if_needed(data):
 
 
 
-def get_page_tokens(pdf_path, model="gpt-4o-2024-11-20", pdf_parser="PyPDF2"):
-    enc = tiktoken.get_encoding("cl100k_base")
+def get_page_tokens(pdf_path, model="gpt-4o-2024-11-20", pdf_parser="PyPDF2", token_mode="exact"):
     if pdf_parser == "PyPDF2":
         pdf_reader = PyPDF2.PdfReader(pdf_path)
-        page_list = []
+        page_texts = []
         for page_num in range(len(pdf_reader.pages)):
             page = pdf_reader.pages[page_num]
-            page_text = page.extract_text()
-            token_length = len(enc.encode(page_text))
-            page_list.append((page_text, token_length))
-        return page_list
+            page_texts.append(page.extract_text())
     elif pdf_parser == "PyMuPDF":
         if isinstance(pdf_path, BytesIO):
             pdf_stream = pdf_path
             doc = pymupdf.open(stream=pdf_stream, filetype="pdf")
         elif isinstance(pdf_path, str) and os.path.isfile(pdf_path) and pdf_path.lower().endswith(".pdf"):
             doc = pymupdf.open(pdf_path)
-        page_list = []
-        for page in doc:
-            page_text = page.get_text()
-            token_length = len(enc.encode(page_text))
-            page_list.append((page_text, token_length))
-        return page_list
+        page_texts = [page.get_text() for page in doc]
     else:
         raise ValueError(f"Unsupported PDF parser: {pdf_parser}")
+    token_lengths = count_page_tokens(page_texts, model=model, token_mode=token_mode)
+    return list(zip(page_texts, token_lengths))
 
         
 
@@ -452,9 +828,20 @@ def get_text_of_pdf_pages(pdf_pages, start_page, end_page):
 def get_text_of_pdf_pages_with_labels(pdf_pages, start_page, end_page):
     text = ""
     for page_num in range(start_page-1, end_page):
+        if is_empty_page(pdf_pages[page_num]):
+            continue
         text += f"<physical_index_{page_num+1}>\n{pdf_pages[page_num][0]}\n<physical_index_{page_num+1}>\n"
     return text
 
+def is_empty_page(page):
+    # Pages blanked by preprocessing keep their slot in page_list but never reach a prompt
+    return not page[0] or not page[0].strip()
+
+def get_labeled_page_text(page, physical_index):
+    if is_empty_page(page):
+        return ""
+    return f"<physical_index_{physical_index}>\n{page[0]}\n<physical_index_{physical_index}>\n\n"
+
 def get_number_of_pages(pdf_path):
     pdf_reader = PyPDF2.PdfReader(pdf_path)
     num = len(pdf_reader.pages)
@@ -538,6 +925,9 @@ def remove_structure_text(data):
 def check_token_limit(structure, limit=110000):
     list = structure_to_list(structure)
     for node in list:
+        # only encode nodes whose estimate could exceed the limit
+        if estimate_tokens(node['text'], upper=True) <= limit:
+            continue
         num_tokens = count_tokens(node['text'], model='gpt-4o')
         if num_tokens > limit:
             print(f"Node ID: {node['node_id']} has {num_tokens} tokens")
@@ -607,6 +997,25 @@ def add_node_text_with_labels(node, pdf_pages):
     return
 
 
+async def cached_summary(model, prompt, cache_text, kind='node'):
+    """
+    ChatGPT_API_async for summary prompts, answered from the summary cache of the
+    current run (see use_summary_cache) when the same input was summarized before.
+    """
+    cache = get_current_summary_cache()
+    if cache is None:
+        return await ChatGPT_API_async(model, prompt)
+    key = summary_cache_key(cache_text, model=model, kind=kind)
+    # SQLite reads and flushes run in a thread, not on the event loop
+    summary = await asyncio.to_thread(cache.get, key)
+    if summary is not None:
+        return summary
+    summary = await ChatGPT_API_async(model, prompt)
+    if summary != "Error":
+        await asyncio.to_thread(cache.put, key, summary, model=model)
+    return summary
+
+
 async def generate_node_summary(node, model=None):
     prompt = f"""You are given a part of a document, your task is to generate a description of the partial document about what are main points covered in the partial document.
 
@@ -614,13 +1023,167 @@ async def generate_node_summary(node, model=None):
     
     Directly return the description, do not include any other text.
     """
+    return await cached_summary(model, prompt, node['text'])
+
+
+# Upper bound of nodes in one packed prompt, every part adds a description to the answer
+PACKED_SUMMARY_MAX_NODES = 16
+# A node is packed when its text takes at most this share of the pack budget
+PACKED_SUMMARY_NODE_SHARE = 0.25
+_summary_tasks = set()
+
+
+async def generate_packed_summaries(nodes, model=None):
+    """Summaries of several small nodes from one prompt, None for parts missing from the answer."""
+    parts = "\n".join(f'<part id="{k}">\n{node["text"]}\n</part>' for k, node in enumerate(nodes, start=1))
+    prompt = f"""You are given several parts of a document, each enclosed in a <part> tag with an id. Your task is to generate a description of each part about what are main points covered in it.
+
+    Parts:
+    {parts}
+
+    Reply in the following JSON format:
+    {{
+        "1": "<description of part 1>",
+        "2": "<description of part 2>",
+        ...
+    }}
+    Directly return the final JSON structure. Do not output anything else."""
     response = await ChatGPT_API_async(model, prompt)
-    return response
+    summaries = extract_json(response) if response != "Error" else {}
+    if not isinstance(summaries, dict):
+        summaries = {}
+    result = []
+    for k in range(1, len(nodes) + 1):
+        summary = summaries.get(str(k))
+        result.append(summary.strip() if isinstance(summary, str) and summary.strip() else None)
+    return result
+
+
+def start_text_summaries(nodes, model=None, summary_token_threshold=0, pack_tokens=0, stats=None):
+    """
+    Start summarizing nodes from their own 'text', returns one future per node in input
+    order. Nodes under summary_token_threshold tokens keep their text as summary, nodes
+    small enough are packed into multi-node prompts of up to pack_tokens tokens, the
+    rest get one call each. Packed summaries go through the summary cache like
+    generate_node_summary, under the same keys.
+    """
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in nodes]
+    stats = stats if stats is not None else {}
+    cache = get_current_summary_cache()
+
+    def count(name, n=1):
+        stats[name] = stats.get(name, 0) + n
+
+    def settle(k, summary):
+        if not futures[k].done():
+            futures[k].set_result(summary)
+
+    def launch(coro, indices):
+        def forward(task):
+            _summary_tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                for k in indices:
+                    if not futures[k].done():
+                        futures[k].set_exception(task.exception())
+
+        task = asyncio.ensure_future(coro)
+        _summary_tasks.add(task)
+        task.add_done_callback(forward)
+
+    async def single(k):
+        settle(k, await generate_node_summary(nodes[k], model=model))
+
+    def cache_summaries(items):
+        for k, summary in items:
+            cache.put(summary_cache_key(nodes[k]['text'], model=model), summary, model=model)
+
+    async def packed(group):
+        summaries = await generate_packed_summaries([nodes[k] for k in group], model=model)
+        missing = [k for k, summary in zip(group, summaries) if summary is None]
+        found = [(k, summary) for k, summary in zip(group, summaries) if summary is not None]
+        if cache is not None and found:
+            await asyncio.to_thread(cache_summaries, found)
+        for k, summary in found:
+            settle(k, summary)
+        # parts the model skipped or mangled are summarized on their own
+        count('single_calls', len(missing))
+        await asyncio.gather(*[single(k) for k in missing])
+
+    async def pack(packable):
+        if cache is not None:
+            # one read-only query for all packable nodes, run off the loop; the cache writes are buffered
+            keys = [summary_cache_key(nodes[k]['text'], model=model) for k in packable]
+            cached = await asyncio.to_thread(cache.get_many, keys)
+            for k, summary in zip(packable, cached):
+                if summary is not None:
+                    count('cached')
+                    settle(k, summary)
+            packable = [k for k, summary in zip(packable, cached) if summary is None]
+
+        # greedy in document order, so a prompt holds neighbouring sections
+        groups, group, group_tokens = [], [], 0
+        for k in packable:
+            if group and (group_tokens + token_nums[k] > pack_tokens or len(group) >= PACKED_SUMMARY_MAX_NODES):
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(k)
+            group_tokens += token_nums[k]
+        if group:
+            groups.append(group)
+
+        for group in groups:
+            if len(group) == 1:
+                count('single_calls')
+                launch(single(group[0]), group)
+                continue
+            count('packed_calls')
+            count('packed_nodes', len(group))
+            launch(packed(group), group)
+
+    token_nums = count_tokens_many([node.get('text') or '' for node in nodes], model=model)
+    count('nodes', len(nodes))
+    packable, singles = [], []
+    for k, (node, num_tokens) in enumerate(zip(nodes, token_nums)):
+        if num_tokens < summary_token_threshold:
+            count('passthrough')
+            settle(k, node.get('text') or '')
+        elif pack_tokens and num_tokens <= pack_tokens * PACKED_SUMMARY_NODE_SHARE:
+            packable.append(k)
+        else:
+            singles.append(k)
+
+    count('single_calls', len(singles))
+    for k in singles:
+        launch(single(k), [k])
+    if packable:
+        launch(pack(packable), packable)
+    return futures
 
 
-async def generate_summaries_for_structure(structure, model=None):
+async def generate_summaries_for_structure(structure, model=None, checkpoint=None, on_summary=None,
+                                           summary_token_threshold=0, pack_tokens=0, stats=None):
     nodes = structure_to_list(structure)
-    tasks = [generate_node_summary(node, model=model) for node in nodes]
+    # summaries finished by an earlier, interrupted run of the same document
+    done = checkpoint.load_summaries() if checkpoint else {}
+    pending = [node for node in nodes if not (checkpoint and checkpoint.summary_key(node) in done)]
+    futures = dict(zip(map(id, pending), start_text_summaries(
+        pending, model=model, summary_token_threshold=summary_token_threshold, pack_tokens=pack_tokens, stats=stats)))
+
+    async def summarize(node):
+        key = checkpoint.summary_key(node) if checkpoint else None
+        if key in done:
+            summary = done[key]
+        else:
+            summary = await futures[id(node)]
+            if checkpoint and summary != "Error":
+                checkpoint.append_summary(key, summary)
+        if on_summary:
+            node['summary'] = summary
+            on_summary(node)
+        return summary
+
+    tasks = [summarize(node) for node in nodes]
     summaries = await asyncio.gather(*tasks)
     
     for node, summary in zip(nodes, summaries):
@@ -628,6 +1191,71 @@ async def generate_summaries_for_structure(structure, model=None):
     return structure
 
 
+async def generate_parent_summary(node, prefix_text, child_summaries, model=None):
+    sections = "\n".join(f"- {title}: {summary}" for title, summary in child_summaries)
+    prompt = f"""You are given the opening text of a part of a document and the descriptions of its sub-sections, your task is to generate a description of this part of the document about what are main points covered in it.
+
+    Opening Text: {prefix_text}
+
+    Sub-section Descriptions:
+    {sections}
+    
+    Directly return the description, do not include any other text.
+    """
+    return await cached_summary(model, prompt, f"{prefix_text}\n{sections}", kind='parent')
+
+
+def get_node_prefix_text(node, pdf_pages):
+    """Text of a node's pages before its first child starts, empty if the child starts on the first page."""
+    children = node.get('nodes') or []
+    if not children:
+        return node.get('text') or get_text_of_pdf_pages(pdf_pages, node['start_index'], node['end_index'])
+    return get_text_of_pdf_pages(pdf_pages, node['start_index'], children[0]['start_index'] - 1)
+
+
+async def generate_summaries_bottom_up(structure, pdf_pages, model=None, checkpoint=None, on_summary=None,
+                                       summary_token_threshold=0, pack_tokens=0, stats=None):
+    """
+    Summarize leaves from their own text and every other node from its prefix text plus
+    its children's summaries, instead of sending each page once per ancestor level.
+    A node starts as soon as all of its children are done. Leaves are summarized
+    together up front, so short ones pass through and small ones share packed prompts.
+    """
+    done = checkpoint.load_summaries() if checkpoint else {}
+    roots = structure if isinstance(structure, list) else [structure]
+    leaves = [node for node in structure_to_list(roots)
+              if not node.get('nodes') and not (checkpoint and checkpoint.summary_key(node) in done)]
+    for node in leaves:
+        if 'text' not in node:
+            node['text'] = get_text_of_pdf_pages(pdf_pages, node['start_index'], node['end_index'])
+    leaf_futures = dict(zip(map(id, leaves), start_text_summaries(
+        leaves, model=model, summary_token_threshold=summary_token_threshold, pack_tokens=pack_tokens, stats=stats)))
+
+    async def summarize(node):
+        children = node.get('nodes') or []
+        child_summaries = await asyncio.gather(*[summarize(child) for child in children])
+        key = checkpoint.summary_key(node) if checkpoint else None
+        if key in done:
+            summary = done[key]
+        elif not children:
+            summary = await leaf_futures[id(node)]
+        else:
+            summaries = [(child.get('title'), child_summary) for child, child_summary in zip(children, child_summaries)
+                         if child_summary != "Error"]
+            if stats is not None:
+                stats['parent_calls'] = stats.get('parent_calls', 0) + 1
+            summary = await generate_parent_summary(node, get_node_prefix_text(node, pdf_pages), summaries, model=model)
+        if checkpoint and key not in done and summary != "Error":
+            checkpoint.append_summary(key, summary)
+        node['summary'] = summary
+        if on_summary:
+            on_summary(node)
+        return summary
+
+    await asyncio.gather(*[summarize(node) for node in roots])
+    return structure
+
+
 def create_clean_structure_for_description(structure):
     """
     Create a clean structure for document description generation,
@@ -662,6 +1290,98 @@ def generate_doc_description(structure, model=None):
     response = ChatGPT_API(model, prompt)
     return response
 
+# Token budget of the outline sent for the document description
+DOC_DESCRIPTION_MAX_TOKENS = 3000
+# Every summary in the outline is cut to about this many tokens
+DOC_DESCRIPTION_SUMMARY_TOKENS = 80
+
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    """Cut text at a word boundary to about max_tokens estimated tokens."""
+    if not text:
+        return text
+    num_tokens = estimate_tokens(text, model)
+    if num_tokens <= max_tokens:
+        return text
+    cut = text[:max(1, int(len(text) * max_tokens / num_tokens))]
+    if ' ' in cut:
+        cut = cut[:cut.rfind(' ')]
+    return cut.rstrip() + '...'
+
+
+def build_description_outline(structure, max_tokens=DOC_DESCRIPTION_MAX_TOKENS,
+                              summary_tokens=DOC_DESCRIPTION_SUMMARY_TOKENS, model=None):
+    """
+    Indented outline of titles and truncated summaries for the document description,
+    level by level from the top: the top level is always included, a deeper level only
+    while it fits max_tokens, with summaries or else titles only. Nodes whose summary
+    does not exist yet are listed by title. Returns (outline, stats).
+    """
+    roots = structure if isinstance(structure, list) else [structure]
+    levels = []
+    frontier = [(node, 0) for node in roots]
+    while frontier:
+        levels.append(frontier)
+        frontier = [(child, depth + 1) for node, depth in frontier for child in (node.get('nodes') or [])]
+
+    def line(node, depth, with_summary):
+        text = f"{'  ' * depth}- {node.get('title', '')}"
+        summary = node.get('summary') or node.get('prefix_summary')
+        if with_summary and summary:
+            text += f": {truncate_to_tokens(summary, summary_tokens, model)}"
+        return text
+
+    included = {}
+    total = 0
+    for depth, level in enumerate(levels):
+        for with_summary in (True, False):
+            lines = {id(node): line(node, node_depth, with_summary) for node, node_depth in level}
+            level_tokens = sum(estimate_tokens(text, model) for text in lines.values())
+            if depth == 0 or total + level_tokens <= max_tokens:
+                break
+        else:
+            break
+        included.update(lines)
+        total += level_tokens
+
+    outline = []
+
+    def walk(nodes):
+        for node in nodes:
+            if id(node) in included:
+                outline.append(included[id(node)])
+                walk(node.get('nodes') or [])
+
+    walk(roots)
+    stats = {'outline_tokens': total, 'outline_nodes': len(included), 'tree_depth': len(levels),
+             'outline_depth': max((depth + 1 for depth, level in enumerate(levels)
+                                   if any(id(node) in included for node, _ in level)), default=0)}
+    return "\n".join(outline), stats
+
+
+async def generate_doc_description_async(structure, model=None, max_tokens=DOC_DESCRIPTION_MAX_TOKENS, usage=None):
+    """
+    Description of the document from a token-budgeted outline (build_description_outline)
+    instead of the whole structure. usage, if given, receives the outline stats and the
+    estimated prompt and answer tokens.
+    """
+    outline, stats = build_description_outline(structure, max_tokens=max_tokens, model=model)
+    prompt = f"""Your are an expert in generating descriptions for a document.
+    You are given the outline of a document with the descriptions of its sections. Your task is to generate a one-sentence description for the document, which makes it easy to distinguish the document from other documents.
+        
+    Document Outline:
+    {outline}
+    
+    Directly return the description, do not include any other text.
+    """
+    response = await ChatGPT_API_async(model, prompt)
+    if usage is not None:
+        usage.update(stats)
+        usage['prompt_tokens'] = estimate_tokens(prompt, model)
+        usage['output_tokens'] = estimate_tokens(response, model)
+    return response
+
+
 
 def reorder_dict(data, key_order):
     if not key_order:
@@ -687,10 +1407,12 @@ class ConfigLoader:
     def __init__(self, default_path: str = None):
         if default_path is None:
             default_path = Path(__file__).parent / "config.yaml"
-        self._default_dict = self._load_yaml(default_path)
+        self._default_dict = self._load_yaml(str(default_path))
 
     @staticmethod
+    @functools.lru_cache(maxsize=8)
     def _load_yaml(path):
+        # cached per path, callers only read from the returned dict
         with open(path, "r", encoding="utf-8") as f:
             return yaml.safe_load(f) or {}
 
@@ -3,12 +3,41 @@ import os
 import json
 from pageindex import *
 from pageindex.page_index_md import md_to_tree
+from pageindex.utils import close_llm_clients
+
+
+def build_pdf_opt(args):
+    """PDF options from the command line, unspecified keys fall back to config.yaml"""
+    return ConfigLoader().load({
+        'model': args.model,
+        'toc_check_page_num': args.toc_check_pages,
+        'max_page_num_each_node': args.max_pages_per_node,
+        'max_token_num_each_node': args.max_tokens_per_node,
+        'if_add_node_id': args.if_add_node_id,
+        'if_add_node_summary': args.if_add_node_summary,
+        'if_add_doc_description': args.if_add_doc_description,
+        'if_add_node_text': args.if_add_node_text,
+        'if_preprocess_pages': args.if_preprocess_pages,
+        'token_count_mode': args.token_count_mode,
+        'toc_generation_mode': args.toc_generation_mode,
+        'toc_verify_mode': args.toc_verify_mode,
+        'max_concurrent_splits': args.max_concurrent_splits,
+        'summary_mode': args.summary_mode,
+        'summary_token_threshold': args.summary_token_threshold,
+        'summary_pack_tokens': args.summary_pack_tokens,
+        'checkpoint_dir': args.checkpoint_dir,
+        'trace_dir': args.trace_dir,
+        'summary_cache_path': args.summary_cache,
+    })
+
 
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Process PDF or Markdown document and generate structure')
     parser.add_argument('--pdf_path', type=str, help='Path to the PDF file')
     parser.add_argument('--md_path', type=str, help='Path to the Markdown file')
+    parser.add_argument('--batch', type=str,
+                      help='Directory, glob pattern or manifest file (one path per line) of PDF/Markdown documents to index in one process')
 
     parser.add_argument('--model', type=str, default='gpt-4o-2024-11-20', help='Model to use')
 
@@ -27,21 +56,52 @@ if __name__ == "__main__":
                       help='Whether to add doc description to the doc')
     parser.add_argument('--if-add-node-text', type=str, default='no',
                       help='Whether to add text to the node')
+    parser.add_argument('--if-preprocess-pages', type=str, default='yes',
+                      help='Whether to strip repeated headers/footers and skip blank pages (PDF only)')
+    parser.add_argument('--token-count-mode', type=str, default='estimate', choices=['exact', 'estimate'],
+                      help='Exact or calibrated estimated page token counts for planning (PDF only)')
+    parser.add_argument('--toc-generation-mode', type=str, default='parallel', choices=['parallel', 'serial'],
+                      help='Generate the TOC of documents without one per page group in parallel, or as a serial chain (PDF only)')
+    parser.add_argument('--toc-verify-mode', type=str, default='adaptive', choices=['adaptive', 'all'],
+                      help='Verify TOC entries by sequential sampling, or check every entry (PDF only)')
+    parser.add_argument('--max-concurrent-splits', type=int, default=None,
+                      help='Large nodes split at the same time, largest first (PDF only, default: the LLM call limit)')
+    parser.add_argument('--summary-mode', type=str, default='bottom_up', choices=['bottom_up', 'flat'],
+                      help='Summarize parent nodes from their children\'s summaries (bottom_up) or from their full text (flat) (PDF only)')
+    parser.add_argument('--summary-token-threshold', type=int, default=200,
+                      help='Nodes under this many tokens keep their text as summary instead of calling the LLM')
+    parser.add_argument('--summary-pack-tokens', type=int, default=8000,
+                      help='Token budget of a prompt summarizing several small nodes at once, 0 to summarize each node alone')
+    parser.add_argument('--checkpoint-dir', type=str, default=None,
+                      help='Directory for stage checkpoints, a rerun resumes after the last finished stage (PDF only)')
+    parser.add_argument('--trace-dir', type=str, default=None,
+                      help='Write the execution trace of the indexing stages as Chrome trace-event JSON here (PDF only)')
+    parser.add_argument('--summary-cache', type=str, default=None,
+                      help='SQLite file of node summaries reused across documents and re-indexes')
                       
     # Markdown specific arguments
     parser.add_argument('--if-thinning', type=str, default='no',
                       help='Whether to apply tree thinning for markdown (markdown only)')
     parser.add_argument('--thinning-threshold', type=int, default=5000,
                       help='Minimum token threshold for thinning (markdown only)')
-    parser.add_argument('--summary-token-threshold', type=int, default=200,
-                      help='Token threshold for generating summaries (markdown only)')
+    parser.add_argument('--previous-structure', type=str, default=None,
+                      help='Output JSON of an earlier run with this flag; unchanged sections keep node IDs and summaries (markdown only)')
+
+    # Batch specific arguments
+    parser.add_argument('--output-dir', type=str, default='./results',
+                      help='Directory for the results and manifest.jsonl of a batch (batch only)')
+    parser.add_argument('--workers', type=int, default=4,
+                      help='Documents indexed at the same time (batch only)')
+    parser.add_argument('--max-concurrent-llm-calls', type=int, default=None,
+                      help='LLM requests in flight across all documents of a batch (batch only, default: PAGEINDEX_MAX_CONCURRENT_LLM_CALLS or 8)')
     args = parser.parse_args()
     
-    # Validate that exactly one file type is specified
-    if not args.pdf_path and not args.md_path:
-        raise ValueError("Either --pdf_path or --md_path must be specified")
-    if args.pdf_path and args.md_path:
-        raise ValueError("Only one of --pdf_path or --md_path can be specified")
+    # Validate that exactly one input is specified
+    num_inputs = sum(1 for value in (args.pdf_path, args.md_path, args.batch) if value)
+    if num_inputs == 0:
+        raise ValueError("One of --pdf_path, --md_path or --batch must be specified")
+    if num_inputs > 1:
+        raise ValueError("Only one of --pdf_path, --md_path or --batch can be specified")
     
     if args.pdf_path:
         # Validate PDF file
@@ -51,17 +111,7 @@ if __name__ == "__main__":
             raise ValueError(f"PDF file not found: {args.pdf_path}")
             
         # Process PDF file
-        # Configure options
-        opt = config(
-            model=args.model,
-            toc_check_page_num=args.toc_check_pages,
-            max_page_num_each_node=args.max_pages_per_node,
-            max_token_num_each_node=args.max_tokens_per_node,
-            if_add_node_id=args.if_add_node_id,
-            if_add_node_summary=args.if_add_node_summary,
-            if_add_doc_description=args.if_add_doc_description,
-            if_add_node_text=args.if_add_node_text
-        )
+        opt = build_pdf_opt(args)
 
         # Process the PDF
         toc_with_page_number = page_index_main(args.pdf_path, opt)
@@ -101,23 +151,41 @@ if __name__ == "__main__":
             'if_add_node_summary': args.if_add_node_summary,
             'if_add_doc_description': args.if_add_doc_description,
             'if_add_node_text': args.if_add_node_text,
-            'if_add_node_id': args.if_add_node_id
+            'if_add_node_id': args.if_add_node_id,
+            'summary_cache_path': args.summary_cache,
         }
         
         # Load config with defaults from config.yaml
         opt = config_loader.load(user_opt)
+
+        previous = None
+        if args.previous_structure:
+            if os.path.isfile(args.previous_structure):
+                with open(args.previous_structure, 'r', encoding='utf-8') as f:
+                    previous = json.load(f)
+            else:
+                previous = {'structure': []}
         
-        toc_with_page_number = asyncio.run(md_to_tree(
-            md_path=args.md_path,
-            if_thinning=args.if_thinning.lower() == 'yes',
-            min_token_threshold=args.thinning_threshold,
-            if_add_node_summary=opt.if_add_node_summary,
-            summary_token_threshold=args.summary_token_threshold,
-            model=opt.model,
-            if_add_doc_description=opt.if_add_doc_description,
-            if_add_node_text=opt.if_add_node_text,
-            if_add_node_id=opt.if_add_node_id
-        ))
+        async def run_md_to_tree():
+            try:
+                return await md_to_tree(
+                    md_path=args.md_path,
+                    if_thinning=args.if_thinning.lower() == 'yes',
+                    min_token_threshold=args.thinning_threshold,
+                    if_add_node_summary=opt.if_add_node_summary,
+                    summary_token_threshold=args.summary_token_threshold,
+                    model=opt.model,
+                    if_add_doc_description=opt.if_add_doc_description,
+                    if_add_node_text=opt.if_add_node_text,
+                    if_add_node_id=opt.if_add_node_id,
+                    summary_cache_path=opt.summary_cache_path,
+                    summary_pack_tokens=opt.summary_pack_tokens,
+                    previous=previous,
+                )
+            finally:
+                await close_llm_clients()
+
+        toc_with_page_number = asyncio.run(run_md_to_tree())
         
         print('Parsing done, saving to file...')
         
@@ -130,4 +198,38 @@ if __name__ == "__main__":
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(toc_with_page_number, f, indent=2, ensure_ascii=False)
         
-        print(f'Tree structure saved to: {output_file}')
\ No newline at end of file
+        print(f'Tree structure saved to: {output_file}')
+
+    elif args.batch:
+        import asyncio
+        import pageindex.utils as pageindex_utils
+        from pageindex.batch import collect_documents, run_batch
+
+        documents = collect_documents(args.batch)
+        if not documents:
+            raise ValueError(f"No PDF or Markdown documents found: {args.batch}")
+        if args.max_concurrent_llm_calls:
+            # read when the event loop's LLM semaphore is created
+            pageindex_utils.MAX_CONCURRENT_LLM_CALLS = args.max_concurrent_llm_calls
+
+        opt = build_pdf_opt(args)
+        md_options = {
+            'if_thinning': args.if_thinning.lower() == 'yes',
+            'min_token_threshold': args.thinning_threshold,
+            'if_add_node_summary': opt.if_add_node_summary,
+            'summary_token_threshold': args.summary_token_threshold,
+            'if_add_doc_description': opt.if_add_doc_description,
+            'if_add_node_text': opt.if_add_node_text,
+            'if_add_node_id': opt.if_add_node_id,
+            'summary_cache_path': opt.summary_cache_path,
+            'summary_pack_tokens': opt.summary_pack_tokens,
+        }
+
+        async def run_batch_and_close():
+            try:
+                return await run_batch(documents, args.output_dir, opt, md_options=md_options, workers=args.workers)
+            finally:
+                await close_llm_clients()
+
+        asyncio.run(run_batch_and_close())
+        print(f"Manifest saved to: {os.path.join(args.output_dir, 'manifest.jsonl')}")
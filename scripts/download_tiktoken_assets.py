@@ -0,0 +1,85 @@
+"""
+准备 tiktoken 编码文件（离线环境使用）
+
+PageIndex 启动时会把 TIKTOKEN_CACHE_DIR 指向项目的 data/tiktoken 目录。
+在可以联网的机器（或镜像构建阶段）运行本脚本下载编码文件；
+完全离线时可用 --from-file 导入事先拷贝过来的 .tiktoken 文件。
+DeepSeek 模型使用自己的 tokenizer.json（随 DeepSeek-V3 发布），--deepseek 从 Hugging Face
+下载到 data/tokenizers/deepseek，离线时可用 --deepseek-tokenizer 导入本地文件；
+缺失时按字符比例估算并输出警告。
+
+用法：
+    python scripts/download_tiktoken_assets.py
+    python scripts/download_tiktoken_assets.py --from-file /path/to/cl100k_base.tiktoken
+    python scripts/download_tiktoken_assets.py --deepseek
+    python scripts/download_tiktoken_assets.py --deepseek-tokenizer /path/to/tokenizer.json
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENCODING_URLS = {
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="准备 tiktoken 编码文件")
+    parser.add_argument("--encoding", action="append", choices=sorted(ENCODING_URLS),
+                        help="要准备的编码，可重复指定（默认 cl100k_base）")
+    parser.add_argument("--from-file", help="从本地 .tiktoken 文件导入（仅支持单个编码）")
+    parser.add_argument("--deepseek", action="store_true", help="下载 DeepSeek 的 tokenizer.json")
+    parser.add_argument("--deepseek-tokenizer", help="导入本地的 DeepSeek tokenizer.json")
+    args = parser.parse_args()
+    encodings = args.encoding or ["cl100k_base"]
+
+    # 导入 pageindex.utils 时会设置 TIKTOKEN_CACHE_DIR
+    from pageindex.utils import TIKTOKEN_CACHE_DIR
+    from pageindex.tokenizer_registry import get_encoding
+
+    if not TIKTOKEN_CACHE_DIR:
+        raise SystemExit("未设置 TIKTOKEN_CACHE_DIR，且项目 data 目录不可写")
+    os.makedirs(TIKTOKEN_CACHE_DIR, exist_ok=True)
+    print(f"缓存目录: {TIKTOKEN_CACHE_DIR}")
+
+    if args.from_file:
+        if len(encodings) != 1:
+            raise SystemExit("--from-file 只能配合一个 --encoding 使用")
+        # tiktoken 以下载 URL 的 sha1 作为缓存文件名
+        cache_key = hashlib.sha1(ENCODING_URLS[encodings[0]].encode()).hexdigest()
+        shutil.copyfile(args.from_file, os.path.join(TIKTOKEN_CACHE_DIR, cache_key))
+
+    for encoding_name in encodings:
+        enc = get_encoding(encoding_name)
+        print(f"{encoding_name}: OK（词表大小 {enc.n_vocab}）")
+
+    if args.deepseek or args.deepseek_tokenizer:
+        from pageindex.tokenizer_registry import (
+            DEEPSEEK_TOKENIZER_PATH,
+            DEEPSEEK_TOKENIZER_URL,
+            load_deepseek_tokenizer,
+        )
+
+        os.makedirs(os.path.dirname(DEEPSEEK_TOKENIZER_PATH), exist_ok=True)
+        if args.deepseek_tokenizer:
+            shutil.copyfile(args.deepseek_tokenizer, DEEPSEEK_TOKENIZER_PATH)
+        else:
+            # 先写临时文件，下载中断时不会留下半个 tokenizer.json
+            tmp_path = DEEPSEEK_TOKENIZER_PATH + ".tmp"
+            urllib.request.urlretrieve(DEEPSEEK_TOKENIZER_URL, tmp_path)
+            os.replace(tmp_path, DEEPSEEK_TOKENIZER_PATH)
+        tokenizer = load_deepseek_tokenizer()
+        if tokenizer.name != "deepseek":
+            raise SystemExit(f"DeepSeek tokenizer 加载失败: {DEEPSEEK_TOKENIZER_PATH}")
+        print(f"DeepSeek tokenizer: {tokenizer.name}（{DEEPSEEK_TOKENIZER_PATH}）")
+
+
+if __name__ == "__main__":
+    main()
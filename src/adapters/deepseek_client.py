@@ -1,6 +1,6 @@
 """DeepSeek API 客户端"""
 
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from langchain_core.language_models import BaseChatModel
 from langchain_openai import ChatOpenAI
@@ -13,6 +13,8 @@ class DeepSeekClient:
     def __init__(self):
         self.settings = get_settings()
         self._llm = None
+        # 按 (temperature, max_tokens) 复用模型实例，避免每次调用都新建 HTTP 客户端
+        self._chat_models: Dict[Tuple[float, int], BaseChatModel] = {}
 
     @property
     def llm(self) -> BaseChatModel:
@@ -30,14 +32,18 @@ class DeepSeekClient:
 
     def get_chat_model(self, temperature: float = None, max_tokens: int = None) -> BaseChatModel:
         """获取指定温度和最大 token 数的聊天模型"""
-        return ChatOpenAI(
-            model=self.settings.deepseek_model,
-            api_key=self.settings.deepseek_api_key,
-            base_url=self.settings.deepseek_base_url,
-            temperature=temperature or self.settings.llm_temperature,
-            max_tokens=max_tokens or self.settings.max_tokens,
-            timeout=self.settings.request_timeout,
-        )
+        key = (temperature or self.settings.llm_temperature, max_tokens or self.settings.max_tokens)
+        model = self._chat_models.get(key)
+        if model is None:
+            model = self._chat_models[key] = ChatOpenAI(
+                model=self.settings.deepseek_model,
+                api_key=self.settings.deepseek_api_key,
+                base_url=self.settings.deepseek_base_url,
+                temperature=key[0],
+                max_tokens=key[1],
+                timeout=self.settings.request_timeout,
+            )
+        return model
 
     def invoke(self, prompt: str, temperature: float = None) -> str:
         """调用 LLM 并返回文本响应"""
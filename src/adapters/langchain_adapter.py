@@ -57,3 +57,14 @@ class LangChainPageIndexAdapter:
 
         # 如果需要，也可以注入到全局命名空间
         sys.modules["pageindex_adapter"] = self
+
+
+_adapter = None
+
+
+def get_pageindex_adapter() -> LangChainPageIndexAdapter:
+    """获取适配器单例，所有索引任务共用同一个 DeepSeek 客户端及其连接池"""
+    global _adapter
+    if _adapter is None:
+        _adapter = LangChainPageIndexAdapter()
+    return _adapter
@@ -16,6 +16,7 @@ def content_extractor(node_id: str) -> dict:
     Returns:
         节点的完整内容
     """
+    from src.core.lazy_summary import get_lazy_summary_service
     from src.storage.database import get_session
     from src.storage.models import PageIndex
 
@@ -25,6 +26,9 @@ def content_extractor(node_id: str) -> dict:
         if not node:
             return {"error": f"节点不存在: {node_id}"}
 
+        # 延迟摘要模式下首次访问时生成摘要
+        get_lazy_summary_service().ensure_summaries(session, [node])
+
         return {
             "node_id": node.node_id,
             "title": node.title,
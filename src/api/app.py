@@ -1,5 +1,6 @@
 """FastAPI 应用入口"""
 
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -9,6 +10,7 @@ from src.api.routes.documents import router as documents_router
 from src.api.routes.search import router as search_router
 from src.config.settings import get_settings
 from src.storage.database import init_db
+from src.utils.warmup import warm_up_components
 
 
 @asynccontextmanager
@@ -21,6 +23,11 @@ async def lifespan(app: FastAPI):
     init_db()
     print("数据库初始化完成")
 
+    # 预热 tokenizer、PageIndex 配置和提示词模板，避免首个请求承担冷启动开销
+    print("正在预热索引组件...")
+    timings = await asyncio.to_thread(warm_up_components)
+    print(f"预热完成: {timings}")
+
     yield
 
     # 关闭时的清理工作
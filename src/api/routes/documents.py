@@ -1,5 +1,6 @@
 """文档管理接口"""
 
+import asyncio
 from typing import List
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
@@ -13,7 +14,7 @@ from src.api.schemas import (
 from src.config.settings import get_settings
 from src.core.document_manager import DocumentManager
 from src.core.index_engine import IndexEngine
-from src.storage.database import get_session
+from src.storage.database import get_session, get_session_factory_global
 from src.storage.file_storage import FileStorage
 
 router = APIRouter(prefix="/documents", tags=["documents"])
@@ -100,7 +101,7 @@ def list_documents(
     参数：
     - skip: 跳过的记录数
     - limit: 返回的记录数
-    - status_filter: 状态过滤（pending, indexing, indexed, failed）
+    - status_filter: 状态过滤（pending, indexing, partially_indexed, indexed, failed）
     """
     with get_session() as session:
         document_manager = DocumentManager(session)
@@ -146,15 +147,18 @@ def delete_document(document_id: int):
 
 
 @router.post("/{document_id}/index", response_model=IndexResponse)
-def index_document(document_id: int):
+async def index_document(document_id: int):
     """
     索引文档
 
     启动文档的索引流程，生成树状结构。
     """
-    with get_session() as session:
-        document_manager = DocumentManager(session)
-        document = document_manager.get_document(document_id)
+    # 同步数据库操作放到线程中执行，不阻塞事件循环
+    def load_document():
+        with get_session() as session:
+            return DocumentManager(session).get_document(document_id)
+
+    document = await asyncio.to_thread(load_document)
 
     if not document:
         raise HTTPException(
@@ -162,9 +166,10 @@ def index_document(document_id: int):
             detail=f"文档不存在: {document_id}",
         )
 
+    session = get_session_factory_global()()
     try:
         index_engine = IndexEngine(session)
-        indexed_document = index_engine.index_document(document_id)
+        indexed_document = await index_engine.aindex_document(document_id)
 
         return IndexResponse(
             document_id=document_id,
@@ -176,6 +181,8 @@ def index_document(document_id: int):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"索引失败: {str(e)}",
         )
+    finally:
+        await asyncio.to_thread(session.close)
 
 
 @router.get("/{document_id}/status", response_model=DocumentResponse)
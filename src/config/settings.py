@@ -41,6 +41,22 @@ class Settings(BaseSettings):
     if_add_node_summary: str = Field(default="yes", description="是否添加节点摘要")
     if_add_doc_description: str = Field(default="yes", description="是否添加文档描述")
     if_add_node_text: str = Field(default="no", description="是否添加节点文本")
+    if_preprocess_pages: str = Field(default="yes", description="是否去除页眉页脚并跳过空白页")
+    token_count_mode: str = Field(default="estimate", description="页面 token 计数方式（exact/estimate）")
+    toc_generation_mode: str = Field(default="parallel", description="无目录文档的目录生成方式（parallel/serial）")
+    toc_verify_mode: str = Field(default="adaptive", description="目录校验方式（adaptive 顺序抽样/all 全量检查）")
+    max_concurrent_splits: int = Field(default=0, description="同时拆分的大节点数，按 token 量从大到小调度，0 表示与 LLM 并发上限相同")
+    summary_mode: str = Field(default="bottom_up", description="节点摘要模式：bottom_up 由子节点摘要汇总父节点，flat 每个节点读取全文")
+    summary_token_threshold: int = Field(default=200, description="节点文本少于该 token 数时直接作为摘要，不调用 LLM")
+    summary_pack_tokens: int = Field(default=8000, description="多个小节点合并为一次摘要请求的 token 预算，0 表示逐节点请求")
+    progressive_indexing: str = Field(default="yes", description="是否在索引过程中渐进写入节点（状态为 partially_indexed 时即可检索已有部分）")
+    lazy_summaries: str = Field(default="no", description="是否延迟生成节点摘要：索引只保存树结构和页码范围，摘要在检索首次访问节点时生成")
+    summary_backfill: str = Field(default="no", description="延迟摘要模式下是否在索引完成后由后台低优先级补齐剩余摘要")
+    summary_backfill_interval: float = Field(default=1.0, description="后台补齐摘要时每个节点之间的间隔（秒）")
+    incremental_reindex: str = Field(default="yes", description="Markdown 文档重新索引时按章节文本哈希增量更新：未变章节保留节点 ID 和摘要，只重写变化的节点")
+    checkpoint_path: str = Field(default="./data/checkpoints", description="索引阶段检查点路径，失败重试时从最后完成的阶段继续")
+    trace_path: str = Field(default="", description="索引执行 trace 输出目录（Chrome trace-event JSON），为空时不导出")
+    summary_cache_path: str = Field(default="./data/summary_cache.db", description="节点摘要缓存（SQLite），按文本哈希跨文档复用，为空时不缓存")
 
     # 检索配置
     default_top_k: int = Field(default=5, description="默认返回结果数")
@@ -72,6 +88,12 @@ class Settings(BaseSettings):
         path.mkdir(parents=True, exist_ok=True)
         return path
 
+    def get_checkpoint_path(self) -> Path:
+        """获取索引检查点路径"""
+        path = Path(self.checkpoint_path)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
     def get_log_path(self) -> Path:
         """获取日志文件路径"""
         path = Path(self.log_file)
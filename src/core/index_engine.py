@@ -2,14 +2,16 @@
 
 import asyncio
 import json
+import queue
 import sys
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 
-from src.adapters.langchain_adapter import LangChainPageIndexAdapter
+from src.adapters.langchain_adapter import get_pageindex_adapter
 from src.config.settings import get_settings
 from src.core.document_manager import DocumentManager
 from src.storage.models import Document, PageIndex
@@ -22,45 +24,104 @@ class IndexEngine:
         self.session = session
         self.settings = get_settings()
         self.document_manager = DocumentManager(session)
-        self.adapter = LangChainPageIndexAdapter()
+        self.adapter = get_pageindex_adapter()
 
     def index_document(self, doc_id: int) -> Optional[Document]:
-        """索引文档"""
-        document = self.document_manager.get_document(doc_id)
+        """索引文档（同步入口，在独立事件循环中运行，用于 CLI 和脚本）"""
+        return self._run_sync(self.aindex_document(doc_id))
+
+    async def aindex_document(self, doc_id: int) -> Optional[Document]:
+        """索引文档（异步入口，复用调用方的事件循环和连接池，可在 FastAPI 中直接 await）"""
+        document = await self._db(self.document_manager.get_document, doc_id)
         if not document:
             raise ValueError(f"文档不存在: {doc_id}")
 
         # 更新状态为索引中
-        self.document_manager.update_document_status(doc_id, "indexing")
+        await self._db(self.document_manager.update_document_status, doc_id, "indexing")
+        self._partial_index_written = False
 
         try:
             # 注入 DeepSeek API 到 PageIndex
             self.adapter.inject_to_pageindex()
 
             # 根据文档类型索引
+            previous = None
             if document.doc_type == "pdf":
-                tree_data = self._index_pdf(document)
+                tree_data = await self._index_pdf(document)
             elif document.doc_type == "markdown":
-                tree_data = self._index_markdown(document)
+                if self.settings.incremental_reindex == "yes":
+                    previous = {"structure": await self._db(self._load_stored_tree, document.id)}
+                tree_data = await self._index_markdown(document, previous)
             else:
                 raise ValueError(f"不支持的文档类型: {document.doc_type}")
 
-            # 保存到数据库
-            self._save_tree_data(document.id, tree_data)
+            # 保存到数据库：增量模式只写入有变化的节点
+            if previous is not None:
+                counts = await self._db(self._apply_tree_diff, document.id, tree_data)
+                print(f"增量更新 page_indices：新增 {counts['inserted']}，更新 {counts['updated']}，删除 {counts['deleted']}")
+            else:
+                await self._db(self._save_tree_data, document.id, tree_data)
 
             # 更新状态为已索引
-            self.document_manager.update_document_status(doc_id, "indexed")
+            await self._db(self.document_manager.update_document_status, doc_id, "indexed")
+
+            # 延迟摘要模式：可选地在后台补齐未生成的摘要
+            if self._lazy_summaries and self.settings.summary_backfill == "yes":
+                from src.core.lazy_summary import get_lazy_summary_service
+
+                get_lazy_summary_service().start_backfill(doc_id)
+
+            # 索引结果已入库，清理该文档的阶段检查点
+            if document.doc_type == "pdf":
+                from pageindex.checkpoint import clear_checkpoint
+
+                file_path = await self._db(self.document_manager.get_document_file_path, document.id)
+                clear_checkpoint(str(self.settings.get_checkpoint_path()), str(file_path))
 
             return document
 
         except Exception as e:
+            # 渐进入库写入的是不完整的树（只在文档没有旧索引时写入），失败时删除，避免失败的文档仍能检索到残缺的结构
+            if self._partial_index_written:
+                await self._db(self._delete_document_nodes, doc_id)
             # 更新状态为失败
-            self.document_manager.update_document_status(doc_id, "failed")
+            await self._db(self.document_manager.update_document_status, doc_id, "failed")
             raise e
 
-    def _index_pdf(self, document: Document) -> dict:
+    @staticmethod
+    async def _db(func: Callable, *args: Any) -> Any:
+        """在线程中执行同步数据库操作，避免阻塞调用方（如 FastAPI）的事件循环；同一会话的操作依次 await，不会并发"""
+        return await asyncio.to_thread(func, *args)
+
+    @property
+    def _lazy_summaries(self) -> bool:
+        """延迟摘要模式：索引时不生成节点摘要和文档描述，节点标记 summary_pending"""
+        return self.settings.lazy_summaries == "yes"
+
+    @property
+    def _if_add_node_summary(self) -> str:
+        return "no" if self._lazy_summaries else self.settings.if_add_node_summary
+
+    @property
+    def _if_add_doc_description(self) -> str:
+        return "no" if self._lazy_summaries else self.settings.if_add_doc_description
+
+    @staticmethod
+    def _run_sync(coro: Coroutine) -> Any:
+        """在新事件循环中运行协程，结束前关闭该循环上的 PageIndex LLM 客户端"""
+        from pageindex.utils import close_llm_clients
+
+        async def run():
+            try:
+                return await coro
+            finally:
+                await close_llm_clients()
+
+        return asyncio.run(run())
+
+    async def _index_pdf(self, document: Document) -> dict:
         """索引 PDF 文档"""
-        file_path = self.document_manager.get_document_file_path(document.id)
+        file_path = await self._db(self.document_manager.get_document_file_path, document.id)
 
         # 创建配置对象，使用 PageIndex 默认配置并覆盖用户配置
         from pageindex.utils import ConfigLoader
@@ -87,74 +148,219 @@ class IndexEngine:
             "max_page_num_each_node": int(max_page_num_each_node),
             "max_token_num_each_node": int(max_token_num_each_node),
             "if_add_node_id": self.settings.if_add_node_id,
-            "if_add_node_summary": self.settings.if_add_node_summary,
-            "if_add_doc_description": self.settings.if_add_doc_description,
+            "if_add_node_summary": self._if_add_node_summary,
+            "if_add_doc_description": self._if_add_doc_description,
             "if_add_node_text": self.settings.if_add_node_text,
+            "if_preprocess_pages": self.settings.if_preprocess_pages,
+            "token_count_mode": self.settings.token_count_mode,
+            "toc_generation_mode": self.settings.toc_generation_mode,
+            "toc_verify_mode": self.settings.toc_verify_mode,
+            "max_concurrent_splits": int(self.settings.max_concurrent_splits) or None,
+            "summary_mode": self.settings.summary_mode,
+            "summary_token_threshold": int(self.settings.summary_token_threshold),
+            "summary_pack_tokens": int(self.settings.summary_pack_tokens),
+            "checkpoint_dir": str(self.settings.get_checkpoint_path()),
+            "trace_dir": self.settings.trace_path or None,
+            "summary_cache_path": self.settings.summary_cache_path or None,
         }
 
         opt = ConfigLoader().load(user_opt)
 
         # 使用 PageIndex 索引 PDF
-        from pageindex.page_index import page_index_main
+        from pageindex.page_index import page_index_main_async
 
-        result = page_index_main(str(file_path), opt)
-        tree_data = asyncio.run(result) if asyncio.iscoroutine(result) else result
-        return tree_data
+        # 渐进入库：顶层节点、大节点拆分出的子树和节点摘要在产生时即写入 page_indices。
+        # 已有索引的文档（重新索引）不渐进写入，旧树保持可检索，直到新结果在 _save_tree_data 中整体替换
+        if self.settings.progressive_indexing != "yes" or await self._db(self._has_stored_nodes, document.id):
+            return await page_index_main_async(str(file_path), opt)
+        writer = ProgressWriter(self, document.id)
+        try:
+            return await page_index_main_async(str(file_path), opt, on_progress=writer)
+        finally:
+            # 等队列中的写库操作完成，之后才由本会话写入最终结果
+            await asyncio.to_thread(writer.close)
+            self._partial_index_written = writer.wrote
 
-    def _index_markdown(self, document: Document) -> dict:
-        """索引 Markdown 文档"""
-        file_path = self.document_manager.get_document_file_path(document.id)
+    async def _index_markdown(self, document: Document, previous: Optional[dict] = None) -> dict:
+        """索引 Markdown 文档，previous 为已入库的旧树时按章节哈希增量索引"""
+        file_path = await self._db(self.document_manager.get_document_file_path, document.id)
 
         # 使用 PageIndex 索引 Markdown
         from pageindex.page_index_md import md_to_tree
 
-        result = md_to_tree(
+        # md_to_tree 的开关参数是 "yes"/"no" 字符串，与 PDF 配置一致
+        return await md_to_tree(
             md_path=str(file_path),
             if_thinning=False,
             min_token_threshold=5000,
-            if_add_node_summary=self.settings.if_add_node_summary == "yes",
-            summary_token_threshold=200,
+            if_add_node_summary=self._if_add_node_summary,
+            summary_token_threshold=int(self.settings.summary_token_threshold),
             model=self.settings.deepseek_model,
-            if_add_doc_description=self.settings.if_add_doc_description == "yes",
-            if_add_node_text=self.settings.if_add_node_text == "yes",
-            if_add_node_id=self.settings.if_add_node_id == "yes",
+            if_add_doc_description=self._if_add_doc_description,
+            # 延迟摘要需要节点文本，Markdown 节点没有页码范围，文本随节点入库
+            if_add_node_text="yes" if self._lazy_summaries else self.settings.if_add_node_text,
+            if_add_node_id=self.settings.if_add_node_id,
+            summary_cache_path=self.settings.summary_cache_path or None,
+            summary_pack_tokens=int(self.settings.summary_pack_tokens),
+            previous=previous,
         )
-        tree_data = asyncio.run(result) if asyncio.iscoroutine(result) else result
-        return tree_data
+
+    def _load_stored_tree(self, doc_id: int) -> List[dict]:
+        """
+        从 page_indices 还原文档的旧树（title/node_id/summary/prefix_summary/text_hash/nodes），
+        作为 md_to_tree 增量索引的对照。兄弟节点按 line_num 排序。
+        """
+        rows = self.session.query(PageIndex).filter(PageIndex.document_id == doc_id).all()
+        nodes: Dict[str, dict] = {}
+        parents: Dict[str, Optional[str]] = {}
+        for row in rows:
+            try:
+                metadata = json.loads(row.node_metadata or "{}")
+            except (TypeError, ValueError):
+                metadata = {}
+            nodes[row.node_id] = {
+                "title": row.title,
+                "node_id": row.node_id,
+                "summary": row.summary,
+                "prefix_summary": metadata.get("prefix_summary"),
+                "text_hash": metadata.get("text_hash"),
+                "line_num": metadata.get("line_num") or 0,
+                "nodes": [],
+            }
+            parents[row.node_id] = row.parent_id
+
+        roots = []
+        for node_id, node in nodes.items():
+            parent = nodes.get(parents[node_id]) if parents[node_id] else None
+            (parent["nodes"] if parent is not None else roots).append(node)
+        for node in [*nodes.values(), {"nodes": roots}]:
+            node["nodes"].sort(key=lambda child: (child["line_num"], child["node_id"]))
+        return roots
+
+    def _has_stored_nodes(self, doc_id: int) -> bool:
+        """文档在 page_indices 中是否已有节点"""
+        return self.session.query(PageIndex.id).filter(PageIndex.document_id == doc_id).first() is not None
+
+    def _delete_document_nodes(self, doc_id: int):
+        """删除文档的全部节点（渐进入库的索引失败时清理不完整的树）"""
+        self.session.rollback()
+        self.session.query(PageIndex).filter(PageIndex.document_id == doc_id).delete()
+        self.session.commit()
+
+    @staticmethod
+    def _fallback_node_id(parent_id: Optional[str], position: int) -> str:
+        """没有 node_id 的节点按树路径生成 ID"""
+        return f"p{position:04d}" if parent_id is None else f"{parent_id}.{position:02d}"
+
+    @staticmethod
+    def _root_nodes(tree_data: Any) -> List[dict]:
+        """兼容 PageIndex 返回结构：dict{structure: [...]} / list / node dict"""
+        if isinstance(tree_data, dict) and "structure" in tree_data:
+            return tree_data["structure"] or []
+        if isinstance(tree_data, list):
+            return tree_data
+        return [tree_data]
 
     def _save_tree_data(self, doc_id: int, tree_data: dict):
         """保存树状数据到数据库"""
         # 清除旧索引
         self.session.query(PageIndex).filter(PageIndex.document_id == doc_id).delete()
 
-        # 兼容 PageIndex 返回结构：dict{structure: [...]} / list / node dict
-        if isinstance(tree_data, dict) and "structure" in tree_data:
-            root_nodes = tree_data["structure"] or []
-        elif isinstance(tree_data, list):
-            root_nodes = tree_data
-        else:
-            root_nodes = [tree_data]
+        root_nodes = self._root_nodes(tree_data)
 
         # 递归保存节点
-        for node in root_nodes:
-            self._save_node_recursive(doc_id, node, parent_id=None)
+        for k, node in enumerate(root_nodes, start=1):
+            self._save_node_recursive(
+                doc_id, node, parent_id=None, node_id=node.get("node_id") or self._fallback_node_id(None, k)
+            )
 
         self.session.commit()
 
-    def _save_node_recursive(self, doc_id: int, node_data: dict, parent_id: Optional[str]):
+    def _apply_tree_diff(self, doc_id: int, tree_data: dict) -> Dict[str, int]:
+        """
+        按 node_id 把新树与 page_indices 中的旧节点比对后写库：新节点插入，字段有变化的节点原地更新，
+        新树中已不存在的节点删除，未变节点不写库。返回 inserted/updated/deleted 计数。
+
+        上方章节增删导致行号平移的节点只改写 node_metadata 中的 line_num，摘要和 node_id 沿用旧树。
+        """
+        existing = {
+            row.node_id: row
+            for row in self.session.query(PageIndex).filter(PageIndex.document_id == doc_id).all()
+        }
+        counts = {"inserted": 0, "updated": 0, "deleted": 0}
+        seen = set()
+        now = datetime.utcnow()
+
+        def walk(nodes: List[dict], parent_id: Optional[str], level: int):
+            for k, node_data in enumerate(nodes, start=1):
+                node_id = node_data.get("node_id") or self._fallback_node_id(parent_id, k)
+                seen.add(node_id)
+                fields = self._node_fields(node_data, parent_id, level)
+                row = existing.get(node_id)
+                if row is None:
+                    row = PageIndex(document_id=doc_id, node_id=node_id, created_at=now, updated_at=now, **fields)
+                    self.session.add(row)
+                    counts["inserted"] += 1
+                else:
+                    changed = {key: value for key, value in fields.items() if getattr(row, key) != value}
+                    if changed:
+                        for key, value in changed.items():
+                            setattr(row, key, value)
+                        row.updated_at = now
+                        counts["updated"] += 1
+                walk(node_data.get("nodes") or node_data.get("children", []), node_id, level + 1)
+
+        walk(self._root_nodes(tree_data), None, 0)
+
+        for node_id, row in existing.items():
+            if node_id not in seen:
+                self.session.delete(row)
+                counts["deleted"] += 1
+
+        self.session.commit()
+        return counts
+
+    def _node_fields(self, node_data: dict, parent_id: Optional[str], level: int) -> Dict[str, Any]:
+        """
+        PageIndex 节点字典对应的 page_indices 字段
+
+        PageIndex 的节点字段为 nodes/start_index/end_index/text（Markdown 为 line_num），
+        层级按树深度计算。
+        """
+        metadata = {
+            key: node_data[key]
+            for key in ("line_num", "prefix_summary", "text_hash")
+            if node_data.get(key) is not None
+        }
+        metadata.update(node_data.get("metadata", {}))
+        if self._lazy_summaries and not node_data.get("summary"):
+            metadata["summary_pending"] = True
+        return {
+            "parent_id": parent_id,
+            "level": level,
+            "title": node_data.get("title", ""),
+            "summary": node_data.get("summary"),
+            "page_start": node_data.get("start_index", node_data.get("page_start")),
+            "page_end": node_data.get("end_index", node_data.get("page_end")),
+            "content": node_data.get("text", node_data.get("content")),
+            "token_count": node_data.get("token_count"),
+            "node_metadata": json.dumps(metadata, ensure_ascii=False),
+        }
+
+    def _save_node_recursive(
+        self,
+        doc_id: int,
+        node_data: dict,
+        parent_id: Optional[str],
+        level: int = 0,
+        node_id: Optional[str] = None,
+    ):
         """递归保存节点"""
+        node_id = node_id or node_data.get("node_id", "")
         node = PageIndex(
             document_id=doc_id,
-            node_id=node_data.get("node_id", ""),
-            parent_id=parent_id,
-            level=node_data.get("level", 0),
-            title=node_data.get("title", ""),
-            summary=node_data.get("summary"),
-            page_start=node_data.get("page_start"),
-            page_end=node_data.get("page_end"),
-            content=node_data.get("content"),
-            token_count=node_data.get("token_count"),
-            node_metadata=json.dumps(node_data.get("metadata", {})),
+            node_id=node_id,
+            **self._node_fields(node_data, parent_id, level),
             created_at=datetime.utcnow(),
             updated_at=datetime.utcnow(),
         )
@@ -163,7 +369,133 @@ class IndexEngine:
         self.session.flush()  # 获取 node.id
 
         # 递归保存子节点
-        children = node_data.get("children", [])
-        for child_data in children:
-            self._save_node_recursive(doc_id, child_data, parent_id=node.node_id)
-
+        children = node_data.get("nodes") or node_data.get("children", [])
+        for k, child_data in enumerate(children, start=1):
+            self._save_node_recursive(
+                doc_id,
+                child_data,
+                parent_id=node.node_id,
+                level=level + 1,
+                node_id=child_data.get("node_id") or self._fallback_node_id(node.node_id, k),
+            )
+
+
+class ProgressWriter:
+    """
+    page_index_main 的进度回调，把中间结果写入 page_indices
+
+    - tree：post_processing 产出顶层节点后立即入库，文档状态置为 partially_indexed
+    - split：大节点拆分完成后追加其子树，并更新父节点的结束页
+    - structure：节点 ID 分配完成后按最终 ID 重写整棵树
+    - summary：节点摘要生成后回填
+
+    回调在事件循环线程中只读取节点、生成要写的行，写库操作放入队列，由后台线程用独立会话
+    依次执行（每次取出队列中的全部操作后提交一次），不阻塞事件循环。
+    结构阶段之前节点还没有 ID，使用按树路径生成的临时 ID（p0001、p0001.02 ...）。
+    写库失败只打印日志，不影响索引本身，最终结果仍由 _save_tree_data 完整写入。
+    只用于还没有索引的文档，"replace" 会删除文档已有的全部节点。
+    """
+
+    def __init__(self, engine: IndexEngine, doc_id: int):
+        self.engine = engine
+        self.doc_id = doc_id
+        # 是否已写入过节点（索引失败时据此清理不完整的树）
+        self.wrote = False
+        self.session = sessionmaker(bind=engine.session.get_bind(), expire_on_commit=False)()
+        self.node_ids: Dict[int, str] = {}
+        self.node_levels: Dict[str, int] = {}
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"progress-writer-{doc_id}", daemon=True)
+        self._thread.start()
+
+    def __call__(self, event: str, payload: Any):
+        if event == "tree":
+            self.node_ids.clear()
+            self._queue.put(("replace", self._rows(payload, None, 0), "partially_indexed"))
+        elif event == "split":
+            parent_id = self.node_ids.get(id(payload))
+            if parent_id is not None:
+                rows = self._rows(payload.get("nodes", []), parent_id, self.node_levels[parent_id] + 1)
+                self._queue.put(("split", parent_id, payload.get("end_index"), rows))
+        elif event == "structure":
+            self.node_ids.clear()
+            self._queue.put(("replace", self._rows(self.engine._root_nodes(payload), None, 0, final_ids=True), None))
+        elif event == "summary":
+            node_id = self.node_ids.get(id(payload))
+            if node_id is not None:
+                self._queue.put(("summary", node_id, payload.get("summary")))
+
+    def close(self):
+        """等待队列中的写库操作全部完成并关闭会话（阻塞，在线程中调用）"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _rows(
+        self, nodes: List[dict], parent_id: Optional[str], level: int, final_ids: bool = False
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """节点及其子树对应的 (node_id, 字段) 行，同时记录节点字典到 node_id 的映射"""
+        rows = []
+        for k, node in enumerate(nodes, start=1):
+            node_id = (final_ids and node.get("node_id")) or self.engine._fallback_node_id(parent_id, k)
+            self.node_ids[id(node)] = node_id
+            self.node_levels[node_id] = level
+            rows.append((node_id, self.engine._node_fields(node, parent_id, level)))
+            rows.extend(self._rows(node.get("nodes") or [], node_id, level + 1, final_ids))
+        return rows
+
+    def _run(self):
+        done = False
+        while not done:
+            ops = [self._queue.get()]
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in ops
+            ops = [op for op in ops if op is not None]
+            try:
+                for op in ops:
+                    self._apply(op)
+                self.session.commit()
+            except Exception as e:
+                self.session.rollback()
+                print(f"渐进入库失败（{', '.join(op[0] for op in ops)}）: {e}")
+        self.session.close()
+
+    def _apply(self, op: tuple):
+        now = datetime.utcnow()
+        kind = op[0]
+        if kind == "replace":
+            _, rows, status = op
+            self.session.query(PageIndex).filter(PageIndex.document_id == self.doc_id).delete()
+            self._add_rows(rows, now)
+            if status:
+                DocumentManager(self.session).update_document_status(self.doc_id, status)
+        elif kind == "split":
+            _, parent_id, end_index, rows = op
+            parent = (
+                self.session.query(PageIndex)
+                .filter(PageIndex.document_id == self.doc_id, PageIndex.node_id == parent_id)
+                .first()
+            )
+            if parent is None:
+                return
+            parent.page_end = end_index
+            parent.updated_at = now
+            self.session.query(PageIndex).filter(
+                PageIndex.document_id == self.doc_id, PageIndex.node_id.like(f"{parent_id}.%")
+            ).delete(synchronize_session=False)
+            self._add_rows(rows, now)
+        elif kind == "summary":
+            _, node_id, summary = op
+            self.session.query(PageIndex).filter(
+                PageIndex.document_id == self.doc_id, PageIndex.node_id == node_id
+            ).update({"summary": summary, "updated_at": now}, synchronize_session=False)
+
+    def _add_rows(self, rows: List[Tuple[str, Dict[str, Any]]], now: datetime):
+        self.session.add_all(
+            PageIndex(document_id=self.doc_id, node_id=node_id, created_at=now, updated_at=now, **fields)
+            for node_id, fields in rows
+        )
+        self.wrote = True
@@ -0,0 +1,193 @@
+"""延迟摘要（检索时按需生成节点摘要）"""
+
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src.adapters.langchain_adapter import get_pageindex_adapter
+from src.config.prompts import PromptTemplates
+from src.config.settings import get_settings
+from src.storage.models import PageIndex
+from src.utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# 单个节点送入摘要的最大字符数，大范围父节点只取开头部分（含子章节标题）
+LAZY_SUMMARY_MAX_CHARS = 48000
+
+
+def is_summary_pending(node: PageIndex) -> bool:
+    """节点是否标记为 summary_pending（延迟摘要模式入库、尚未生成摘要）"""
+    if node.summary or not node.node_metadata:
+        return False
+    try:
+        return bool(json.loads(node.node_metadata).get("summary_pending"))
+    except (TypeError, ValueError):
+        return False
+
+
+class LazySummaryService:
+    """
+    延迟摘要服务
+
+    延迟摘要模式下索引只保存树结构和页码范围，节点标记 summary_pending。
+    TreeSearchEngine 和 Agent 工具首次访问节点时调用 ensure_summaries 生成摘要并回写 page_indices；
+    同一节点的并发请求合并为一次 LLM 调用。可选的后台补齐逐个处理剩余节点，
+    有前台请求在等待时让出。
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.settings = get_settings()
+        self.adapter = get_pageindex_adapter()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lazy-summary")
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[int, str], Future] = {}
+        self._foreground = 0
+        self._backfills: Dict[int, threading.Thread] = {}
+
+    def ensure_summaries(self, session: Session, nodes: List[PageIndex]) -> List[PageIndex]:
+        """为 summary_pending 的节点生成摘要（已在生成中的节点等待同一结果），返回原节点列表"""
+        pending = [node for node in nodes if is_summary_pending(node)]
+        if not pending:
+            return nodes
+
+        with self._lock:
+            self._foreground += 1
+        try:
+            futures = [(node, self._submit(node.document_id, node.node_id)) for node in pending]
+            for node, future in futures:
+                try:
+                    summary, metadata = future.result()
+                except Exception as e:
+                    logger.warning(f"节点摘要生成失败 {node.document_id}/{node.node_id}: {e}")
+                    continue
+                # 结果已由生成线程写库，这里只同步会话中的对象，不产生重复写入
+                set_committed_value(node, "summary", summary)
+                set_committed_value(node, "node_metadata", metadata)
+        finally:
+            with self._lock:
+                self._foreground -= 1
+        return nodes
+
+    def _submit(self, doc_id: int, node_id: str) -> Future:
+        key = (doc_id, node_id)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(self._generate, doc_id, node_id)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+            return future
+
+    def _forget(self, key: Tuple[int, str]):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def _generate(self, doc_id: int, node_id: str) -> Tuple[str, str]:
+        """生成并回写一个节点的摘要，返回 (summary, node_metadata)"""
+        from src.storage.database import get_session
+
+        with get_session() as session:
+            node = (
+                session.query(PageIndex)
+                .filter(PageIndex.document_id == doc_id, PageIndex.node_id == node_id)
+                .first()
+            )
+            if node is None:
+                raise ValueError(f"节点不存在: {doc_id}/{node_id}")
+            # 其他请求或后台补齐可能已经写入
+            if not is_summary_pending(node):
+                return node.summary, node.node_metadata
+
+            text = self._get_node_text(session, node)
+            prompt = PromptTemplates.get_indexing_prompt("node_summary").format(content=text[:LAZY_SUMMARY_MAX_CHARS])
+            summary = self.adapter.call_llm(self.settings.deepseek_model, prompt)
+
+            metadata = json.loads(node.node_metadata or "{}")
+            metadata.pop("summary_pending", None)
+            node.summary = summary
+            node.node_metadata = json.dumps(metadata, ensure_ascii=False)
+            node.updated_at = datetime.utcnow()
+            return node.summary, node.node_metadata
+
+    @staticmethod
+    def _get_node_text(session: Session, node: PageIndex) -> str:
+        """节点文本：优先使用入库的 content，PDF 节点按页码范围从原文件读取"""
+        if node.content:
+            return node.content
+
+        from src.core.document_manager import DocumentManager
+
+        file_path = DocumentManager(session).get_document_file_path(node.document_id)
+        if file_path is None or node.page_start is None:
+            return node.title
+
+        import pymupdf
+
+        with pymupdf.open(str(file_path)) as pdf:
+            end = min(node.page_end or node.page_start, pdf.page_count)
+            text = []
+            size = 0
+            for page_num in range(node.page_start - 1, end):
+                page_text = pdf[page_num].get_text()
+                text.append(page_text)
+                size += len(page_text)
+                if size >= LAZY_SUMMARY_MAX_CHARS:
+                    break
+        return "".join(text) or node.title
+
+    def start_backfill(self, doc_id: int) -> bool:
+        """启动文档的后台摘要补齐，已在运行时返回 False"""
+        with self._lock:
+            thread = self._backfills.get(doc_id)
+            if thread is not None and thread.is_alive():
+                return False
+            thread = threading.Thread(target=self._backfill, args=(doc_id,), name=f"summary-backfill-{doc_id}", daemon=True)
+            self._backfills[doc_id] = thread
+        thread.start()
+        return True
+
+    def _backfill(self, doc_id: int):
+        """逐个补齐 summary_pending 节点，前台有请求在等待时暂停"""
+        from src.storage.database import get_session
+
+        interval = float(self.settings.summary_backfill_interval)
+        with get_session() as session:
+            nodes = (
+                session.query(PageIndex)
+                .filter(PageIndex.document_id == doc_id, PageIndex.summary.is_(None))
+                .order_by(PageIndex.level, PageIndex.node_id)
+                .all()
+            )
+            node_ids = [node.node_id for node in nodes if is_summary_pending(node)]
+
+        logger.info(f"文档 {doc_id} 后台补齐摘要：{len(node_ids)} 个节点")
+        for node_id in node_ids:
+            while self._foreground > 0:
+                time.sleep(interval)
+            try:
+                self._submit(doc_id, node_id).result()
+            except Exception as e:
+                logger.warning(f"后台补齐摘要失败 {doc_id}/{node_id}: {e}")
+            time.sleep(interval)
+
+        with self._lock:
+            self._backfills.pop(doc_id, None)
+
+
+# 全局延迟摘要服务实例
+_lazy_summary_service: Optional[LazySummaryService] = None
+
+
+def get_lazy_summary_service() -> LazySummaryService:
+    """获取延迟摘要服务单例"""
+    global _lazy_summary_service
+    if _lazy_summary_service is None:
+        _lazy_summary_service = LazySummaryService()
+    return _lazy_summary_service
@@ -64,6 +64,8 @@ class RetrievalEngine:
         if not node:
             return None
 
+        self.tree_search.lazy_summaries.ensure_summaries(self.session, [node])
+
         return {
             "node_id": node.node_id,
             "title": node.title,
@@ -85,6 +87,8 @@ class RetrievalEngine:
             .order_by(PageIndex.level, PageIndex.node_id)
             .all()
         )
+        # 子节点按文档中的位置排列，增量重建索引后新增章节的 node_id 不代表顺序
+        nodes = self.tree_search._document_order(nodes)
 
         # 构建树状结构
         node_map = {node.node_id: node.to_dict() for node in nodes}
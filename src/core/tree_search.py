@@ -1,5 +1,6 @@
 """树搜索工具"""
 
+import json
 import re
 from typing import List, Optional
 
@@ -8,6 +9,7 @@ from sqlalchemy.orm import Session
 from src.adapters.langchain_adapter import LangChainPageIndexAdapter
 from src.config.prompts import PromptTemplates
 from src.config.settings import get_settings
+from src.core.lazy_summary import get_lazy_summary_service
 from src.storage.models import PageIndex
 
 
@@ -18,6 +20,27 @@ class TreeSearchEngine:
         self.session = session
         self.settings = get_settings()
         self.adapter = LangChainPageIndexAdapter()
+        self.lazy_summaries = get_lazy_summary_service()
+
+    def _visit(self, nodes: List[PageIndex]) -> List[PageIndex]:
+        """返回给调用方的节点视为已访问，补齐延迟摘要模式下尚未生成的摘要"""
+        return self.lazy_summaries.ensure_summaries(self.session, nodes)
+
+    @staticmethod
+    def _document_order(nodes: List[PageIndex]) -> List[PageIndex]:
+        """
+        按文档中的位置排序兄弟节点：Markdown 增量重建索引后新增章节的 node_id 排在已有节点之后，
+        不再代表顺序，有 line_num 的节点按 line_num 排序
+        """
+
+        def key(node: PageIndex):
+            try:
+                line_num = json.loads(node.node_metadata or "{}").get("line_num")
+            except (TypeError, ValueError):
+                line_num = None
+            return (line_num is None, line_num or 0, node.node_id)
+
+        return sorted(nodes, key=key)
 
     def search_by_keywords(
         self, query: str, doc_ids: Optional[List[int]] = None, top_k: int = 5
@@ -41,7 +64,7 @@ class TreeSearchEngine:
             node.relevance_score = self._calculate_keyword_relevance(query, node)
 
         nodes.sort(key=lambda n: (-n.relevance_score, n.level))
-        return nodes[:top_k]
+        return self._visit(nodes[:top_k])
 
     def search_by_llm(
         self, query: str, doc_ids: Optional[List[int]] = None, top_k: int = 5
@@ -59,7 +82,7 @@ class TreeSearchEngine:
         if not all_nodes:
             return []
 
-        # 使用 LLM 评估相关性
+        # 使用 LLM 评估相关性（摘要未生成的节点只按标题评估，不在这里触发摘要生成）
         scored_nodes = []
         for node in all_nodes:
             score = self._calculate_relevance(query, node)
@@ -69,7 +92,7 @@ class TreeSearchEngine:
 
         # 按相关性排序并返回 top_k
         scored_nodes.sort(key=lambda n: n.relevance_score, reverse=True)
-        return scored_nodes[:top_k]
+        return self._visit(scored_nodes[:top_k])
 
     def _calculate_relevance(self, query: str, node: PageIndex) -> float:
         """计算查询与节点的相关性分数"""
@@ -139,12 +162,13 @@ class TreeSearchEngine:
 
     def get_node_children(self, node_id: str) -> List[PageIndex]:
         """获取子节点"""
-        return (
+        children = (
             self.session.query(PageIndex)
             .filter(PageIndex.parent_id == node_id)
             .order_by(PageIndex.node_id)
             .all()
         )
+        return self._visit(self._document_order(children))
 
     def get_node_siblings(self, node_id: str) -> List[PageIndex]:
         """获取兄弟节点"""
@@ -152,9 +176,10 @@ class TreeSearchEngine:
         if not node or not node.parent_id:
             return []
 
-        return (
+        siblings = (
             self.session.query(PageIndex)
             .filter(PageIndex.parent_id == node.parent_id, PageIndex.node_id != node_id)
             .order_by(PageIndex.node_id)
             .all()
         )
+        return self._visit(self._document_order(siblings))
@@ -35,7 +35,7 @@ class Document(Base):
     doc_type = Column(String(50), nullable=False)  # pdf, markdown, txt
     title = Column(String(500))
     description = Column(Text)
-    status = Column(String(50), default="pending")  # pending, indexing, indexed, failed
+    status = Column(String(50), default="pending")  # pending, indexing, partially_indexed, indexed, failed
     indexed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
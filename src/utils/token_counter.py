@@ -1,23 +1,25 @@
 """Token 计数工具"""
 
-import tiktoken
+from typing import Optional
+
+from pageindex.utils import count_tokens, get_tokenizer
+from src.config.settings import get_settings
 
 
 class TokenCounter:
     """Token 计数器"""
 
-    def __init__(self, encoding_name: str = "cl100k_base"):
+    def __init__(self, model: Optional[str] = None):
         """
         初始化 Token 计数器
 
         Args:
-            encoding_name: tiktoken 编码名称，默认为 cl100k_base（GPT-4）
+            model: 模型名称，用于选择对应的 tokenizer（如 deepseek-chat），
+                为空时使用 cl100k_base
         """
-        try:
-            self.encoding = tiktoken.get_encoding(encoding_name)
-        except Exception:
-            # 如果无法加载指定编码，使用默认编码
-            self.encoding = tiktoken.encoding_for_model("gpt-4")
+        self.model = model
+        # 与 PageIndex 共享同一个 tokenizer 注册表，按模型选择分词器，避免重复加载
+        self.tokenizer = get_tokenizer(model)
 
     def count_tokens(self, text: str) -> int:
         """
@@ -30,8 +32,7 @@ class TokenCounter:
             token 数量
         """
         try:
-            tokens = self.encoding.encode(text)
-            return len(tokens)
+            return count_tokens(text, model=self.model)
         except Exception:
             # 如果编码失败，使用近似估算（1 token ≈ 4 字符）
             return len(text) // 4
@@ -75,12 +76,8 @@ class TokenCounter:
             截断后的文本
         """
         try:
-            tokens = self.encoding.encode(text)
-            if len(tokens) <= max_tokens:
-                return text
-
-            truncated_tokens = tokens[:max_tokens]
-            return self.encoding.decode(truncated_tokens)
+            # 各 tokenizer 自行截断：可编码的按 token 截断，估算型按比例截断字符
+            return self.tokenizer.truncate(text, max_tokens)
         except Exception:
             # 如果编码失败，按字符数截断
             max_chars = max_tokens * 4
@@ -111,8 +108,8 @@ _token_counter = None
 
 
 def get_token_counter() -> TokenCounter:
-    """获取 Token 计数器单例"""
+    """获取 Token 计数器单例（按配置的 DeepSeek 模型计数）"""
     global _token_counter
     if _token_counter is None:
-        _token_counter = TokenCounter()
+        _token_counter = TokenCounter(model=get_settings().deepseek_model)
     return _token_counter
@@ -0,0 +1,53 @@
+"""启动预热"""
+
+import time
+from typing import Dict
+
+
+def warm_up_components() -> Dict[str, float]:
+    """
+    预热 tokenizer、PageIndex 配置和提示词模板
+
+    Returns:
+        各项预热耗时（秒），失败的项记录为 -1
+    """
+    timings = {}
+
+    def run(name, func):
+        start = time.perf_counter()
+        try:
+            func()
+            timings[name] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            print(f"预热 {name} 失败: {e}")
+            timings[name] = -1
+
+    def load_pageindex():
+        # 首次导入会加载 PyPDF2 / pymupdf / openai，耗时较长
+        import pageindex.page_index  # noqa: F401
+        import pageindex.page_index_md  # noqa: F401
+
+    def load_tokenizer():
+        from pageindex.utils import warm_up_tokenizer
+        from src.config.settings import get_settings
+        from src.utils.token_counter import get_token_counter
+
+        warm_up_tokenizer(get_settings().deepseek_model)
+        get_token_counter()
+
+    def load_config():
+        from pageindex.utils import ConfigLoader
+
+        ConfigLoader().load()
+
+    def load_prompts():
+        from src.config.prompts import PromptTemplates
+
+        PromptTemplates.get_retrieval_prompt("system")
+        PromptTemplates.get_indexing_prompt("node_summary")
+
+    run("pageindex", load_pageindex)
+    run("tokenizer", load_tokenizer)
+    run("config", load_config)
+    run("prompts", load_prompts)
+    return timings